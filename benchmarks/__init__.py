@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for the chat apps and their shared components.
+"""
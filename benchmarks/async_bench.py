@@ -0,0 +1,111 @@
+"""
+Memory and time of many concurrent requests: threads versus asyncio.
+
+Starts the mock completion server in its own process, then sends N
+concurrent chat completions from a fresh interpreter per mode: one thread
+per request with the sync client, or one coroutine per request with the
+async client on the background loop of :mod:`src.async_bridge`. Each mode
+reports the wall time and how much its peak resident memory grew while
+the requests were in flight.
+
+Usage:
+    python -m benchmarks.async_bench --requests 1000 --latency 1.0
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_server import server_process
+
+MODES = ("threads", "asyncio")
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker(mode: str, requests: int, base_url: str) -> dict:
+    """
+    Send the requests concurrently in this process.
+
+    Args:
+        mode: "threads" or "asyncio"
+        requests: Number of concurrent requests
+        base_url: Mock server base URL
+
+    Returns:
+        Wall seconds and peak memory growth in MiB
+    """
+    from openai import AsyncOpenAI, OpenAI
+    from src.async_bridge import run_async
+
+    messages = [{"role": "user", "content": "Hello"}]
+    if mode == "threads":
+        client = OpenAI(api_key="sk-bench", base_url=base_url, max_retries=0)
+
+        def send(_):
+            return client.chat.completions.create(
+                model="gpt-3.5-turbo", messages=messages, max_tokens=50
+            )
+
+        def run():
+            with ThreadPoolExecutor(max_workers=requests) as executor:
+                return list(executor.map(send, range(requests)))
+    else:
+        client = AsyncOpenAI(api_key="sk-bench", base_url=base_url, max_retries=0)
+
+        async def fan_out():
+            return await asyncio.gather(*(
+                client.chat.completions.create(
+                    model="gpt-3.5-turbo", messages=messages, max_tokens=50
+                )
+                for _ in range(requests)
+            ))
+
+        def run():
+            return run_async(fan_out())
+
+    baseline = _peak_rss_mib()
+    started = time.perf_counter()
+    responses = run()
+    seconds = time.perf_counter() - started
+    assert len(responses) == requests
+    return {"seconds": seconds, "rss_mib": _peak_rss_mib() - baseline}
+
+
+def main() -> None:
+    """Compare both modes against a mock server in a separate process."""
+    parser = argparse.ArgumentParser(description="Threads versus asyncio requests")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=1.0,
+                        help="Mock server response latency in seconds")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.requests, args.base_url)))
+        return
+
+    with server_process("--latency", str(args.latency)) as base_url:
+        print(f"{args.requests} concurrent requests, {args.latency:.1f}s latency")
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.async_bench", "--worker", mode,
+                 "--requests", str(args.requests), "--base-url", base_url],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:<8} {result['seconds']:6.2f} s   "
+                  f"+{result['rss_mib']:6.1f} MiB peak memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Append, reopen, search and resume times of the conversation journal.
+
+Fills a journal in a temporary directory with synthetic conversations
+whose words follow a Zipf-like distribution, like natural text: a few
+words appear in most messages and most words are rare. It then reports
+the append rate, the time to reopen the journal, search latency for
+rare, common and multi-word queries, and the time to resume one
+conversation.
+
+Usage:
+    python -m benchmarks.journal_bench --messages 1000000
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+from src.journal import ConversationJournal
+
+VOCABULARY = 50_000
+WORDS_PER_MESSAGE = 20
+MESSAGES_PER_CONVERSATION = 40
+
+
+def make_words(rng: random.Random, count: int) -> List[str]:
+    """Draw words with Zipf-like frequencies."""
+    weights = [1 / rank for rank in range(1, VOCABULARY + 1)]
+    return [f"w{rank}" for rank in rng.choices(range(VOCABULARY), weights, k=count)]
+
+
+def timed(action: Callable[[], object], repeats: int) -> List[float]:
+    """Run an action repeatedly and return the durations in seconds."""
+    durations = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        action()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def report(label: str, durations: List[float]) -> None:
+    """Print the median and p95 of durations in milliseconds."""
+    durations = sorted(durations)
+    p95 = durations[int(0.95 * (len(durations) - 1))]
+    print(f"{label:<28} p50 {statistics.median(durations) * 1e3:8.2f} ms"
+          f"   p95 {p95 * 1e3:8.2f} ms")
+
+
+def main() -> None:
+    """Fill a journal and time the operations the chat apps use."""
+    parser = argparse.ArgumentParser(description="Conversation journal benchmark")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_words(rng, args.messages * WORDS_PER_MESSAGE)
+    conversations = max(1, args.messages // MESSAGES_PER_CONVERSATION)
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = ConversationJournal(directory)
+        started = time.perf_counter()
+        for i in range(args.messages):
+            text = " ".join(words[i * WORDS_PER_MESSAGE:(i + 1) * WORDS_PER_MESSAGE])
+            journal.append(f"conversation-{rng.randrange(conversations)}",
+                           {"role": "user", "content": text})
+        elapsed = time.perf_counter() - started
+        journal.close()
+        print(f"{args.messages:,} messages appended in {elapsed:.1f} s "
+              f"({args.messages / elapsed:,.0f}/s, {journal.syncs} fsyncs)")
+
+        started = time.perf_counter()
+        journal = ConversationJournal(directory)
+        print(f"reopened {len(journal._segments)} segments in "
+              f"{time.perf_counter() - started:.2f} s")
+
+        queries = {
+            "rare word": lambda: journal.search(f"w{rng.randrange(20_000, 50_000)}"),
+            "common word": lambda: journal.search(f"w{rng.randrange(10)}"),
+            "two words": lambda: journal.search(
+                f"w{rng.randrange(100)} w{rng.randrange(100, 5000)}"
+            ),
+            "resume conversation": lambda: journal.load_messages(
+                f"conversation-{rng.randrange(conversations)}"
+            ),
+        }
+        for label, action in queries.items():
+            report(label, timed(action, args.queries))
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Concurrent-session load test for the Streamlit chat apps.
+
+Drives N simultaneous sessions of an app through Streamlit's headless
+``AppTest`` API, all inside this one process, with the OpenAI client
+pointed at the mock completion server running in a separate process (or
+replaying a recorded fixture with ``--replay``). Each session sends a
+scripted multi-turn conversation. For every concurrency level the report
+shows per-rerun latency percentiles, the memory each session costs and
+two CPU figures per session:
+
+- ``script cpu``: CPU time of the script threads running the app's
+  reruns (``time.thread_time``), i.e. what a server spends on the app;
+- ``proc cpu``: CPU time of this whole process, which also includes the
+  AppTest harness and any threads the app starts (the mock server's CPU
+  is excluded since it runs in its own process).
+
+A turn counts as an error when the rerun raised or the app answered with
+an error or quota message instead of a reply. It also shows the largest
+level that stays within the p95 latency target without errors.
+
+Usage:
+    python -m benchmarks.load_test --app chatgpt_clone.py --levels 1,5,10,20
+"""
+
+import argparse
+import gc
+import os
+import resource
+import statistics
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import List
+from unittest.mock import MagicMock, patch
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import (
+    MemoryCacheStorageManager,
+)
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.scriptrunner.script_runner import ScriptRunner
+from streamlit.proto.ChatInput_pb2 import ChatInput as ChatInputProto
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.element_tree import ChatInput
+
+from benchmarks.mock_server import server_process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = [
+    "Hello! Can you help me plan a trip?",
+    "I want to visit Japan in spring. What should I see?",
+    "How many days do I need for Tokyo and Kyoto?",
+    "Write a short packing list.",
+    "Thanks, summarize everything in three bullet points.",
+]
+
+# Replies the apps show instead of an answer when a request fails
+ERROR_REPLIES = (
+    "I'm sorry, I encountered an error",
+    "Sorry, I encountered an error",
+    "Please configure your OpenAI API key",
+    "⏳",
+)
+
+
+def rss_bytes() -> int:
+    """Return the current resident set size of this process."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is a peak (KiB on Linux, bytes on macOS) but close enough
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _chat_input_state(chat_input: ChatInput) -> WidgetState:
+    """Widget state for a chat input, shaped like the browser sends it."""
+    state = WidgetState(id=chat_input.id)
+    value = chat_input._value  # pylint: disable=protected-access
+    if value is not None:
+        if chat_input.proto.accept_file == ChatInputProto.AcceptFile.NONE:
+            state.string_trigger_value.data = value
+        else:
+            # File-accepting inputs expect text and files together
+            state.chat_input_value.data = value
+    return state
+
+
+@contextmanager
+def chat_input_files():
+    """
+    Let AppTest submit text to chat inputs created with ``accept_file``.
+
+    AppTest always sends chat input text as a plain string trigger, which
+    a file-accepting chat input cannot read.
+    """
+    with patch.object(ChatInput, "_widget_state", property(_chat_input_state)):
+        yield
+
+
+@contextmanager
+def shared_runtime():
+    """
+    Give all AppTest sessions one runtime, like sessions of a real server.
+
+    AppTest installs and removes a process-global mock Runtime around every
+    run, so concurrent runs tear each other's runtime down. Pinning a single
+    runtime also shares ``st.cache_data`` storage and the compiled script
+    between sessions, which is what happens inside one server process.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    script_cache = ScriptCache()
+    with patch.object(Runtime, "instance", classmethod(lambda cls: runtime)), \
+            patch.object(Runtime, "exists", classmethod(lambda cls: True)), \
+            patch("streamlit.testing.v1.app_test.ScriptCache", lambda: script_cache), \
+            patch("streamlit.testing.v1.local_script_runner.ScriptCache",
+                  lambda: script_cache), \
+            chat_input_files():
+        yield runtime
+
+
+class ScriptCpu:
+    """CPU seconds spent in script threads running reruns."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        """Add the CPU time of one rerun."""
+        with self._lock:
+            self.seconds += seconds
+
+
+@contextmanager
+def script_cpu():
+    """
+    Measure the CPU time of every script rerun in this process.
+
+    Yields:
+        A :class:`ScriptCpu` accumulating per-thread CPU time of the reruns
+    """
+    total = ScriptCpu()
+    original = ScriptRunner._run_script  # pylint: disable=protected-access
+
+    def timed(runner, rerun_data):
+        started = time.thread_time()
+        try:
+            return original(runner, rerun_data)
+        finally:
+            total.add(time.thread_time() - started)
+
+    with patch.object(ScriptRunner, "_run_script", timed):
+        yield total
+
+
+@contextmanager
+def mock_server_process(latency: float):
+    """
+    Run the mock completion server in a separate process.
+
+    Args:
+        latency: Response latency in seconds
+
+    Yields:
+        The server's base URL
+    """
+    with server_process("--latency", str(latency)) as base_url:
+        yield base_url
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, int(round(pct / 100 * len(ordered))) - 1)]
+
+
+@dataclass
+class LevelResult:
+    """Measurements for one concurrency level."""
+
+    sessions: int
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    wall_time: float = 0.0
+    script_cpu_per_session: float = 0.0
+    cpu_per_session: float = 0.0
+    memory_per_session: float = 0.0
+
+    def p(self, pct: float) -> float:
+        """Return a rerun latency percentile in seconds."""
+        return percentile(self.latencies, pct)
+
+
+def turn_failed(app: AppTest) -> bool:
+    """
+    Return whether the last turn failed instead of getting an answer.
+
+    Args:
+        app: The session, after sending a turn
+
+    Returns:
+        True if the rerun raised or did not end with a normal reply
+    """
+    if app.exception:
+        return True
+    try:
+        messages = app.session_state["messages"]
+    except KeyError:
+        return True
+    if not messages or messages[-1]["role"] != "assistant":
+        return True
+    return messages[-1]["content"].startswith(ERROR_REPLIES)
+
+
+def run_session(app_path: str, session_index: int, turns: int, timeout: float,
+                result: LevelResult, lock: threading.Lock, keep: list) -> None:
+    """
+    Run one scripted conversation.
+
+    Args:
+        app_path: Streamlit script to test
+        session_index: Used to make prompts unique across sessions
+        turns: Number of scripted turns to send
+        timeout: Per-rerun timeout in seconds
+        result: Shared result to record into
+        lock: Guards ``result``
+        keep: Keeps the AppTest alive so its session memory is measured
+    """
+    latencies = []
+    errors = 0
+    app = AppTest.from_file(app_path, default_timeout=timeout)
+    try:
+        started = time.perf_counter()
+        app.run()
+        latencies.append(time.perf_counter() - started)
+        for turn in range(turns):
+            prompt = f"{SCRIPT[turn % len(SCRIPT)]} (session {session_index})"
+            started = time.perf_counter()
+            app.chat_input[0].set_value(prompt).run()
+            latencies.append(time.perf_counter() - started)
+            errors += turn_failed(app)
+    except Exception:  # pylint: disable=broad-except
+        errors += 1
+    with lock:
+        result.latencies.extend(latencies)
+        result.errors += errors
+        keep.append(app)
+
+
+def run_level(app_path: str, sessions: int, turns: int, timeout: float) -> LevelResult:
+    """
+    Run ``sessions`` concurrent conversations and measure them.
+
+    Args:
+        app_path: Streamlit script to test
+        sessions: Number of concurrent sessions
+        turns: Turns per session
+        timeout: Per-rerun timeout in seconds
+
+    Returns:
+        The level's measurements
+    """
+    result = LevelResult(sessions)
+    lock = threading.Lock()
+    keep: list = []
+    gc.collect()
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+
+    threads = [
+        threading.Thread(
+            target=run_session,
+            args=(app_path, i, turns, timeout, result, lock, keep),
+        )
+        for i in range(sessions)
+    ]
+    with script_cpu() as script:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    result.wall_time = time.perf_counter() - started
+    result.script_cpu_per_session = script.seconds / sessions
+    result.cpu_per_session = (time.process_time() - cpu_before) / sessions
+    gc.collect()
+    result.memory_per_session = max(0, rss_bytes() - rss_before) / sessions
+    keep.clear()
+    return result
+
+
+def print_report(app_path: str, results: List[LevelResult], p95_target: float) -> None:
+    """Print a table of results and the estimated sessions per process."""
+    print(f"\nLoad test: {os.path.basename(app_path)}")
+    print("CPU per session: script = app reruns only; proc = whole process, "
+          "incl. the AppTest harness")
+    print(f"{'sessions':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8} "
+          f"{'script cpu ms':>13} {'proc cpu ms':>11} {'mem/sess KiB':>12} "
+          f"{'errors':>6}")
+    for r in results:
+        mean = statistics.mean(r.latencies) if r.latencies else 0.0
+        print(f"{r.sessions:>8} {r.p(50) * 1e3:>8.1f} {r.p(95) * 1e3:>8.1f} "
+              f"{r.p(99) * 1e3:>8.1f} {mean * 1e3:>8.1f} "
+              f"{r.script_cpu_per_session * 1e3:>13.1f} "
+              f"{r.cpu_per_session * 1e3:>11.1f} {r.memory_per_session / 1024:>12.1f} "
+              f"{r.errors:>6}")
+    within = [r.sessions for r in results if r.p(95) <= p95_target and not r.errors]
+    target = f"p95 <= {p95_target * 1e3:.0f} ms"
+    if within:
+        print(f"Sessions/process within {target}: {max(within)}")
+    else:
+        print(f"No level met {target}")
+
+
+def main() -> None:
+    """Parse arguments, start the mock server unless replaying, run each level."""
+    parser = argparse.ArgumentParser(description="Concurrent-session load test")
+    parser.add_argument("--app", default="chatgpt_clone.py",
+                        help="Streamlit script, relative to the project root")
+    parser.add_argument("--levels", default="1,5,10,20",
+                        help="Comma-separated concurrent session counts")
+    parser.add_argument("--turns", type=int, default=len(SCRIPT))
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Mock server response latency in seconds")
+    parser.add_argument("--p95-target", type=float, default=1.0,
+                        help="Rerun p95 latency target in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--replay", metavar="FIXTURE",
+                        help="Replay a recorded fixture instead of the mock server")
+    args = parser.parse_args()
+
+    app_path = os.path.join(ROOT, args.app)
+    levels = [int(level) for level in args.levels.split(",")]
+    server = nullcontext() if args.replay else mock_server_process(args.latency)
+    with server as base_url, shared_runtime():
+        os.environ["OPENAI_API_KEY"] = "sk-load-test"
+        if args.replay:
+            # Session prompts differ, so match recordings on the path only
+            os.environ["OPENAI_REPLAY_FIXTURE"] = args.replay
+            os.environ["OPENAI_REPLAY_MATCH"] = "path"
+        else:
+            os.environ["OPENAI_BASE_URL"] = base_url
+        # Warm up imports and the compiled script so level 1 isn't skewed
+        run_level(app_path, 1, 1, args.timeout)
+        results = [run_level(app_path, n, args.turns, args.timeout) for n in levels]
+    print_report(app_path, results, args.p95_target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Microbenchmarks for the chat apps' hot paths.
+
+Every benchmark is timed offline and compared against the per-call time
+stored in ``benchmarks/baselines.json``. A benchmark fails when it is more
+than ``BENCHMARK_TOLERANCE`` (default 0.5, i.e. 50%) slower than its
+baseline. Baselines are machine specific, so regenerate them on the
+machine that gates merges. Benchmarks registered with ``gate=False`` are
+only reported: their time is dominated by code outside this repo and
+varies too much between runs to fail a merge on.
+
+Usage:
+    python -m benchmarks.micro            # run and compare
+    python -m benchmarks.micro --update   # store new baselines
+    pytest -m benchmark --no-cov          # run as merge gate
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+from typing import Callable, Dict, Optional, Set
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines.json"
+)
+DEFAULT_TOLERANCE = 0.5
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+# Benchmarks reported but never failed on
+UNGATED: Set[str] = set()
+
+
+def benchmark(name: str, gate: bool = True):
+    """
+    Register a benchmark.
+
+    The decorated function does the setup and returns the callable to time.
+
+    Args:
+        name: Benchmark name used in the baselines file
+        gate: Fail on regressions; False only reports the timing
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        if not gate:
+            UNGATED.add(name)
+        return setup
+    return register
+
+
+def make_history(count: int, size: int = 400) -> list:
+    """Build a chat history of alternating user and assistant messages."""
+    body = ("Lorem ipsum dolor sit amet, **consectetur** adipiscing elit. " * 20)[:size]
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i}: {body}"}
+        for i in range(count)
+    ]
+
+
+@benchmark("build_chat_messages")
+def _build_chat_messages():
+    import chatgpt_clone
+    history = make_history(8)
+    return lambda: chatgpt_clone.build_chat_messages(history, "Next question")
+
+
+@benchmark("history_trimming")
+def _history_trimming():
+    import chatgpt_clone
+    history = make_history(10000)
+    return lambda: chatgpt_clone.build_chat_messages(history, "Next question")
+
+
+@benchmark("cache_key_hashing")
+def _cache_key_hashing():
+    from src.shared_state import make_cache_key
+    prompt = "Explain quantum computing in simple terms. " * 50
+    return lambda: make_cache_key("streamlit_app", prompt, 150, 1.0)
+
+
+@benchmark("shared_cache_lookup")
+def _shared_cache_lookup():
+    from src.shared_state import SharedStateStore, make_cache_key
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    store = SharedStateStore(path)
+    keys = [make_cache_key("bench", i) for i in range(1000)]
+    for key in keys:
+        store.cache_set(key, "cached response " * 20)
+    key = keys[500]
+    return lambda: store.cache_get(key)
+
+
+@benchmark("render_large_history")
+def _render_large_history():
+    import chatgpt_clone
+    history = make_history(200)
+    return lambda: chatgpt_clone.render_history(history)
+
+
+@benchmark("span_disabled")
+def _span_disabled():
+    from src import tracing
+
+    def traced_block():
+        with patch.object(tracing, "_tracer", None), \
+                patch.object(tracing, "_configured", True):
+            for _ in range(1000):
+                with tracing.span("render_history", messages=200):
+                    pass
+    return traced_block
+
+
+@benchmark("quota_admit")
+def _quota_admit():
+    from src.quotas import QuotaLimits, QuotaManager
+    manager = QuotaManager(QuotaLimits(10**9, 10**12), QuotaLimits(10**9, 10**12))
+    sessions = [f"session-{i}" for i in range(10000)]
+    for session in sessions:
+        manager.admit(session, 100, user="ip:" + session)
+
+    def admit_all():
+        # One request per session across 10,000 tracked sessions
+        for session in sessions[:1000]:
+            manager.admit(session, 100, user="ip:" + session)
+    return admit_all
+
+
+# Nearly all of it is OpenSSL loading the CA bundle from disk, which
+# swings by 50% between runs; kept to spot a client rebuilt per request
+@benchmark("openai_client_construction", gate=False)
+def _openai_client_construction():
+    from src.openai_example import get_openai_client
+
+    def construct():
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "sk-benchmark"}):
+            return get_openai_client()
+    return construct
+
+
+@benchmark("import_chatgpt_clone")
+def _import_chatgpt_clone():
+    # Time a fresh interpreter importing the app, minus interpreter startup
+    def run(code):
+        return subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+    def import_time():
+        startup = timeit.timeit(lambda: run("pass"), number=1)
+        total = timeit.timeit(lambda: run("import chatgpt_clone"), number=1)
+        return max(0.0, total - startup)
+    return import_time
+
+
+def measure(name: str, repeat: int = 5) -> float:
+    """
+    Time a benchmark.
+
+    Args:
+        name: Registered benchmark name
+        repeat: Number of timing rounds of at least 0.2 s each; the
+            fastest round is reported
+
+    Returns:
+        Seconds per call
+    """
+    func = BENCHMARKS[name]()
+    if name.startswith("import_"):
+        # The callable measures itself and returns seconds
+        return min(func() for _ in range(repeat))
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def load_baselines(path: str = BASELINE_PATH) -> Dict[str, float]:
+    """Load stored per-call baselines in seconds."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baselines(baselines: Dict[str, float], path: str = BASELINE_PATH) -> None:
+    """Store per-call baselines in seconds."""
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def tolerance() -> float:
+    """Return the allowed slowdown ratio from BENCHMARK_TOLERANCE."""
+    return float(os.getenv("BENCHMARK_TOLERANCE", DEFAULT_TOLERANCE))
+
+
+def check(name: str, measured: float, baselines: Dict[str, float]) -> Optional[str]:
+    """
+    Compare a measurement with its baseline.
+
+    Args:
+        name: Benchmark name
+        measured: Seconds per call
+        baselines: Stored baselines
+
+    Returns:
+        A failure message, or None if within tolerance (or no baseline,
+        or the benchmark is not gated)
+    """
+    baseline = baselines.get(name)
+    if baseline is None or name in UNGATED:
+        return None
+    limit = baseline * (1 + tolerance())
+    if measured > limit:
+        return (f"{name}: {measured * 1e6:.1f} us/call is "
+                f"{measured / baseline - 1:.0%} slower than baseline "
+                f"{baseline * 1e6:.1f} us (limit {limit * 1e6:.1f} us)")
+    return None
+
+
+def main() -> None:
+    """Run all benchmarks and compare or update baselines."""
+    parser = argparse.ArgumentParser(description="Hot path microbenchmarks")
+    parser.add_argument("--update", action="store_true", help="store new baselines")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default all)")
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    failures = []
+    for name in args.names or sorted(BENCHMARKS):
+        measured = measure(name)
+        baseline = baselines.get(name)
+        change = f"{measured / baseline - 1:+.0%}" if baseline else "new"
+        note = "  (not gated)" if name in UNGATED else ""
+        print(f"{name:<28} {measured * 1e6:>12.1f} us/call  {change}{note}")
+        if args.update:
+            baselines[name] = measured
+        else:
+            failure = check(name, measured, baselines)
+            if failure:
+                failures.append(failure)
+    if args.update:
+        save_baselines(baselines)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Local mock of the OpenAI chat completions endpoint.
+
+Serves ``POST /v1/chat/completions`` (plain and streamed) with canned
+answers and configurable latency, so the apps can be exercised through the
+real ``OpenAI`` client without network access or an API key. Point the
+client at it with ``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1``.
+
+Benchmarks that need the server in a separate process (so its CPU is
+not counted with theirs) start it with :func:`server_process`.
+
+Usage:
+    python -m benchmarks.mock_server --port 8765 --latency 0.2
+"""
+
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+DEFAULT_ANSWER = (
+    "This is a mock response from the local completion server. "
+    "It is long enough to exercise rendering and streaming paths."
+)
+
+
+class MockCompletionServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering chat completion requests."""
+
+    daemon_threads = True
+    # Accept bursts of concurrent connections (socketserver's default is 5)
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        chunk_delay: float = 0.0,
+        answer: str = DEFAULT_ANSWER,
+    ):
+        """
+        Create the server (call :meth:`start` to serve in the background).
+
+        Args:
+            port: Port to bind on 127.0.0.1, 0 picks a free one
+            latency: Seconds to wait before answering
+            chunk_delay: Seconds between streamed chunks
+            answer: Text returned for every request
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.answer = answer
+        self.requests = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to pass to the OpenAI client."""
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "MockCompletionServer":
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        server.requests += 1
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        time.sleep(server.latency)
+        words = server.answer.split(" ")
+        limit = body.get("max_tokens") or len(words)
+        # One word per "token" keeps finish_reason == "length" reachable
+        finish_reason = "length" if len(words) > limit else "stop"
+        words = words[:limit]
+        prompt_tokens = sum(
+            len(str(m.get("content", "")).split()) + 4 for m in body.get("messages", [])
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        if body.get("stream"):
+            self._stream(body, words, finish_reason, usage)
+        else:
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, body, words, finish_reason, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish=None, chunk_usage=None):
+            payload = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [] if chunk_usage else [
+                    {"index": 0, "delta": delta, "finish_reason": finish}
+                ],
+            }
+            if chunk_usage:
+                payload["usage"] = chunk_usage
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(words):
+                time.sleep(self.server.chunk_delay)
+                chunk({"content": word if i == 0 else " " + word})
+            chunk({}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk(None, chunk_usage=usage)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            self.close_connection = True
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def free_port() -> int:
+    """Return a local TCP port that is free right now."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    """
+    Wait until a local TCP port accepts connections.
+
+    Args:
+        port: Port to connect to
+        timeout: Seconds to wait
+
+    Raises:
+        OSError: If nothing listens on the port within ``timeout``
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@contextmanager
+def server_process(*options: str) -> Iterator[str]:
+    """
+    Run the mock server in a separate process.
+
+    Args:
+        *options: Command line options, e.g. ``"--latency", "0.2"``
+
+    Yields:
+        The server's base URL
+    """
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_server", "--port", str(port),
+         *options],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description="Mock OpenAI completion server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--answer-words", type=int,
+                        help="Answer with this many words instead of the default")
+    args = parser.parse_args()
+    answer = DEFAULT_ANSWER
+    if args.answer_words:
+        answer = " ".join(f"word{i}" for i in range(args.answer_words))
+    server = MockCompletionServer(args.port, args.latency, args.chunk_delay, answer)
+    print(f"Serving mock completions at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
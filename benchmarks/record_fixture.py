@@ -0,0 +1,83 @@
+"""
+Record chat completion exchanges to a replay fixture.
+
+Sends each prompt through the real ``OpenAI`` client with a
+:class:`~src.http_replay.RecordingTransport`, once as a plain request and
+once streamed, and appends both exchanges to the fixture. ``--mock``
+records against the local mock completion server instead of the API.
+
+Usage:
+    python -m benchmarks.record_fixture tests/fixtures/hello.jsonl "Hello!"
+    python -m benchmarks.record_fixture out.jsonl "Hi" --mock --chunk-delay 0.02
+"""
+
+import argparse
+import os
+from contextlib import nullcontext
+
+import httpx
+from openai import OpenAI
+
+from benchmarks.mock_server import MockCompletionServer
+from src.http_replay import RecordingTransport
+
+
+def record(client: OpenAI, prompts, model: str, max_tokens: int) -> None:
+    """
+    Send every prompt plainly and streamed.
+
+    Args:
+        client: Client whose HTTP client records
+        prompts: Prompts to send
+        model: Model name
+        max_tokens: max_tokens for each request
+    """
+    for prompt in prompts:
+        messages = [{"role": "user", "content": prompt}]
+        client.chat.completions.create(
+            model=model, messages=messages, max_tokens=max_tokens
+        )
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for _ in stream:
+            pass
+
+
+def main() -> None:
+    """Parse arguments and record the fixture."""
+    parser = argparse.ArgumentParser(description="Record a replay fixture")
+    parser.add_argument("fixture", help="JSON-lines file to append to")
+    parser.add_argument("prompts", nargs="+")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--max-tokens", type=int, default=150)
+    parser.add_argument("--mock", action="store_true",
+                        help="Record against the local mock server")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Mock server response latency in seconds")
+    parser.add_argument("--chunk-delay", type=float, default=0.02,
+                        help="Mock server delay between streamed chunks")
+    args = parser.parse_args()
+
+    server = (
+        MockCompletionServer(latency=args.latency, chunk_delay=args.chunk_delay)
+        if args.mock else nullcontext()
+    )
+    with server:
+        transport = RecordingTransport(args.fixture)
+        client = OpenAI(
+            api_key="sk-mock" if args.mock else os.environ["OPENAI_API_KEY"],
+            base_url=server.base_url if args.mock else None,
+            http_client=httpx.Client(transport=transport),
+        )
+        record(client, args.prompts, args.model, args.max_tokens)
+        transport.close()
+    print(f"Recorded {2 * len(args.prompts)} exchanges to {args.fixture}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Per-rerun cost of rendering a long chat history.
+
+Reruns a script that draws N past messages, through Streamlit's headless
+``AppTest`` runner, once with plain ``st.markdown`` and once with the
+render cache. For every rerun it reports the script time and the bytes of
+ForwardMsgs sent to the browser. Bytes take the browser's message cache
+into account: elements at least ``global.minCachedMessageSize`` large that
+the browser already holds are sent as a short hash reference.
+
+Usage:
+    python -m benchmarks.render_bench --messages 200 --reruns 5
+"""
+
+import argparse
+import statistics
+from typing import List
+from unittest.mock import patch
+
+from streamlit.runtime.forward_msg_cache import create_reference_msg
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from streamlit.testing.v1.util import patch_config_options
+
+
+def history_app(count: int, use_cache: bool) -> None:
+    """Streamlit script rendering a fixed chat history."""
+    import time
+    import streamlit as st
+    from src.render_cache import get_render_cache
+
+    if "messages" not in st.session_state:
+        body = "Here is a **detailed** answer with a list:\n\n" + "".join(
+            f"- point {i}: lorem ipsum dolor sit amet, consectetur adipiscing\n"
+            for i in range(20)
+        )
+        st.session_state.messages = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"#{i} {body}"}
+            for i in range(count)
+        ]
+    started = time.perf_counter()
+    cache = get_render_cache()
+    for message in st.session_state.messages:
+        if use_cache:
+            cache.render(st.chat_message(message["role"]), message)
+        else:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+    st.session_state.render_seconds = time.perf_counter() - started
+
+
+def run_mode(count: int, reruns: int, use_cache: bool, min_cached: int) -> List[tuple]:
+    """
+    Rerun the history script and measure each rerun.
+
+    Args:
+        count: Number of history messages
+        reruns: Number of reruns
+        use_cache: Render through the render cache instead of st.markdown
+        min_cached: Value for global.minCachedMessageSize
+
+    Returns:
+        (render seconds, bytes sent) per rerun
+    """
+    captured = []
+    original = LocalScriptRunner.forward_msgs
+
+    def capture(runner):
+        msgs = original(runner)
+        captured.append(list(msgs))
+        return msgs
+
+    browser_cache = set()
+    results = []
+    app = AppTest.from_function(
+        history_app, args=(count, use_cache), default_timeout=60
+    )
+    with patch.object(LocalScriptRunner, "forward_msgs", capture), \
+            patch_config_options({"global.minCachedMessageSize": min_cached}):
+        for _ in range(reruns):
+            captured.clear()
+            app.run()
+            sent = 0
+            for msg in captured[-1]:
+                if msg.metadata.cacheable and msg.hash in browser_cache:
+                    sent += create_reference_msg(msg).ByteSize()
+                else:
+                    sent += msg.ByteSize()
+                    if msg.metadata.cacheable:
+                        browser_cache.add(msg.hash)
+            results.append((app.session_state.render_seconds, sent))
+    return results
+
+
+def main() -> None:
+    """Compare rendering modes and print per-rerun costs."""
+    parser = argparse.ArgumentParser(description="Chat history rerun cost")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    modes = [
+        ("st.markdown, default config", False, 10000),
+        ("render cache, default config", True, 10000),
+        ("render cache, 1 KB msg cache", True, 1000),
+    ]
+    print(f"{args.messages} messages, {args.reruns} reruns (first rerun excluded)")
+    for label, use_cache, min_cached in modes:
+        results = run_mode(args.messages, args.reruns + 1, use_cache, min_cached)[1:]
+        seconds = statistics.median(r[0] for r in results)
+        sent = statistics.median(r[1] for r in results)
+        print(f"{label:<32} {seconds * 1e3:8.1f} ms/rerun {sent / 1024:9.1f} KiB/rerun")
+
+
+if __name__ == "__main__":
+    main()
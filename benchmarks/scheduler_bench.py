@@ -0,0 +1,97 @@
+"""
+Interactive latency while a batch job shares the API quota.
+
+Bulk workers keep the request slots busy while interactive requests
+arrive at a steady pace. Requests are simulated with a fixed duration, so
+the numbers isolate the scheduling: once with every request in one
+first-come first-served queue, once with the interactive requests in
+their own priority class, and once more with bulk work also limited to
+half of the slots.
+
+Usage:
+    python -m benchmarks.scheduler_bench --slots 4 --bulk-workers 16
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from typing import List
+
+from src.scheduler import BULK, INTERACTIVE, RequestScheduler
+
+
+def run(slots: int, bulk_workers: int, interactive: int, duration: float,
+        prioritized: bool, bulk_slots: int) -> List[float]:
+    """
+    Run the mixed workload once.
+
+    Args:
+        slots: Concurrent request slots
+        bulk_workers: Threads sending bulk requests back to back
+        interactive: Number of interactive requests
+        duration: Seconds each simulated request takes
+        prioritized: Put interactive requests in their own class; otherwise
+            they queue with the bulk requests, in the same session
+        bulk_slots: Slots bulk requests may hold at once
+
+    Returns:
+        Interactive latencies (queueing plus request) in seconds
+    """
+    scheduler = RequestScheduler(slots, bulk_slots=bulk_slots)
+    interactive_class = INTERACTIVE if prioritized else BULK
+    session = "user" if prioritized else "batch"
+    stop = threading.Event()
+
+    def bulk() -> None:
+        while not stop.is_set():
+            grant = scheduler.acquire(1, BULK, "batch")
+            time.sleep(duration)
+            scheduler.release(grant)
+
+    workers = [threading.Thread(target=bulk) for _ in range(bulk_workers)]
+    for worker in workers:
+        worker.start()
+    latencies = []
+    try:
+        for _ in range(interactive):
+            time.sleep(duration)
+            started = time.perf_counter()
+            grant = scheduler.acquire(1, interactive_class, session)
+            time.sleep(duration)
+            scheduler.release(grant)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    return latencies
+
+
+def main() -> None:
+    """Compare interactive latency with and without priorities."""
+    parser = argparse.ArgumentParser(description="Scheduler priority benchmark")
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--bulk-workers", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=0.05,
+                        help="Seconds each simulated request takes")
+    args = parser.parse_args()
+
+    print(f"{args.slots} slots, {args.bulk_workers} bulk workers, "
+          f"{args.duration * 1e3:.0f} ms requests")
+    modes = [
+        ("first come first served", False, args.slots),
+        ("interactive priority", True, args.slots),
+        ("priority + bulk slots", True, max(1, args.slots // 2)),
+    ]
+    for label, prioritized, bulk_slots in modes:
+        latencies = sorted(run(args.slots, args.bulk_workers, args.requests,
+                               args.duration, prioritized, bulk_slots))
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"{label:<24} p50 {statistics.median(latencies) * 1e3:7.1f} ms"
+              f"   p95 {p95 * 1e3:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
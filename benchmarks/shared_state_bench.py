@@ -0,0 +1,106 @@
+"""
+Cross-process cache benchmark for the shared state store.
+
+Simulates several Streamlit server processes behind a load balancer, each
+serving requests drawn from the same skewed prompt distribution. Compares
+per-process caches (what ``st.cache_data`` gives us) with the shared SQLite
+store, and checks read-your-writes consistency and read latency under load.
+
+Usage:
+    python -m benchmarks.shared_state_bench --processes 4 --requests 2000
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from src.shared_state import SharedStateStore, make_cache_key
+
+
+def _prompts(seed: int, count: int, distinct: int):
+    """Draw prompts from a Zipf-like popularity distribution."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return rng.choices(range(distinct), weights=weights, k=count)
+
+
+def _worker(args):
+    mode, path, seed, count, distinct = args
+    local_cache = {}
+    store = SharedStateStore(path) if mode == "shared" else None
+    hits = 0
+    read_latencies = []
+    stale_reads = 0
+    for prompt in _prompts(seed, count, distinct):
+        key = make_cache_key("bench", prompt)
+        if store is None:
+            value = local_cache.get(key)
+        else:
+            started = time.perf_counter()
+            value = store.cache_get(key)
+            read_latencies.append(time.perf_counter() - started)
+        if value is not None:
+            hits += 1
+            continue
+        value = f"response {prompt}"
+        if store is None:
+            local_cache[key] = value
+        else:
+            store.cache_set(key, value)
+            # Read-your-writes: the value must be visible immediately
+            if store.cache_get(key) != value:
+                stale_reads += 1
+    if store is not None:
+        store.close()
+    return hits, read_latencies, stale_reads
+
+
+def run(processes: int, requests: int, distinct: int) -> None:
+    """
+    Run both cache modes and print a comparison.
+
+    Args:
+        processes: Number of simulated server processes
+        requests: Requests served by each process
+        distinct: Number of distinct prompts
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.sqlite3")
+        SharedStateStore(path).close()
+        with multiprocessing.Pool(processes) as pool:
+            for mode in ("per-process", "shared"):
+                jobs = [(mode, path, seed, requests, distinct) for seed in range(processes)]
+                started = time.perf_counter()
+                results = pool.map(_worker, jobs)
+                elapsed = time.perf_counter() - started
+
+                hits = sum(r[0] for r in results)
+                latencies = sorted(l for r in results for l in r[1])
+                stale = sum(r[2] for r in results)
+                total = processes * requests
+                print(f"{mode:>12}: hit rate {hits / total:6.1%}  "
+                      f"throughput {total / elapsed:9.0f} req/s", end="")
+                if latencies:
+                    p99 = latencies[int(len(latencies) * 0.99) - 1]
+                    print(f"  read p50 {statistics.median(latencies) * 1e6:6.0f} us"
+                          f"  p99 {p99 * 1e6:6.0f} us  stale reads {stale}")
+                else:
+                    print()
+
+
+def main() -> None:
+    """Parse arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=500)
+    args = parser.parse_args()
+    run(args.processes, args.requests, args.distinct)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Browser updates and server CPU per streamed answer.
+
+Streams long answers from the mock completion server (in a separate
+process) into ``chatgpt_clone.py`` through Streamlit's headless
+``AppTest`` runner: once redrawing the answer on every delta, then at the
+renderer's frame rate. For each mode it reports, per answer, the
+ForwardMsgs the script enqueued for the browser and their bytes, and the
+CPU time this process spent (script, client and message handling). The
+server merges repeated updates of an element only within one flush of its
+queue, so most enqueued updates of a streamed answer reach the browser.
+
+Usage:
+    python -m benchmarks.stream_render_bench --words 400 --answers 3
+"""
+
+import argparse
+import os
+import time
+from unittest.mock import patch
+
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.load_test import chat_input_files
+from benchmarks.mock_server import server_process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_mode(base_url: str, fps: float, answers: int) -> tuple:
+    """
+    Stream several answers and measure each.
+
+    Args:
+        base_url: Mock server base URL
+        fps: STREAM_RENDER_FPS; 0 redraws on every delta
+        answers: Number of prompts to send
+
+    Returns:
+        Per answer averages: (ForwardMsgs, bytes, CPU seconds, wall seconds)
+    """
+    captured = []
+    original = ForwardMsgQueue.enqueue
+
+    def capture(queue, msg):
+        captured.append(msg.ByteSize())
+        return original(queue, msg)
+
+    env = {"OPENAI_API_KEY": "sk-bench", "OPENAI_BASE_URL": base_url,
+           "STREAM_RENDER_FPS": str(fps)}
+    totals = [0, 0, 0.0, 0.0]
+    with patch.dict(os.environ, env), chat_input_files(), \
+            patch.object(ForwardMsgQueue, "enqueue", capture):
+        app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"),
+                                default_timeout=120)
+        app.run()
+        for number in range(answers):
+            captured.clear()
+            cpu, wall = time.process_time(), time.perf_counter()
+            app.chat_input[0].set_value(f"Tell me story number {number}").run()
+            totals[2] += time.process_time() - cpu
+            totals[3] += time.perf_counter() - wall
+            totals[0] += len(captured)
+            totals[1] += sum(captured)
+    return tuple(total / answers for total in totals)
+
+
+def main() -> None:
+    """Compare per-delta redraws with frame-rate-limited ones."""
+    parser = argparse.ArgumentParser(description="Streamed answer render cost")
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--answers", type=int, default=3)
+    parser.add_argument("--chunk-delay", type=float, default=0.005,
+                        help="Seconds between streamed words")
+    parser.add_argument("--fps", type=float, default=15.0)
+    args = parser.parse_args()
+
+    options = ("--chunk-delay", str(args.chunk_delay),
+               "--answer-words", str(args.words))
+    with server_process(*options) as base_url:
+        print(f"{args.words}-word answers, {args.chunk_delay * 1e3:.0f} ms per word")
+        for label, fps in (("every delta", 0), (f"{args.fps:g} fps", args.fps)):
+            msgs, sent, cpu, wall = run_mode(base_url, fps, args.answers)
+            print(f"{label:<12} {msgs:6.0f} msgs {sent / 1024:8.1f} KiB "
+                  f"{cpu * 1e3:8.1f} ms CPU {wall:6.2f} s per answer")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,64 @@ Clean, simple, and focused on conversation.
 """
 
 import streamlit as st
-import os
+import itertools
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
+from src.journal import new_conversation, persist_message, render_search, saved_messages
+from src.long_input import (
+    DEFAULT_QUESTION,
+    estimate_chunk_count,
+    is_long_input,
+    iter_document_chunks,
+    map_reduce,
+    split_question,
+)
 from src.openai_example import get_openai_client
+from src.prompt_cache import block_window, get_prompt_cache_stats
+from src.retrieval_memory import ConversationMemory, create_memory_from_env
+from src.render_cache import finalize_message, get_render_cache
+from src.quotas import QuotaExceeded, get_user_id, quota_limiter
+from src.scheduler import INTERACTIVE, limiter_for
+from src.session_memory import session_run, track_session
+from src.shared_state import get_session_id, get_shared_store
+from src.stream_render import StreamRenderer
+from src.streaming import CancellableStream, budgeted_stream
+from src.token_budget import (
+    CompletionLengthPredictor,
+    budgeted_completion,
+    estimate_tokens,
+)
+from src.tracing import set_session, span, traced
 
 # Load environment variables
 load_dotenv()
 
+# Longest answer a single turn may produce, including continuations
+MAX_RESPONSE_TOKENS = 1000
+
+SYSTEM_PROMPT = "You are ChatGPT, a helpful AI assistant."
+
+# Fewest past messages sent along with each prompt
+HISTORY_WINDOW = 10
+
+# The history window starts at multiples of this many messages, so the
+# prompt prefix stays the same (and cached by the API) between moves
+HISTORY_BLOCK = 10
+
+# Uploads accepted by the chat input; they are answered with map-reduce
+DOCUMENT_TYPES = ["txt", "md", "csv", "json", "log", "py"]
+
+# Most past messages listed for a conversation search
+SEARCH_RESULTS = 10
+
 def main():
     """Main chat application."""
+    # The session stays in memory until the run (and its answer) is done
+    with span("rerun", app="chatgpt_clone"), session_run():
+        render_page()
+
+def render_page():
+    """Render the chat page; one call per script rerun."""
     
     # Page config - minimal and clean
     st.set_page_config(
@@ -23,75 +72,352 @@ def main():
         layout="centered"
     )
     
+    # Shared store lets another server process pick up this conversation
+    store = get_shared_store()
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = get_user_id(st.user)
+    session_id = get_session_id(
+        st.session_state, st.query_params, st.session_state.user_id, store
+    )
+    set_session(session_id)
+    # Account for this session's memory; puts back state offloaded while idle
+    track_session()
+    # Journal keeps every conversation, searchable, across clears and restarts
+    render_search(st.sidebar, st.session_state, st.query_params, open_conversation,
+                  "🔎 Search conversations", limit=SEARCH_RESULTS)
+    
     # Header with clear button
     col1, col2 = st.columns([4, 1])
     with col1:
         st.title("💬 ChatGPT")
+        cache_usage = get_prompt_cache_stats().usage(session_id)
+        if cache_usage.requests:
+            st.caption(
+                f"⚡ Prompt cache: {cache_usage.hit_ratio:.0%} of "
+                f"{cache_usage.prompt_tokens:,} prompt tokens cached "
+                f"over {cache_usage.requests} requests"
+            )
     with col2:
         if st.button("🗑️ Clear Chat", type="secondary"):
             st.session_state.messages = []
+            st.session_state.memory = create_memory_from_env(get_openai_client)
+            if store is not None:
+                store.clear_messages(session_id)
+            new_conversation(st.session_state, st.query_params)
             st.rerun()
     
     # Initialize chat history
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        if store is not None:
+            st.session_state.messages = store.load_messages(session_id)
+        else:
+            st.session_state.messages = saved_messages(
+                st.session_state, st.query_params
+            )
+    
+    # Optional retrieval memory over the whole conversation
+    if "memory" not in st.session_state:
+        st.session_state.memory = create_memory_from_env(get_openai_client)
     
     # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    render_history(st.session_state.messages)
     
     # Chat input
-    if prompt := st.chat_input("Message ChatGPT..."):
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
-        
-        # Generate AI response
-        with st.chat_message("assistant"):
+    submission = st.chat_input(
+        "Message ChatGPT...", accept_file="multiple", file_type=DOCUMENT_TYPES
+    )
+    if submission and (submission.files or is_long_input(submission.text)):
+        # Too long for one prompt: answer chunk by chunk, then combine
+        answer_document(submission.text, submission.files)
+    elif submission and (prompt := submission.text):
+        answer_prompt(prompt, session_id)
+
+def answer_prompt(prompt: str, session_id: str) -> None:
+    """
+    Answer a chat prompt, streaming the reply as it arrives.
+    
+    A Stop click reruns the script mid-answer; the partial answer is kept
+    and the request's slot and reservations are returned.
+    
+    Args:
+        prompt: Chat input text
+        session_id: Session the prompt cache usage is recorded for
+    """
+    # Add user message to chat history
+    add_message("user", prompt)
+    with st.chat_message("user"):
+        st.markdown(prompt)
+    
+    # Generate AI response
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        stop_button = st.empty()
+        # Clicking Stop reruns the script, which interrupts the loop below
+        stop_button.button("⏹️ Stop generating", key="stop_generating")
+        stream = None
+        try:
             with st.spinner(""):
-                try:
-                    response = get_chat_response(prompt)
-                    st.markdown(response)
-                    # Add assistant response to chat history
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    error_msg = f"I'm sorry, I encountered an error: {str(e)}"
-                    st.markdown(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
-
-def get_chat_response(prompt: str) -> str:
+                stream = stream_chat_response(prompt, st.session_state.memory)
+            # Redraw at a limited frame rate, not once per token
+            renderer = StreamRenderer(placeholder)
+            with span("stream_response") as streaming:
+                with stream:
+                    for _ in stream:
+                        renderer.update(stream.text)
+                    renderer.finish(stream.text)
+                    streaming.set(completion_tokens=stream.completion_tokens,
+                                  cached_tokens=stream.cached_tokens,
+                                  deltas=renderer.deltas, frames=renderer.frames)
+            get_prompt_cache_stats().record(
+                session_id, stream.prompt_tokens, stream.cached_tokens
+            )
+            stop_button.empty()
+            # Add assistant response to chat history
+            add_message("assistant", stream.text)
+        except QuotaExceeded as e:
+            placeholder.markdown(f"⏳ {e}")
+            stop_button.empty()
+            add_message("assistant", f"⏳ {e}")
+        except Exception as e:
+            error_msg = f"I'm sorry, I encountered an error: {str(e)}"
+            placeholder.markdown(error_msg)
+            stop_button.empty()
+            add_message("assistant", error_msg)
+        except BaseException:
+            # Stopped (or otherwise rerun) mid-answer: keep the partial
+            # answer
+            if stream is not None and stream.text:
+                add_message("assistant", stream.text)
+            raise
+        finally:
+            # Also when stopped before streaming started, e.g. while
+            # waiting for the scheduler: returns the slot and reservations
+            if stream is not None:
+                stream.close()
+
+def answer_document(prompt: str, files: list) -> None:
     """
-    Get response from OpenAI API.
+    Answer a long pasted text or uploaded files with map-reduce.
+    
+    The history keeps the question and a short description of the
+    document, not the document itself, so later turns still fit the
+    history window.
     
     Args:
-        prompt: User input
+        prompt: Chat input text (the question, or the pasted document)
+        files: Uploaded files
+    """
+    if files:
+        question = prompt.strip() or DEFAULT_QUESTION
+        sources = files
+        label = ", ".join(f"{f.name} ({f.size // 1024} KB)" for f in files)
+    else:
+        question, document = split_question(prompt)
+        sources = [document]
+        label = f"pasted text (~{estimate_tokens(document)} tokens)"
+    add_message("user", f"{question}\n\n📄 {label}")
+    with st.chat_message("user"):
+        st.markdown(st.session_state.messages[-1]["content"])
+    
+    with st.chat_message("assistant"):
+        progress = st.progress(0.0, text="Reading the document...")
+        
+        def on_progress(done: int, expected: int) -> None:
+            progress.progress(
+                min(1.0, done / expected), text=f"Processed {done} of {expected} parts"
+            )
         
+        try:
+            with span("map_reduce", sources=len(sources)) as tracing_span:
+                result = map_reduce(
+                    get_openai_client(),
+                    itertools.chain.from_iterable(
+                        iter_document_chunks(source) for source in sources
+                    ),
+                    question,
+                    on_progress=on_progress,
+                    total_hint=sum(estimate_chunk_count(source) for source in sources),
+                    # Chunks share the session's fair share and quota
+                    limiter=session_limiter(),
+                    model="gpt-3.5-turbo",
+                    temperature=0.3
+                )
+                tracing_span.set(chunks=result.chunks)
+            progress.empty()
+            st.markdown(result.content)
+            add_message("assistant", result.content)
+        except QuotaExceeded as e:
+            progress.empty()
+            st.markdown(f"⏳ {e}")
+            add_message("assistant", f"⏳ {e}")
+        except Exception as e:
+            progress.empty()
+            error_msg = f"I'm sorry, I encountered an error: {str(e)}"
+            st.markdown(error_msg)
+            add_message("assistant", error_msg)
+
+def add_message(role: str, content: str) -> None:
+    """
+    Append a message to the chat history and the shared store.
+    
+    Args:
+        role: Message role ("user" or "assistant")
+        content: Message text
+    """
+    message = finalize_message({"role": role, "content": content})
+    st.session_state.messages.append(message)
+    # Embed each message once, as it is added
+    memory = st.session_state.get("memory")
+    if memory is not None:
+        try:
+            memory.sync(st.session_state.messages)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # An embedding error or timeout must not lose the message; the
+            # next successful sync embeds whatever was missed
+            pass
+    persist_message(st.session_state, message)
+
+def open_conversation(messages: List[Dict[str, str]]) -> None:
+    """
+    Show a journaled conversation the user opened from the search.
+    
+    Args:
+        messages: The conversation's messages
+    """
+    st.session_state.messages = messages
+    st.session_state.memory = create_memory_from_env(get_openai_client)
+
+def session_limiter():
+    """
+    Return the limiter for this session's requests.
+    
+    Requests wait for the session's share of the scheduler (when enabled)
+    and are checked against the session's and user's quotas (when set).
+    
     Returns:
-        AI response
+        Limiter to pass as ``limiter=``, or None if nothing is limited
     """
-    client = get_openai_client()
+    session_id = st.session_state.session_id
+    return quota_limiter(
+        limiter_for(INTERACTIVE, session_id),
+        session_id,
+        st.session_state.get("user_id"),
+    )
+
+def render_history(messages: list) -> None:
+    """
+    Render past chat messages.
+    
+    Past messages never change, so their rendered markdown is reused from
+    the render cache instead of being rebuilt on every rerun.
+    
+    Args:
+        messages: Chat history to display
+    """
+    with span("render_history", messages=len(messages)):
+        cache = get_render_cache()
+        for message in messages:
+            cache.render(st.chat_message(message["role"]), message)
+
+def build_chat_messages(history: list, prompt: str,
+                        memory: Optional[ConversationMemory] = None) -> list:
+    """
+    Build the message list sent to the API for a new prompt.
     
+    Without retrieval memory the recent history is sent in a window that
+    moves in steps of HISTORY_BLOCK messages, so consecutive prompts share
+    their prefix and the API can serve it from its prompt cache.
+    
+    Args:
+        history: Chat history (the last HISTORY_WINDOW to
+            HISTORY_WINDOW + HISTORY_BLOCK - 1 messages are sent)
+        prompt: User input
+        memory: Retrieval memory; when given, the earlier messages most
+            relevant to the prompt plus the latest few are sent instead
+            (or the window, if embedding fails)
+        
+    Returns:
+        System prompt, recent history and the prompt as chat messages
+    """
     # Build message history for context
-    messages = [{"role": "system", "content": "You are ChatGPT, a helpful AI assistant."}]
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
-    # Add conversation history (last 10 messages for context)
-    recent_messages = st.session_state.messages[-10:] if len(st.session_state.messages) > 10 else st.session_state.messages
-    for msg in recent_messages:
+    # Add conversation history (recent messages, or recalled ones)
+    context = None
+    if memory is not None:
+        try:
+            context = memory.select(history, prompt)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Embedding failed: answer with the plain history window instead
+            context = None
+    if context is None:
+        context = block_window(history, HISTORY_BLOCK, HISTORY_WINDOW)
+    for msg in context:
         messages.append({"role": msg["role"], "content": msg["content"]})
     
     # Add current prompt
     messages.append({"role": "user", "content": prompt})
+    return messages
+
+@traced()
+def get_chat_response(prompt: str, memory: Optional[ConversationMemory] = None) -> str:
+    """
+    Get response from OpenAI API.
+    
+    Args:
+        prompt: User input
+        memory: Optional retrieval memory for choosing context messages
+        
+    Returns:
+        AI response
+    """
+    client = get_openai_client()
+    messages = build_chat_messages(st.session_state.messages, prompt, memory)
     
-    response = client.chat.completions.create(
+    # max_tokens is predicted from past answers to similar prompts; answers
+    # cut off by the prediction are continued up to MAX_RESPONSE_TOKENS
+    prompt_class = CompletionLengthPredictor.classify(prompt, app="chatgpt_clone")
+    result = budgeted_completion(
+        client,
+        messages,
+        prompt_class,
+        ceiling=MAX_RESPONSE_TOKENS,
+        limiter=session_limiter(),
         model="gpt-3.5-turbo",
-        messages=messages,
-        max_tokens=1000,
         temperature=0.7
     )
+    get_prompt_cache_stats().record(
+        st.session_state.get("session_id"), result.prompt_tokens, result.cached_tokens
+    )
+    
+    return result.content
+
+@traced()
+def stream_chat_response(
+    prompt: str, memory: Optional[ConversationMemory] = None
+) -> CancellableStream:
+    """
+    Start a streamed response from OpenAI API.
     
-    return response.choices[0].message.content
+    Args:
+        prompt: User input
+        memory: Optional retrieval memory for choosing context messages
+        
+    Returns:
+        Stream of text deltas that can be cancelled mid-answer
+    """
+    client = get_openai_client()
+    messages = build_chat_messages(st.session_state.messages, prompt, memory)
+    prompt_class = CompletionLengthPredictor.classify(prompt, app="chatgpt_clone")
+    return budgeted_stream(
+        client,
+        messages,
+        prompt_class,
+        ceiling=MAX_RESPONSE_TOKENS,
+        limiter=session_limiter(),
+        model="gpt-3.5-turbo",
+        temperature=0.7
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Background event loop for calling async code from Streamlit scripts.
+
+Streamlit runs every script on its own thread, without an event loop, and
+``asyncio.run`` would start (and tear down) a loop per call, losing the
+async client's connection pool each time. Instead, one event loop runs on
+a daemon thread for the whole process; scripts submit coroutines to it
+and block only their own thread until the result (or the next item of an
+async stream) arrives. Thousands of requests in flight on the loop cost a
+coroutine each rather than a thread each.
+
+Async clients keep their connection pool on the loop they first ran on,
+so :func:`loop_resource` shares one per loop; :meth:`BackgroundLoop.close`
+closes them, and the process-wide loop is closed at interpreter exit.
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import inspect
+import os
+import queue
+import threading
+import weakref
+from typing import (
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+_ITEM, _DONE, _ERROR = range(3)
+
+
+class BackgroundLoop:
+    """An asyncio event loop running on its own daemon thread."""
+
+    def __init__(self, name: str = "async-bridge"):
+        """
+        Start the loop.
+
+        Args:
+            name: Name of the loop thread
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def running(self) -> bool:
+        """True while the loop thread is alive."""
+        return self._thread.is_alive()
+
+    def submit(self, coro: Awaitable[T]) -> concurrent.futures.Future[T]:
+        """
+        Schedule a coroutine without waiting for it.
+
+        Args:
+            coro: Coroutine to run on the loop
+
+        Returns:
+            Future for the coroutine's result; cancelling it cancels the task
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """
+        Run a coroutine on the loop and wait for its result.
+
+        If the calling thread is interrupted while waiting (e.g. a Streamlit
+        rerun stops the script), the coroutine is cancelled.
+
+        Args:
+            coro: Coroutine to run
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            The coroutine's result
+
+        Raises:
+            TimeoutError: If the result did not arrive within ``timeout``
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, aiterable: AsyncIterable[T]) -> Iterator[T]:
+        """
+        Consume an async iterable from synchronous code.
+
+        Items are pushed onto a queue as the loop produces them, so the
+        loop never waits for the caller. Closing the returned iterator
+        (or leaving a ``for`` loop over it early) cancels the producer,
+        which closes async streams such as HTTP responses.
+
+        Args:
+            aiterable: Async iterable to consume on the loop
+
+        Yields:
+            Items of ``aiterable``, in order
+        """
+        items: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+
+        async def pump() -> None:
+            try:
+                async for item in aiterable:
+                    items.put((_ITEM, item))
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                items.put((_ERROR, e))
+            else:
+                items.put((_DONE, None))
+            finally:
+                aclose = getattr(aiterable, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+        future = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Close the loop's shared resources, stop it and wait for its thread.
+
+        Args:
+            timeout: Seconds allowed for closing the shared resources
+        """
+        if self.running:
+            try:
+                self.run(close_loop_resources(), timeout)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # Shutting down regardless; the connections die with the loop
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
+
+
+_resources: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+    weakref.WeakKeyDictionary()
+)
+_resources_lock = threading.Lock()
+
+
+def loop_resource(key: Hashable, factory: Callable[[], T]) -> T:
+    """
+    Return an object shared by the coroutines of the running loop.
+
+    The object is made by ``factory`` the first time ``key`` is asked for
+    on a loop. Call from a coroutine.
+
+    Args:
+        key: Identifies the object on the loop, e.g. a client's settings
+        factory: Creates the object
+
+    Returns:
+        The running loop's object for ``key``
+    """
+    loop = asyncio.get_running_loop()
+    with _resources_lock:
+        resources = _resources.setdefault(loop, {})
+        if key not in resources:
+            resources[key] = factory()
+        return resources[key]
+
+
+async def close_loop_resources() -> None:
+    """Close (``aclose`` or ``close``) the running loop's shared objects."""
+    with _resources_lock:
+        resources: Dict[Hashable, Any] = _resources.pop(
+            asyncio.get_running_loop(), {}
+        )
+    for resource in resources.values():
+        close = getattr(resource, "aclose", None) or getattr(resource, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+
+_loop: Optional[BackgroundLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> BackgroundLoop:
+    """
+    Return the process-wide background loop, starting it on first use.
+
+    A process forked from one that had a loop starts its own, since the
+    loop thread does not survive the fork.
+
+    Returns:
+        The shared loop
+    """
+    global _loop, _loop_pid  # pylint: disable=global-statement
+    if _loop is None or _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop is None or _loop_pid != os.getpid():
+                _loop = BackgroundLoop()
+                _loop_pid = os.getpid()
+                atexit.register(_loop.close)
+    return _loop
+
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Run a coroutine on the process-wide loop and wait for its result.
+
+    Args:
+        coro: Coroutine to run
+        timeout: Maximum seconds to wait, or None to wait indefinitely
+
+    Returns:
+        The coroutine's result
+    """
+    return get_background_loop().run(coro, timeout)
+
+
+def iterate_async(aiterable: AsyncIterable[T]) -> Iterator[T]:
+    """
+    Consume an async iterable on the process-wide loop.
+
+    Args:
+        aiterable: Async iterable, e.g. from
+            :func:`src.openai_example.async_stream_chat_completion`
+
+    Returns:
+        Synchronous iterator over its items
+    """
+    return get_background_loop().iterate(aiterable)
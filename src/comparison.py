@@ -0,0 +1,220 @@
+"""
+Concurrent comparison of one prompt across model settings.
+
+Each variant (model, temperature, max_tokens) streams on its own worker
+thread; the workers push text deltas onto one queue, which the Streamlit
+script thread drains to update the variants' columns. All variants start
+at once, so the total wait is that of the slowest variant rather than the
+sum of all of them.
+
+A variant counts as done only once the script thread has taken its last
+delta off the queue, so its final text is complete when it is drawn.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.streaming import CancellableStream
+from src.token_budget import (
+    TokenRateLimiter,
+    estimate_prompt_tokens,
+    estimate_tokens,
+    get_rate_limiter,
+)
+
+MODELS = ["gpt-3.5-turbo", "gpt-4o-mini", "gpt-4o"]
+
+
+@dataclass(frozen=True)
+class Variant:
+    """One configuration to compare."""
+
+    model: str
+    temperature: float
+    max_tokens: int
+
+    @property
+    def label(self) -> str:
+        """Short description for column headers."""
+        return f"{self.model} · T={self.temperature:g} · {self.max_tokens} tok"
+
+
+@dataclass
+class VariantResult:
+    """Streaming state and measurements of one variant."""
+
+    variant: Variant
+    text: str = ""
+    first_token_seconds: Optional[float] = None
+    latency_seconds: Optional[float] = None
+    completion_tokens: int = 0
+    prompt_tokens: int = 0
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        """True once the variant finished or failed and its text is complete."""
+        return self.latency_seconds is not None
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Generation speed after the first token."""
+        if self.first_token_seconds is None or self.latency_seconds is None:
+            return None
+        generating = self.latency_seconds - self.first_token_seconds
+        if generating <= 0 or self.completion_tokens <= 1:
+            return None
+        # The first token arrives with the time to first token
+        return (self.completion_tokens - 1) / generating
+
+    def summary(self) -> str:
+        """One-line metrics for display."""
+        if self.error is not None:
+            return f"❌ {self.error}"
+        if not self.done:
+            return "⏳ streaming..."
+        parts = [f"⏱️ {self.latency_seconds:.2f}s"]
+        if self.first_token_seconds is not None:
+            parts.append(f"first token {self.first_token_seconds:.2f}s")
+        if self.tokens_per_second is not None:
+            parts.append(f"{self.tokens_per_second:.0f} tok/s")
+        parts.append(f"{self.prompt_tokens} + {self.completion_tokens} tokens")
+        return " · ".join(parts)
+
+
+@dataclass(frozen=True)
+class _Finished:
+    """Queued by a worker after its variant's last delta."""
+
+    latency_seconds: float
+
+
+class ComparisonRun:
+    """
+    Streams one set of messages through several variants at once.
+
+    Iterate :meth:`updates` on the calling thread; every item lists the
+    variants that changed since the previous item, so the caller redraws
+    each column at most once per batch of deltas.
+    """
+
+    def __init__(
+        self,
+        client,
+        messages: List[Dict[str, str]],
+        variants: List[Variant],
+        limiter: Optional[TokenRateLimiter] = None,
+    ):
+        """
+        Prepare the run; nothing is sent until :meth:`updates` is iterated.
+
+        Args:
+            client: OpenAI client shared by all workers
+            messages: Chat messages sent to every variant
+            variants: Configurations to compare
+            limiter: Token rate limiter (defaults to the process-wide one, if any)
+        """
+        self.client = client
+        self.messages = list(messages)
+        self.results = [VariantResult(variant) for variant in variants]
+        self.limiter = limiter if limiter is not None else get_rate_limiter()
+        self._queue: "queue.SimpleQueue[Tuple[int, object]]" = queue.SimpleQueue()
+        self._streams: List[CancellableStream] = []
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def _run_variant(self, index: int) -> None:
+        result = self.results[index]
+        variant = result.variant
+        started = time.perf_counter()
+        reservation = None
+        stream = None
+        try:
+            if self.limiter is not None:
+                reservation = self.limiter.acquire(
+                    estimate_prompt_tokens(self.messages) + variant.max_tokens
+                )
+            stream = CancellableStream(
+                self.client,
+                self.messages,
+                variant.max_tokens,
+                max_continuations=0,
+                model=variant.model,
+                temperature=variant.temperature,
+            )
+            with self._lock:
+                if self._cancelled:
+                    stream.cancel()
+                self._streams.append(stream)
+            with stream:
+                for delta in stream:
+                    if result.first_token_seconds is None:
+                        result.first_token_seconds = time.perf_counter() - started
+                    self._queue.put((index, delta))
+            result.completion_tokens = stream.completion_tokens
+            result.prompt_tokens = stream.prompt_tokens
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            result.error = str(e)
+        finally:
+            latency = time.perf_counter() - started
+            if reservation is not None:
+                used = (result.prompt_tokens or estimate_prompt_tokens(self.messages))
+                used += result.completion_tokens or (
+                    estimate_tokens(stream.text) if stream is not None else 0
+                )
+                self.limiter.release(reservation, used)
+            # Deltas queued before this one may not have been taken yet
+            self._queue.put((index, _Finished(latency)))
+
+    def updates(self) -> Iterator[List[int]]:
+        """
+        Start every variant and follow their progress.
+
+        Yields:
+            Indexes of the variants whose text or status changed
+        """
+        started = time.perf_counter()
+        remaining = len(self.results)
+        executor = ThreadPoolExecutor(max_workers=max(1, remaining))
+        try:
+            for index in range(remaining):
+                executor.submit(self._run_variant, index)
+            while remaining:
+                # Block for one event, then take everything else already queued
+                events = [self._queue.get()]
+                while True:
+                    try:
+                        events.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                changed = []
+                for index, item in events:
+                    if isinstance(item, _Finished):
+                        self.results[index].latency_seconds = item.latency_seconds
+                        remaining -= 1
+                    else:
+                        self.results[index].text += item
+                    if index not in changed:
+                        changed.append(index)
+                yield changed
+        finally:
+            # Leaving early (e.g. the script was rerun) stops every stream
+            if remaining:
+                self.cancel()
+                stopped = time.perf_counter() - started
+                for result in self.results:
+                    if result.latency_seconds is None:
+                        result.latency_seconds = stopped
+            executor.shutdown(wait=False)
+
+    def cancel(self) -> None:
+        """Stop all variants that are still streaming."""
+        with self._lock:
+            self._cancelled = True
+            streams = list(self._streams)
+        for stream in streams:
+            stream.cancel()
@@ -0,0 +1,376 @@
+"""
+Record and replay OpenAI HTTP exchanges.
+
+The transports here plug into the ``httpx.Client`` underneath the
+``OpenAI`` client, so serialization, HTTP handling, SSE parsing and
+retries all run for real. :class:`RecordingTransport` forwards requests
+to the network and writes each exchange to a JSON-lines fixture,
+including when every chunk of a streamed response arrived.
+:class:`ReplayTransport` answers requests from such a fixture, either at
+the recorded pace (scaled by ``time_scale``) or as fast as possible.
+Both transports serve ``httpx.Client`` and ``httpx.AsyncClient`` alike,
+so the same fixture drives the sync and the async OpenAI clients.
+
+Fixture lines look like::
+
+    {"request": {"method": "POST", "path": "/v1/chat/completions",
+                 "body": {...}},
+     "status": 200, "headers": {"content-type": "text/event-stream"},
+     "chunks": [[412.5, "data: {...}\\n\\n"], ...]}
+
+Chunk times are milliseconds since the request was sent. Authorization
+headers are never recorded.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterator, List, Optional
+
+import httpx
+
+# Response headers worth keeping; everything else is transport detail
+_KEPT_HEADERS = ("content-type", "x-request-id", "openai-processing-ms")
+
+
+def _request_body(request: httpx.Request, content: Optional[bytes] = None):
+    if content is None:
+        content = request.read()
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode("utf-8", "surrogateescape")
+
+
+def exchange_key(method: str, path: str, body=None, match_body: bool = True) -> str:
+    """
+    Build the key used to match a request to a recorded exchange.
+
+    Args:
+        method: HTTP method
+        path: URL path, e.g. "/v1/chat/completions"
+        body: Decoded request body
+        match_body: Include the body in the key; without it, streamed and
+            plain requests are still told apart
+
+    Returns:
+        Key string
+    """
+    key = f"{method.upper()} {path}"
+    if match_body and body is not None:
+        key += " " + json.dumps(body, sort_keys=True, separators=(",", ":"))
+    elif isinstance(body, dict) and body.get("stream"):
+        key += " stream"
+    return key
+
+
+def load_exchanges(path: str) -> List[dict]:
+    """
+    Read a fixture file.
+
+    Args:
+        path: JSON-lines fixture path
+
+    Returns:
+        Recorded exchanges in recording order
+    """
+    with open(path, encoding="utf-8") as fixture:
+        return [json.loads(line) for line in fixture if line.strip()]
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """Passes response chunks through while timing them."""
+
+    def __init__(self, inner: httpx.SyncByteStream, on_close, started: float):
+        self._inner = inner
+        self._on_close = on_close
+        self._started = started
+        self._chunks: List[list] = []
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        for data in self._inner:
+            elapsed = (time.perf_counter() - self._started) * 1000
+            self._chunks.append(
+                [round(elapsed, 1), data.decode("utf-8", "surrogateescape")]
+            )
+            yield data
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._inner.close()
+        self._on_close(self._chunks)
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    """Async counterpart of :class:`_RecordingStream`."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, on_close, started: float):
+        self._inner = inner
+        self._on_close = on_close
+        self._started = started
+        self._chunks: List[list] = []
+        self._closed = False
+
+    async def __aiter__(self):
+        async for data in self._inner:
+            elapsed = (time.perf_counter() - self._started) * 1000
+            self._chunks.append(
+                [round(elapsed, 1), data.decode("utf-8", "surrogateescape")]
+            )
+            yield data
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        await self._inner.aclose()
+        self._on_close(self._chunks)
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Transport that forwards requests and appends each exchange to a fixture.
+
+    An exchange is written once its response is closed, so a stream
+    cancelled half way is recorded with the chunks that were received.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        Initialize the recorder.
+
+        Args:
+            path: JSON-lines fixture to append to
+            transport: Transport that performs sync requests
+                (defaults to a plain ``httpx.HTTPTransport``)
+            async_transport: Transport that performs async requests
+                (defaults to a plain ``httpx.AsyncHTTPTransport``)
+        """
+        self.path = path
+        self._transport = transport or httpx.HTTPTransport()
+        self._async_transport = async_transport or httpx.AsyncHTTPTransport()
+        self._lock = threading.Lock()
+
+    def _writer(self, request: httpx.Request, body, response: httpx.Response):
+        """Return the callback that appends the exchange once it is closed."""
+
+        def write(chunks: List[list]) -> None:
+            exchange = {
+                "request": {
+                    "method": request.method,
+                    "path": request.url.path,
+                    "body": body,
+                },
+                "status": response.status_code,
+                "headers": {
+                    name: response.headers[name]
+                    for name in _KEPT_HEADERS
+                    if name in response.headers
+                },
+                "chunks": chunks,
+            }
+            line = json.dumps(exchange, ensure_ascii=False, separators=(",", ":"))
+            with self._lock, open(self.path, "a", encoding="utf-8") as fixture:
+                fixture.write(line + "\n")
+        return write
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # Recorded bytes must be readable without the original decoder
+        request.headers["Accept-Encoding"] = "identity"
+        body = _request_body(request)
+        started = time.perf_counter()
+        response = self._transport.handle_request(request)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(
+                response.stream, self._writer(request, body, response), started
+            ),
+            extensions=response.extensions,
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.headers["Accept-Encoding"] = "identity"
+        body = _request_body(request, await request.aread())
+        started = time.perf_counter()
+        response = await self._async_transport.handle_async_request(request)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_AsyncRecordingStream(
+                response.stream, self._writer(request, body, response), started
+            ),
+            extensions=response.extensions,
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+    async def aclose(self) -> None:
+        await self._async_transport.aclose()
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Yields recorded chunks, sleeping until each one is due."""
+
+    def __init__(self, chunks: List[list], started: float, time_scale: float):
+        self._chunks = chunks
+        self._started = started
+        self._time_scale = time_scale
+        self._closed = threading.Event()
+
+    def __iter__(self) -> Iterator[bytes]:
+        for offset, text in self._chunks:
+            if self._time_scale > 0:
+                due = self._started + offset / 1000 * self._time_scale
+                # Waiting on the event lets close() from another thread cut in
+                if self._closed.wait(max(0.0, due - time.perf_counter())):
+                    return
+            elif self._closed.is_set():
+                return
+            yield text.encode("utf-8", "surrogateescape")
+
+    async def __aiter__(self):
+        for offset, text in self._chunks:
+            if self._time_scale > 0:
+                due = self._started + offset / 1000 * self._time_scale
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            if self._closed.is_set():
+                return
+            yield text.encode("utf-8", "surrogateescape")
+
+    def close(self) -> None:
+        self._closed.set()
+
+    async def aclose(self) -> None:
+        self._closed.set()
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Transport that answers requests from recorded exchanges.
+
+    Requests are matched on method, path and (by default) JSON body.
+    Repeated identical requests replay their recordings in order and then
+    start over, so a short fixture can drive a long load test. Unmatched
+    requests get a 404 error, which the OpenAI client raises without
+    retrying.
+    """
+
+    def __init__(
+        self,
+        exchanges: List[dict],
+        time_scale: float = 1.0,
+        match_body: bool = True,
+    ):
+        """
+        Initialize the replayer.
+
+        Args:
+            exchanges: Exchanges from :func:`load_exchanges`
+            time_scale: Multiplier for recorded delays; 1.0 replays at the
+                recorded pace, 0 as fast as possible
+            match_body: Require the request body to match the recording
+        """
+        self.time_scale = time_scale
+        self.match_body = match_body
+        self.requests = 0
+        self._recorded: Dict[str, List[dict]] = defaultdict(list)
+        for exchange in exchanges:
+            req = exchange["request"]
+            key = exchange_key(req["method"], req["path"], req.get("body"), match_body)
+            self._recorded[key].append(exchange)
+        self._pending: Dict[str, Deque[dict]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayTransport":
+        """
+        Create a replayer from a fixture file.
+
+        Args:
+            path: JSON-lines fixture path
+            **kwargs: Arguments for the constructor
+
+        Returns:
+            The replay transport
+        """
+        return cls(load_exchanges(path), **kwargs)
+
+    def _next_exchange(self, key: str) -> Optional[dict]:
+        with self._lock:
+            self.requests += 1
+            if key not in self._recorded:
+                return None
+            pending = self._pending.get(key)
+            if not pending:
+                pending = self._pending[key] = deque(self._recorded[key])
+            return pending.popleft()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self._respond(request, _request_body(request))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return self._respond(request, _request_body(request, await request.aread()))
+
+    def _respond(self, request: httpx.Request, body) -> httpx.Response:
+        started = time.perf_counter()
+        key = exchange_key(request.method, request.url.path, body, self.match_body)
+        exchange = self._next_exchange(key)
+        if exchange is None:
+            message = f"No recorded exchange for {request.method} {request.url.path}"
+            return httpx.Response(
+                404, json={"error": {"message": message, "type": "replay_miss"}}
+            )
+        return httpx.Response(
+            status_code=exchange["status"],
+            headers=exchange.get("headers", {}),
+            stream=_ReplayStream(exchange["chunks"], started, self.time_scale),
+        )
+
+
+_env_transport: Optional[httpx.BaseTransport] = None
+_env_lock = threading.Lock()
+
+
+def get_env_transport() -> Optional[httpx.BaseTransport]:
+    """
+    Return the process-wide record or replay transport, if configured.
+
+    OPENAI_REPLAY_FIXTURE replays a fixture (OPENAI_REPLAY_TIME_SCALE sets
+    the pace, default 1.0; OPENAI_REPLAY_MATCH=path ignores request
+    bodies); OPENAI_RECORD_FIXTURE records to one. The
+    transport is created once, so replay positions and the recorder's
+    connection pool are shared by all clients of the process.
+
+    Returns:
+        The transport, or None to use the network directly
+    """
+    global _env_transport  # pylint: disable=global-statement
+    if _env_transport is None:
+        with _env_lock:
+            if _env_transport is None:
+                replay = os.getenv("OPENAI_REPLAY_FIXTURE")
+                record = os.getenv("OPENAI_RECORD_FIXTURE")
+                if replay:
+                    _env_transport = ReplayTransport.from_file(
+                        replay,
+                        time_scale=float(os.getenv("OPENAI_REPLAY_TIME_SCALE", "1.0")),
+                        match_body=os.getenv("OPENAI_REPLAY_MATCH", "body") != "path",
+                    )
+                elif record:
+                    _env_transport = RecordingTransport(record)
+    return _env_transport
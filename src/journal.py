@@ -0,0 +1,717 @@
+"""
+Append-only conversation journal with full-text search.
+
+Every chat message is appended to a log split into segment files. A
+record is its length, a CRC-32 and the message as JSON, so a write torn by
+a crash is detected and dropped when the journal is reopened. Writes go
+straight to the operating system, so they survive the process crashing.
+A background thread fsyncs them in batches every ``sync_interval``
+seconds, so disk flushes are not paid per message; a power loss can drop
+at most that much.
+
+Each segment has an inverted index, updated as messages are appended. It
+maps every word to the messages containing it, and every conversation and
+every owner (the user who wrote the message) to their messages. A
+posting list stores message numbers as varint-encoded gaps, usually one
+byte per posting. When a segment reaches ``segment_bytes`` it is sealed
+and its index is written next to it. On reopening, sealed indexes are
+loaded and only the active segment is scanned.
+
+Searches intersect the posting lists segment by segment, newest first,
+and read only the matching records. Resuming a conversation reads only
+that conversation's records. The chat apps journal only signed-in users'
+messages and pass the user as owner, so a user only ever finds and opens
+their own messages; anonymous users have nothing that could identify them
+safely (a client address is shared behind a proxy) and get no journal.
+Reads take the lock only to find the records, not while reading them, so
+they don't hold up appends.
+
+One process owns a journal directory at a time, enforced with an
+exclusive lock on a ``LOCK`` file in it; several processes sharing
+conversations should use :mod:`src.shared_state` instead.
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from dataclasses import dataclass
+from struct import Struct
+from typing import Callable, Dict, List, Mapping, MutableMapping, Optional, Set, Union
+
+from src.shared_state import get_shared_store
+from src.tracing import span
+
+CONVERSATION_PARAM = "cid"
+
+# Words longer than this are not indexed
+MAX_TERM_LENGTH = 64
+
+_HEADER = Struct("<II")  # payload length, CRC-32 of the payload
+_INDEX_MAGIC = b"JIDX2\n"
+_WORD = re.compile(r"\w+")
+
+Postings = Union[bytearray, bytes]
+
+
+def tokenize(text: str) -> Set[str]:
+    """
+    Split text into the lowercase words the index uses.
+
+    Args:
+        text: Message or query text
+
+    Returns:
+        Distinct words of at most MAX_TERM_LENGTH characters
+    """
+    return {
+        word for word in _WORD.findall(text.lower()) if len(word) <= MAX_TERM_LENGTH
+    }
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, pos: int):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def decode_postings(data: Postings) -> List[int]:
+    """
+    Decode a posting list of varint gaps.
+
+    Args:
+        data: Encoded posting list
+
+    Returns:
+        Message numbers within the segment, ascending
+    """
+    numbers = []
+    current = -1
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            current += value
+            numbers.append(current)
+            value = shift = 0
+    return numbers
+
+
+def _intersect(lists: List[Postings]) -> List[int]:
+    """Message numbers in every posting list, ascending."""
+    # Start from the shortest list; it bounds the candidates
+    lists = sorted(lists, key=len)
+    candidates = decode_postings(lists[0])
+    for postings in lists[1:]:
+        matching = set(decode_postings(postings))
+        candidates = [local for local in candidates if local in matching]
+        if not candidates:
+            break
+    return candidates
+
+
+def _frozen(postings: Optional[Postings]) -> Optional[bytes]:
+    # The active segment's lists grow under the lock; readers take a copy
+    return bytes(postings) if isinstance(postings, bytearray) else postings
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """A message matching a search."""
+
+    message_id: int
+    conversation: str
+    role: str
+    content: str
+    timestamp: float
+
+
+def _post(lists: Dict[str, Postings], last: Dict[str, int], key: str,
+          local: int) -> None:
+    postings = lists.get(key)
+    if postings is None:
+        postings = lists[key] = bytearray()
+    _put_varint(postings, local - last.get(key, -1))
+    last[key] = local
+
+
+class _Segment:
+    """One log file and the index of the messages in it."""
+
+    def __init__(self, directory: str, number: int, base: int):
+        self.number = number
+        self.base = base
+        self.path = os.path.join(directory, f"{number:08d}.log")
+        self.index_path = os.path.join(directory, f"{number:08d}.idx")
+        self.offsets = array("Q")
+        self.size = 0
+        self.terms: Dict[str, Postings] = {}
+        self.conversations: Dict[str, Postings] = {}
+        self.owners: Dict[str, Postings] = {}
+        # Last message number added to each posting list, while writable
+        self._last_term: Dict[str, int] = {}
+        self._last_conversation: Dict[str, int] = {}
+        self._last_owner: Dict[str, int] = {}
+        # Appends go to fd while the segment is active; reads use read_fd,
+        # which stays open when the segment is sealed
+        self.fd: Optional[int] = None
+        self.read_fd: Optional[int] = None
+
+    def add(self, offset: int, conversation: str, owner: str,
+            terms: Set[str]) -> None:
+        local = len(self.offsets)
+        self.offsets.append(offset)
+        for term in terms:
+            _post(self.terms, self._last_term, term, local)
+        _post(self.conversations, self._last_conversation, conversation, local)
+        _post(self.owners, self._last_owner, owner, local)
+
+    def seal(self) -> None:
+        """Freeze the index and write it next to the log."""
+        self.terms = {term: bytes(data) for term, data in self.terms.items()}
+        self.conversations = {
+            key: bytes(data) for key, data in self.conversations.items()
+        }
+        self.owners = {key: bytes(data) for key, data in self.owners.items()}
+        self._last_term = self._last_conversation = self._last_owner = {}
+        out = bytearray(_INDEX_MAGIC)
+        _put_varint(out, self.base)
+        _put_varint(out, len(self.offsets))
+        _put_varint(out, self.size)
+        out += self.offsets.tobytes()
+        for lists in (self.terms, self.conversations, self.owners):
+            _put_varint(out, len(lists))
+            for key, data in lists.items():
+                encoded = key.encode("utf-8")
+                _put_varint(out, len(encoded))
+                out += encoded
+                _put_varint(out, len(data))
+                out += data
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "wb") as index_file:
+            index_file.write(out)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temporary, self.index_path)
+
+    def load_index(self) -> bool:
+        """Load the index written by :meth:`seal`; False if it is unusable."""
+        try:
+            with open(self.index_path, "rb") as index_file:
+                data = index_file.read()
+        except OSError:
+            return False
+        if not data.startswith(_INDEX_MAGIC):
+            return False
+        try:
+            pos = len(_INDEX_MAGIC)
+            base, pos = _get_varint(data, pos)
+            count, pos = _get_varint(data, pos)
+            size, pos = _get_varint(data, pos)
+            if base != self.base or size != os.path.getsize(self.path):
+                return False
+            end = pos + count * self.offsets.itemsize
+            self.offsets.frombytes(data[pos:end])
+            pos = end
+            loaded: List[Dict[str, Postings]] = []
+            for _ in range(3):
+                lists: Dict[str, Postings] = {}
+                entries, pos = _get_varint(data, pos)
+                for _ in range(entries):
+                    length, pos = _get_varint(data, pos)
+                    key = data[pos:pos + length].decode("utf-8")
+                    pos += length
+                    length, pos = _get_varint(data, pos)
+                    lists[key] = data[pos:pos + length]
+                    pos += length
+                loaded.append(lists)
+        except (IndexError, UnicodeDecodeError, ValueError):
+            self.offsets = array("Q")
+            return False
+        self.terms = loaded[0]
+        self.conversations = loaded[1]
+        self.owners = loaded[2]
+        self.size = size
+        return True
+
+
+class ConversationJournal:
+    """Segmented message log with an incrementally built search index."""
+
+    def __init__(self, directory: str, segment_bytes: int = 8 * 1024 * 1024,
+                 sync_interval: Optional[float] = 0.05):
+        """
+        Open the journal, creating the directory if needed.
+
+        Args:
+            directory: Directory holding the segment and index files
+            segment_bytes: Size at which the active segment is sealed
+            sync_interval: Seconds between batched fsyncs; None to fsync
+                only on :meth:`sync` and :meth:`close`
+
+        Raises:
+            RuntimeError: If another journal (in this or another process)
+                has the directory open
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, "LOCK"), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as exc:
+            os.close(self._lock_fd)
+            raise RuntimeError(
+                f"Journal directory {directory} is already in use by another "
+                "journal; only one process may open it"
+            ) from exc
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_interval = sync_interval
+        self.syncs = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._segments: List[_Segment] = []
+        self._open_segments()
+        self._stop = threading.Event()
+        self._sync_thread = None
+        if sync_interval is not None:
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop, name="journal-sync", daemon=True
+            )
+            self._sync_thread.start()
+
+    def _open_segments(self) -> None:
+        numbers = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith(".log") and name[:-4].isdigit()
+        )
+        base = 0
+        for position, number in enumerate(numbers):
+            segment = _Segment(self.directory, number, base)
+            last = position == len(numbers) - 1
+            if last or not segment.load_index():
+                self._scan(segment, truncate=last)
+                if not last:
+                    segment.seal()
+            segment.read_fd = os.open(segment.path, os.O_RDONLY)
+            self._segments.append(segment)
+            base += len(segment.offsets)
+        if numbers:
+            active = self._segments[-1]
+            active.fd = os.open(active.path, os.O_RDWR | os.O_APPEND)
+        else:
+            self._start_segment(1, 0)
+
+    def _scan(self, segment: _Segment, truncate: bool) -> None:
+        """Index a segment's records, dropping a torn write at its end."""
+        with open(segment.path, "rb") as log:
+            data = log.read()
+        pos = 0
+        while pos + _HEADER.size <= len(data):
+            length, checksum = _HEADER.unpack_from(data, pos)
+            start = pos + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            record = json.loads(payload)
+            segment.add(pos, record["c"], record.get("o", ""), tokenize(record["t"]))
+            pos = start + length
+        segment.size = pos
+        if truncate and pos < len(data):
+            os.truncate(segment.path, pos)
+
+    def _start_segment(self, number: int, base: int) -> None:
+        segment = _Segment(self.directory, number, base)
+        segment.fd = os.open(
+            segment.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644
+        )
+        segment.read_fd = os.open(segment.path, os.O_RDONLY)
+        self._segments.append(segment)
+
+    def __len__(self) -> int:
+        """Number of messages in the journal."""
+        with self._lock:
+            active = self._segments[-1]
+            return active.base + len(active.offsets)
+
+    def append(self, conversation: str, message: Dict[str, str],
+               owner: str = "") -> int:
+        """
+        Append a message and index it.
+
+        Args:
+            conversation: Conversation id
+            message: Message with "role" and "content" keys
+            owner: User the message belongs to
+
+        Returns:
+            The message id
+        """
+        payload = json.dumps(
+            {"c": conversation, "o": owner, "r": message["role"],
+             "t": message["content"], "ts": time.time()},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        terms = tokenize(message["content"])
+        with self._lock:
+            active = self._segments[-1]
+            if active.offsets and active.size + len(record) > self.segment_bytes:
+                active = self._rotate()
+            _write_all(active.fd, record)
+            active.add(active.size, conversation, owner, terms)
+            active.size += len(record)
+            self._dirty = True
+            return active.base + len(active.offsets) - 1
+
+    def _rotate(self) -> _Segment:
+        active = self._segments[-1]
+        os.fsync(active.fd)
+        os.close(active.fd)
+        active.fd = None
+        active.seal()
+        self._start_segment(active.number + 1, active.base + len(active.offsets))
+        return self._segments[-1]
+
+    def sync(self) -> None:
+        """Flush appended messages to disk."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # fsync a duplicate so appends can continue meanwhile
+            fd = os.dup(self._segments[-1].fd)
+        try:
+            os.fsync(fd)
+            self.syncs += 1
+        finally:
+            os.close(fd)
+
+    def _sync_loop(self) -> None:
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def _read(self, segment: _Segment, local: int) -> dict:
+        offset = segment.offsets[local]
+        length, _ = _HEADER.unpack(os.pread(segment.read_fd, _HEADER.size, offset))
+        return json.loads(os.pread(segment.read_fd, length, offset + _HEADER.size))
+
+    def load_messages(self, conversation: str, limit: Optional[int] = None,
+                      owner: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Load a conversation, reading only its own records.
+
+        Args:
+            conversation: Conversation id
+            limit: Load only this many of the latest messages
+            owner: Load only this owner's messages; None loads everyone's
+
+        Returns:
+            Messages in the order they were appended
+        """
+        located = []
+        with self._lock:
+            for segment in reversed(self._segments):
+                lists = [segment.conversations.get(conversation)]
+                if owner is not None:
+                    lists.append(segment.owners.get(owner))
+                if any(postings is None for postings in lists):
+                    continue
+                locals_ = _intersect([_frozen(postings) for postings in lists])
+                located.extend((segment, local) for local in reversed(locals_))
+                if limit is not None and len(located) >= limit:
+                    del located[limit:]
+                    break
+        records = [self._read(segment, local) for segment, local in located]
+        return [{"role": r["r"], "content": r["t"]} for r in reversed(records)]
+
+    def search(self, query: str, limit: int = 20,
+               owner: Optional[str] = None) -> List[SearchHit]:
+        """
+        Find messages containing every word of a query.
+
+        Args:
+            query: Words to search for (case-insensitive)
+            limit: Most hits to return
+            owner: Search only this owner's messages; None searches everyone's
+
+        Returns:
+            Matching messages, newest first
+        """
+        terms = tokenize(query)
+        hits: List[SearchHit] = []
+        if not terms:
+            return hits
+        # Copy the matching posting lists, then read without the lock
+        with self._lock:
+            candidates = []
+            for segment in reversed(self._segments):
+                lists = [segment.terms.get(term) for term in terms]
+                if owner is not None:
+                    lists.append(segment.owners.get(owner))
+                if all(postings is not None for postings in lists):
+                    candidates.append(
+                        (segment, [_frozen(postings) for postings in lists])
+                    )
+        for segment, lists in candidates:
+            for local in reversed(_intersect(lists)):
+                record = self._read(segment, local)
+                hits.append(SearchHit(
+                    segment.base + local, record["c"], record["r"], record["t"],
+                    record["ts"],
+                ))
+                if len(hits) >= limit:
+                    return hits
+        return hits
+
+    def close(self) -> None:
+        """Stop the sync thread, flush to disk and close the files."""
+        self._stop.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        with self._lock:
+            for segment in self._segments:
+                if segment.fd is not None:
+                    os.fsync(segment.fd)
+                    os.close(segment.fd)
+                    segment.fd = None
+                if segment.read_fd is not None:
+                    os.close(segment.read_fd)
+                    segment.read_fd = None
+            self._dirty = False
+            if self._lock_fd is not None:
+                # Closing the file releases the directory lock
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+def get_conversation_id(session_state: MutableMapping, query_params: MutableMapping,
+                        new: bool = False) -> str:
+    """
+    Return the id the current conversation is journaled under.
+
+    The id is carried in the page URL, next to the session id, so the
+    conversation is resumed after a server restart.
+
+    Args:
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+        new: Start a new conversation, e.g. when the chat is cleared
+
+    Returns:
+        The conversation id
+    """
+    conversation = None
+    if not new:
+        conversation = (session_state.get("conversation_id")
+                        or query_params.get(CONVERSATION_PARAM))
+    if not conversation:
+        conversation = uuid.uuid4().hex
+    session_state["conversation_id"] = conversation
+    if query_params.get(CONVERSATION_PARAM) != conversation:
+        query_params[CONVERSATION_PARAM] = conversation
+    return conversation
+
+
+def journal_owner(session_state: Mapping) -> Optional[str]:
+    """
+    Return the owner a session's messages are journaled under.
+
+    Args:
+        session_state: ``st.session_state``, with the "user_id" from
+            :func:`src.quotas.get_user_id`
+
+    Returns:
+        The signed-in user's id, or None for anonymous sessions, which are
+        not journaled
+    """
+    return session_state.get("user_id") or None
+
+
+def persist_message(session_state: Mapping, message: Dict[str, str]) -> None:
+    """
+    Save a new message of the current conversation, where enabled.
+
+    The shared store keeps it for the session; the journal keeps it for
+    the session's signed-in user.
+
+    Args:
+        session_state: ``st.session_state``
+        message: Message appended to the chat history
+    """
+    store = get_shared_store()
+    if store is not None:
+        store.append_message(session_state["session_id"], message)
+    journal = get_journal()
+    owner = journal_owner(session_state)
+    if journal is not None and owner is not None:
+        journal.append(session_state["conversation_id"], message, owner)
+
+
+def switch_conversation(session_state: MutableMapping, query_params: MutableMapping,
+                        conversation: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Make one of the owner's journaled conversations the current one.
+
+    Args:
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+        conversation: Conversation to resume
+
+    Returns:
+        The owner's messages in it, or None (and nothing switched) if the
+        owner has no messages there or the session is anonymous
+    """
+    owner = journal_owner(session_state)
+    if owner is None:
+        return None
+    messages = get_journal().load_messages(conversation, owner=owner)
+    if not messages:
+        return None
+    session_state["conversation_id"] = conversation
+    query_params[CONVERSATION_PARAM] = conversation
+    store = get_shared_store()
+    if store is not None:
+        # Other processes resume this session with the opened conversation
+        store.clear_messages(session_state["session_id"])
+        for message in messages:
+            store.append_message(session_state["session_id"], message)
+    return messages
+
+
+def saved_messages(session_state: MutableMapping,
+                   query_params: MutableMapping) -> List[Dict[str, str]]:
+    """
+    Return the owner's journaled messages of the current conversation.
+
+    Args:
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+
+    Returns:
+        The messages, oldest first; empty if journaling is disabled or the
+        session is anonymous
+    """
+    journal = get_journal()
+    owner = journal_owner(session_state)
+    if journal is None or owner is None:
+        return []
+    return journal.load_messages(
+        get_conversation_id(session_state, query_params), owner=owner
+    )
+
+
+def new_conversation(session_state: MutableMapping,
+                     query_params: MutableMapping) -> None:
+    """
+    Journal the following messages under a new conversation, if enabled.
+
+    Args:
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+    """
+    if get_journal() is not None:
+        get_conversation_id(session_state, query_params, new=True)
+
+
+def _open_result(session_state: MutableMapping, query_params: MutableMapping,
+                 conversation: str,
+                 on_open: Callable[[List[Dict[str, str]]], None]) -> None:
+    messages = switch_conversation(session_state, query_params, conversation)
+    if messages is not None:
+        on_open(messages)
+
+
+def render_search(sidebar, session_state: MutableMapping, query_params: MutableMapping,
+                  on_open: Callable[[List[Dict[str, str]]], None], label: str,
+                  title: Optional[str] = None, limit: int = 10) -> None:
+    """
+    Render full-text search over the owner's past conversations.
+
+    Does nothing if journaling is disabled or the session is anonymous.
+    Otherwise it also sets the current conversation id, which
+    :func:`persist_message` journals under.
+
+    Args:
+        sidebar: ``st.sidebar``
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+        on_open: Called with the messages of a conversation once it is
+            opened from the results
+        label: Label of the search box
+        title: Optional subheader above the search box
+        limit: Most matching messages listed
+    """
+    journal = get_journal()
+    owner = journal_owner(session_state)
+    if journal is None or owner is None:
+        return
+    current = get_conversation_id(session_state, query_params)
+    if title:
+        sidebar.subheader(title)
+    query = sidebar.text_input(label, key="journal_query")
+    if not query:
+        return
+    with span("journal_search"):
+        hits = journal.search(query, limit=limit, owner=owner)
+    if not hits:
+        sidebar.caption("No matching messages.")
+    for hit in hits:
+        sidebar.caption(f"{hit.role}: {hit.content[:120]}")
+        sidebar.button(
+            "Open conversation",
+            key=f"open_{hit.message_id}",
+            on_click=_open_result,
+            args=(session_state, query_params, hit.conversation, on_open),
+            disabled=hit.conversation == current,
+        )
+
+
+_journal: Optional[ConversationJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> Optional[ConversationJournal]:
+    """
+    Return the process-wide conversation journal.
+
+    Enabled by setting CHAT_JOURNAL_DIR; CHAT_JOURNAL_SYNC_SECONDS sets the
+    interval between batched fsyncs.
+
+    Returns:
+        The journal, or None if journaling is disabled
+    """
+    global _journal  # pylint: disable=global-statement
+    if _journal is None:
+        directory = os.getenv("CHAT_JOURNAL_DIR")
+        if not directory:
+            return None
+        interval = float(os.getenv("CHAT_JOURNAL_SYNC_SECONDS", "0.05"))
+        with _journal_lock:
+            if _journal is None:
+                _journal = ConversationJournal(directory, sync_interval=interval)
+    return _journal
@@ -0,0 +1,352 @@
+"""
+Map-reduce answering over documents too long for one prompt.
+
+A long pasted text or an uploaded file is split into token-sized chunks
+while it is read, so a large file is never decoded into one string. Every
+chunk is sent to the model concurrently (map) with the user's question,
+through one shared client and the token rate limiter, and the partial
+answers are combined (reduce) into a single response. Wall-clock time
+grows with the number of chunks divided by the number of workers rather
+than with the document length.
+"""
+
+import codecs
+import io
+import mmap
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.token_budget import (
+    CHARS_PER_TOKEN,
+    CompletionLengthPredictor,
+    TokenRateLimiter,
+    budgeted_completion,
+    estimate_tokens,
+)
+
+# Prompts longer than this are answered with map-reduce
+LONG_INPUT_TOKENS = 3000
+# Size of each document chunk sent in one map request
+CHUNK_TOKENS = 2000
+# Largest partial answer per chunk, and largest final answer
+MAP_ANSWER_TOKENS = 300
+REDUCE_ANSWER_TOKENS = 1000
+# Concurrent map requests per document
+MAX_WORKERS = 8
+# Files at least this large are memory-mapped instead of read in blocks
+MMAP_MIN_BYTES = 8 * 1024 * 1024
+READ_BLOCK_BYTES = 256 * 1024
+
+DEFAULT_QUESTION = "Summarize the document."
+
+MAP_PROMPT = (
+    "You are reading one part of a longer document. Using only this part, "
+    "answer the question or extract everything relevant to it. If the part "
+    "contains nothing relevant, reply with 'Nothing relevant.'"
+)
+REDUCE_PROMPT = (
+    "You are given notes taken from consecutive parts of one document. "
+    "Combine them into a single, well-structured answer to the question. "
+    "Ignore parts marked 'Nothing relevant.' and do not mention the parts."
+)
+
+
+def is_long_input(text: str, threshold: Optional[int] = None) -> bool:
+    """
+    Decide whether a prompt needs map-reduce.
+
+    Args:
+        text: Prompt text
+        threshold: Token threshold (defaults to LONG_INPUT_TOKENS or the
+            LONG_INPUT_TOKENS environment variable)
+
+    Returns:
+        True if the prompt is too long to send as one message
+    """
+    if threshold is None:
+        threshold = int(os.getenv("LONG_INPUT_TOKENS", str(LONG_INPUT_TOKENS)))
+    return estimate_tokens(text) > threshold
+
+
+def split_question(text: str) -> Tuple[str, str]:
+    """
+    Separate a leading question from pasted document text.
+
+    A short first line ending in "?" or ":" (such as "Summarize this:")
+    is taken as the question; otherwise the document is summarized.
+
+    Args:
+        text: Pasted prompt
+
+    Returns:
+        (question, document)
+    """
+    first, _, rest = text.partition("\n")
+    first = first.strip()
+    if rest.strip() and len(first) <= 300 and first.endswith(("?", ":")):
+        return first, rest
+    return DEFAULT_QUESTION, text
+
+
+def split_chunks(
+    pieces: Iterable[str], chunk_tokens: int = CHUNK_TOKENS
+) -> Iterator[str]:
+    """
+    Re-cut a stream of text pieces into chunks of about ``chunk_tokens``.
+
+    Chunks end at a paragraph break, line break or space in the second
+    half of the chunk when there is one, so words are not split.
+
+    Args:
+        pieces: Text in any number of pieces
+        chunk_tokens: Target chunk size in tokens
+
+    Yields:
+        Non-empty chunks, in order
+    """
+    size = chunk_tokens * CHARS_PER_TOKEN
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        start = 0
+        while len(buffer) - start >= size:
+            end = start + size
+            cut = end
+            for separator in ("\n\n", "\n", " "):
+                position = buffer.rfind(separator, start + size // 2, end)
+                if position != -1:
+                    cut = position + len(separator)
+                    break
+            chunk = buffer[start:cut]
+            start = cut
+            if chunk.strip():
+                yield chunk
+        # Keep only the unfinished chunk; slicing once per piece stays linear
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer
+
+
+def _iter_blocks(source) -> Iterator[bytes]:
+    """Yield the bytes of a file-like object without loading it whole."""
+    if hasattr(source, "getbuffer"):
+        # In-memory files (including Streamlit uploads): read the existing
+        # buffer block by block instead of copying it whole with read()
+        with source.getbuffer() as view:
+            for start in range(0, len(view), READ_BLOCK_BYTES):
+                yield bytes(view[start:start + READ_BLOCK_BYTES])
+        return
+    try:
+        size = os.fstat(source.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        size = 0
+    if size >= MMAP_MIN_BYTES:
+        # Pages are read on demand and dropped by the OS, not kept on the heap
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, size, READ_BLOCK_BYTES):
+                yield mapped[start:start + READ_BLOCK_BYTES]
+        return
+    while True:
+        block = source.read(READ_BLOCK_BYTES)
+        if not block:
+            return
+        yield block
+
+
+def iter_document_chunks(
+    source, chunk_tokens: int = CHUNK_TOKENS
+) -> Iterator[str]:
+    """
+    Stream a UTF-8 document as token-sized chunks.
+
+    Args:
+        source: Text, a binary file-like object (e.g. a Streamlit upload)
+            or a ``pathlib.Path``
+        chunk_tokens: Target chunk size in tokens
+
+    Yields:
+        Document chunks, in order
+    """
+    if isinstance(source, str):
+        yield from split_chunks([source], chunk_tokens)
+        return
+    if isinstance(source, os.PathLike):
+        with open(source, "rb") as document:
+            yield from iter_document_chunks(document, chunk_tokens)
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pieces = (decoder.decode(block) for block in _iter_blocks(source))
+    yield from split_chunks(pieces, chunk_tokens)
+    tail = decoder.decode(b"", final=True)
+    if tail.strip():
+        yield tail
+
+
+def estimate_chunk_count(source, chunk_tokens: int = CHUNK_TOKENS) -> int:
+    """
+    Estimate how many chunks a document yields, for progress display.
+
+    Args:
+        source: Same as for :func:`iter_document_chunks`
+        chunk_tokens: Target chunk size in tokens
+
+    Returns:
+        Estimated chunk count (at least 1)
+    """
+    if isinstance(source, str):
+        length = len(source)
+    elif isinstance(source, os.PathLike):
+        length = os.path.getsize(source)
+    elif hasattr(source, "size"):
+        length = source.size
+    elif hasattr(source, "getbuffer"):
+        length = source.getbuffer().nbytes
+    else:
+        length = 0
+    return max(1, -(-length // (chunk_tokens * CHARS_PER_TOKEN)))
+
+
+@dataclass
+class MapReduceResult:
+    """Outcome of a map-reduce answer."""
+
+    content: str
+    chunks: int
+    reduce_rounds: int
+
+
+def _complete(client, system: str, user: str, ceiling: int, app: str,
+              limiter: Optional[TokenRateLimiter], kwargs: dict) -> str:
+    prompt_class = CompletionLengthPredictor.classify(user, app=app)
+    result = budgeted_completion(
+        client,
+        [{"role": "system", "content": system}, {"role": "user", "content": user}],
+        prompt_class,
+        ceiling=ceiling,
+        limiter=limiter,
+        **kwargs,
+    )
+    return result.content
+
+
+def map_reduce(
+    client,
+    chunks: Iterable[str],
+    question: str,
+    max_workers: Optional[int] = None,
+    limiter: Optional[TokenRateLimiter] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    total_hint: int = 0,
+    **kwargs,
+) -> MapReduceResult:
+    """
+    Answer a question about a long document.
+
+    Chunks are pulled from the iterator only as workers free up, so at most
+    ``2 * max_workers`` chunks are held in memory. ``on_progress`` is
+    called from the calling thread, which makes it safe to update
+    Streamlit elements from it.
+
+    Args:
+        client: OpenAI client shared by all workers
+        chunks: Document chunks, e.g. from :func:`iter_document_chunks`
+        question: What to answer about the document
+        max_workers: Concurrent requests (defaults to MAX_WORKERS or the
+            LONG_INPUT_WORKERS environment variable)
+        limiter: Token rate limiter (defaults to the process-wide one, if any)
+        on_progress: Called with (completed requests, expected requests)
+        total_hint: Expected number of chunks, for progress display
+        **kwargs: Extra arguments for ``chat.completions.create``
+
+    Returns:
+        The combined answer
+
+    Raises:
+        ValueError: If there are no chunks
+    """
+    if max_workers is None:
+        max_workers = int(os.getenv("LONG_INPUT_WORKERS", str(MAX_WORKERS)))
+    partials: Dict[int, str] = {}
+    done = 0
+    submitted = 0
+
+    def report(expected: int) -> None:
+        if on_progress is not None:
+            on_progress(done, max(expected, submitted))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending: Dict[Future, int] = {}
+
+        def collect(block: bool) -> None:
+            nonlocal done
+            finished, _ = wait(list(pending), timeout=None if block else 0,
+                               return_when=FIRST_COMPLETED)
+            for future in finished:
+                partials[pending.pop(future)] = future.result()
+                done += 1
+                report(total_hint)
+
+        for index, chunk in enumerate(chunks):
+            user = f"Question: {question}\n\nDocument part {index + 1}:\n{chunk}"
+            future = executor.submit(
+                _complete, client, MAP_PROMPT, user, MAP_ANSWER_TOKENS,
+                "long_input:map", limiter, kwargs,
+            )
+            pending[future] = index
+            submitted += 1
+            collect(block=len(pending) >= 2 * max_workers)
+        while pending:
+            collect(block=True)
+        if not submitted:
+            raise ValueError("The document is empty")
+
+        notes = [partials[i] for i in range(submitted)]
+        rounds = 0
+        previous_groups = len(notes) + 1
+        # Reduce in groups that fit one prompt until one group is left
+        while True:
+            rounds += 1
+            groups = _group_notes(notes, CHUNK_TOKENS)
+            # A round that did not shrink the notes would never finish
+            if len(groups) == 1 or len(groups) >= previous_groups:
+                user = f"Question: {question}\n\nNotes:\n" + "\n".join(groups)
+                content = _complete(
+                    client, REDUCE_PROMPT, user, REDUCE_ANSWER_TOKENS,
+                    "long_input:reduce", limiter, kwargs,
+                )
+                done += 1
+                report(submitted + 1)
+                return MapReduceResult(content, submitted, rounds)
+            futures = [
+                executor.submit(
+                    _complete, client, REDUCE_PROMPT,
+                    f"Question: {question}\n\nNotes:\n{group}",
+                    MAP_ANSWER_TOKENS, "long_input:reduce", limiter, kwargs,
+                )
+                for group in groups
+            ]
+            notes = [future.result() for future in futures]
+            previous_groups = len(groups)
+    finally:
+        # Stop queued work if the caller is interrupted (e.g. Stop clicked)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _group_notes(notes: List[str], group_tokens: int) -> List[str]:
+    """Join consecutive notes into groups of at most ``group_tokens``."""
+    groups: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for number, note in enumerate(notes, 1):
+        text = f"[Part {number}]\n{note.strip()}\n"
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > group_tokens:
+            groups.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    groups.append("\n".join(current))
+    return groups
@@ -3,16 +3,41 @@ Example of using OpenAI API with environment variables.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from src.async_bridge import loop_resource
+from src.http_replay import ReplayTransport, get_env_transport
+from src.quotas import quota_limiter
+from src.scheduler import BULK, INTERACTIVE, limiter_for
+from src.token_budget import estimate_prompt_tokens, estimate_tokens
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+def _api_key(replaying: bool) -> str:
+    """Return the configured API key, or a placeholder when replaying."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if replaying:
+        return api_key or "sk-replay"
+    if not api_key or api_key == "your_actual_api_key_here":
+        raise ValueError(
+            "OPENAI_API_KEY not found or not set properly. "
+            "Please set it in your .env file."
+        )
+    return api_key
+
+
 def get_openai_client():
     """
     Create and return an OpenAI client using API key from environment.
+
+    If OPENAI_REPLAY_FIXTURE or OPENAI_RECORD_FIXTURE is set, the client's
+    HTTP traffic goes through the matching transport from
+    :mod:`src.http_replay`; replaying needs no API key.
     
     Returns:
         OpenAI: Configured OpenAI client
@@ -20,39 +45,225 @@ def get_openai_client():
     Raises:
         ValueError: If OPENAI_API_KEY is not set
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_actual_api_key_here":
-        raise ValueError(
-            "OPENAI_API_KEY not found or not set properly. "
-            "Please set it in your .env file."
-        )
-    
+    transport = get_env_transport()
+    api_key = _api_key(isinstance(transport, ReplayTransport))
+    if transport is not None:
+        return OpenAI(api_key=api_key, http_client=httpx.Client(transport=transport))
     return OpenAI(api_key=api_key)
 
 
-def simple_chat_completion(prompt: str) -> str:
+def async_get_client() -> AsyncOpenAI:
+    """
+    Create an asyncio OpenAI client, configured like :func:`get_openai_client`.
+
+    The client's connection pool belongs to the event loop it is first
+    used on; from Streamlit, use it on the loop of
+    :mod:`src.async_bridge`.
+    
+    Returns:
+        AsyncOpenAI: Configured async client
+        
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    transport = get_env_transport()
+    api_key = _api_key(isinstance(transport, ReplayTransport))
+    if transport is not None:
+        return AsyncOpenAI(
+            api_key=api_key, http_client=httpx.AsyncClient(transport=transport)
+        )
+    return AsyncOpenAI(api_key=api_key)
+
+
+def simple_chat_completion(prompt: str, priority: str = INTERACTIVE,
+                           session: Optional[str] = None) -> str:
     """
     Get a simple chat completion from OpenAI.
     
+    When OPENAI_MAX_CONCURRENT_REQUESTS is set, the request waits for a
+    slot from the process-wide scheduler in its priority class.
+    
     Args:
         prompt: The user prompt
+        priority: Priority class (INTERACTIVE, PREFETCH or BULK)
+        session: Session or job the request is fairly queued under
         
     Returns:
         The AI response
     """
     client = get_openai_client()
+    messages = [
+        {"role": "user", "content": prompt}
+    ]
+    max_tokens = 150
     
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=150
-    )
+    limiter = limiter_for(priority, session)
+    reservation = None
+    if limiter is not None:
+        reservation = limiter.acquire(estimate_prompt_tokens(messages) + max_tokens)
+    used = None
+    try:
+        response = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        total = getattr(getattr(response, "usage", None), "total_tokens", None)
+        used = total if isinstance(total, int) else None
+    finally:
+        if reservation is not None:
+            limiter.release(reservation, used)
     
     return response.choices[0].message.content
 
 
+def batch_chat_completion(prompts: List[str], max_workers: int = 4,
+                          session: str = "batch") -> List[str]:
+    """
+    Answer many prompts as bulk work.
+    
+    Requests run concurrently but in the BULK class, so with the scheduler
+    enabled they never delay interactive chat requests on the same key.
+    
+    Args:
+        prompts: User prompts
+        max_workers: Requests sent at once
+        session: Job name the requests are fairly queued under
+        
+    Returns:
+        The AI responses, in prompt order
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda prompt: simple_chat_completion(prompt, BULK, session), prompts
+        ))
+
+
+def shared_async_client() -> AsyncOpenAI:
+    """
+    Return the running event loop's async client, creating it once.
+
+    Reusing one client per loop keeps its connection pool warm; the
+    background loop of :mod:`src.async_bridge` closes it on shutdown.
+    Call from a coroutine.
+
+    Returns:
+        AsyncOpenAI: Client for the current configuration
+    """
+    key = ("openai", get_env_transport(), os.getenv("OPENAI_API_KEY"),
+           os.getenv("OPENAI_BASE_URL"))
+    return loop_resource(key, async_get_client)
+
+
+async def _acquire(limiter, tokens: int):
+    """Reserve from a limiter without blocking the event loop or a thread."""
+    if limiter is None:
+        return None
+    return await limiter.acquire_async(tokens)
+
+
+async def async_chat_completion(prompt: str, client: Optional[AsyncOpenAI] = None,
+                                priority: str = INTERACTIVE,
+                                session: Optional[str] = None,
+                                user: Optional[str] = None) -> str:
+    """
+    Get a simple chat completion without holding a thread while it runs.
+    
+    Args:
+        prompt: The user prompt
+        client: Async client to use (defaults to the loop's shared one)
+        priority: Priority class (INTERACTIVE, PREFETCH or BULK)
+        session: Session or job the request is fairly queued under, and
+            whose quota it counts against
+        user: Signed-in user whose quota it counts against
+        
+    Returns:
+        The AI response
+        
+    Raises:
+        QuotaExceeded: If the request is over the session's or user's quota
+    """
+    client = client or shared_async_client()
+    messages = [{"role": "user", "content": prompt}]
+    max_tokens = 150
+    
+    limiter = quota_limiter(limiter_for(priority, session), session, user)
+    reservation = await _acquire(limiter, estimate_prompt_tokens(messages) + max_tokens)
+    used = None
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        total = getattr(getattr(response, "usage", None), "total_tokens", None)
+        used = total if isinstance(total, int) else None
+    finally:
+        if reservation is not None:
+            limiter.release(reservation, used)
+    
+    return response.choices[0].message.content
+
+
+async def async_stream_chat_completion(
+    prompt: str,
+    client: Optional[AsyncOpenAI] = None,
+    priority: str = INTERACTIVE,
+    session: Optional[str] = None,
+    user: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion as text deltas.
+    
+    Closing the generator early (e.g. via
+    :func:`src.async_bridge.iterate_async` when the script is rerun)
+    closes the HTTP response.
+    
+    Args:
+        prompt: The user prompt
+        client: Async client to use (defaults to the loop's shared one)
+        priority: Priority class (INTERACTIVE, PREFETCH or BULK)
+        session: Session or job the request is fairly queued under, and
+            whose quota it counts against
+        user: Signed-in user whose quota it counts against
+        
+    Yields:
+        Text deltas as they arrive
+        
+    Raises:
+        QuotaExceeded: If the request is over the session's or user's quota
+    """
+    client = client or shared_async_client()
+    messages = [{"role": "user", "content": prompt}]
+    max_tokens = 150
+    prompt_estimate = estimate_prompt_tokens(messages)
+    
+    limiter = quota_limiter(limiter_for(priority, session), session, user)
+    reservation = await _acquire(limiter, prompt_estimate + max_tokens)
+    text = ""
+    used = None
+    try:
+        stream = await client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    used = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+    finally:
+        if reservation is not None:
+            limiter.release(
+                reservation, used or prompt_estimate + estimate_tokens(text)
+            )
+
+
 if __name__ == "__main__":
     try:
         # Example usage
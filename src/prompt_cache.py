@@ -0,0 +1,141 @@
+"""
+Cache-friendly chat history layout and prompt cache hit reporting.
+
+The API caches prompt prefixes: when a request starts with the same
+tokens as a recent one (at least 1024 of them), the shared prefix is not
+processed again, which shortens time to first token and is reported as
+``usage.prompt_tokens_details.cached_tokens``. A history window that
+slides by one message per turn changes the prompt right after the system
+prompt, so nothing past it is ever reused.
+
+:func:`block_window` instead moves the start of the window in whole
+blocks. Between moves every prompt extends the previous one, so all of the
+earlier prompt is a cache hit; only every ``block``-th turn starts a new
+prefix. :class:`PromptCacheStats` keeps per-session totals of prompt and
+cached tokens to show how well that works.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+
+def cached_prompt_tokens(usage) -> int:
+    """
+    Read the number of cached prompt tokens from a response's usage.
+
+    Args:
+        usage: ``usage`` of a completion or of a stream's final chunk
+
+    Returns:
+        Cached prompt tokens, or 0 if the API did not report any
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    value = getattr(details, "cached_tokens", None)
+    return value if isinstance(value, int) else 0
+
+
+def block_window(history: Sequence[dict], block: int, min_window: int) -> List[dict]:
+    """
+    Select the recent history to send, moving its start in whole blocks.
+
+    The window starts at a multiple of ``block`` and holds at least
+    ``min_window`` messages (or all of them), so it holds between
+    ``min_window`` and ``min_window + block - 1`` messages and its first
+    message only changes once every ``block`` messages.
+
+    Args:
+        history: Full message history
+        block: Messages the window start moves by at once
+        min_window: Fewest recent messages to send
+
+    Returns:
+        Messages from the window start to the end of ``history``
+
+    Raises:
+        ValueError: If ``block`` is not positive
+    """
+    if block < 1:
+        raise ValueError("block must be at least 1")
+    excess = len(history) - min_window
+    start = (excess // block) * block if excess > 0 else 0
+    return list(history[start:])
+
+
+@dataclass(frozen=True)
+class CacheUsage:
+    """Prompt cache totals of one session."""
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Share of prompt tokens served from the cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class PromptCacheStats:
+    """Per-session prompt cache totals, keeping the most recent sessions."""
+
+    def __init__(self, max_sessions: int = 10_000):
+        """
+        Create empty statistics.
+
+        Args:
+            max_sessions: Sessions to keep; the least recently updated ones
+                are dropped beyond that
+        """
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, CacheUsage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, session: Optional[str], prompt_tokens: int,
+               cached_tokens: int) -> None:
+        """
+        Add one request's usage to its session's totals.
+
+        Args:
+            session: Session id; requests without one are not recorded
+            prompt_tokens: Prompt tokens the API reported
+            cached_tokens: How many of them were cached
+        """
+        if session is None or not prompt_tokens:
+            return
+        with self._lock:
+            usage = self._sessions.pop(session, CacheUsage())
+            self._sessions[session] = CacheUsage(
+                usage.requests + 1,
+                usage.prompt_tokens + prompt_tokens,
+                usage.cached_tokens + cached_tokens,
+            )
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def usage(self, session: str) -> CacheUsage:
+        """
+        Return a session's totals.
+
+        Args:
+            session: Session id
+
+        Returns:
+            Totals, all zero for an unknown session
+        """
+        with self._lock:
+            return self._sessions.get(session, CacheUsage())
+
+    def snapshot(self) -> Dict[str, CacheUsage]:
+        """Return the totals of every tracked session."""
+        with self._lock:
+            return dict(self._sessions)
+
+
+_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """Return the process-wide prompt cache statistics."""
+    return _stats
@@ -0,0 +1,502 @@
+"""
+Per-session and per-user request and token quotas.
+
+Each session (and each signed-in user) gets a budget of requests and
+tokens per window. Anonymous users only have their session's quota: a
+client address is shared by everyone behind the same proxy or NAT. Usage
+is tracked with sliding-window counters approximated from two fixed
+buckets: the count over the last
+window is the current bucket plus the previous bucket weighted by how much
+of it still overlaps the window. That needs two numbers per limit and
+constant work per request, however many sessions there are; counters of
+idle sessions are dropped as new requests arrive.
+
+A request over quota waits when its quota frees up within ``max_wait``
+seconds and is otherwise rejected with :class:`QuotaExceeded`, which says
+how long to wait before trying again.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Tolerance for float rounding when comparing against limits
+_EPSILON = 1e-9
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request does not fit its session's or user's quota."""
+
+    def __init__(self, scope: str, resource: str, retry_after: float):
+        """
+        Describe the exhausted quota.
+
+        Args:
+            scope: "session" or "user"
+            resource: "requests" or "tokens"
+            retry_after: Seconds until the request would be admitted
+        """
+        self.scope = scope
+        self.resource = resource
+        self.retry_after = retry_after
+        seconds = max(1, math.ceil(retry_after))
+        super().__init__(
+            f"You have reached the {resource} limit for this {scope}. "
+            f"Please try again in {seconds} second{'s' if seconds != 1 else ''}."
+        )
+
+
+@dataclass(frozen=True)
+class QuotaLimits:
+    """Requests and tokens allowed per window; None means unlimited."""
+
+    requests: Optional[int] = None
+    tokens: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        """True if any limit is set."""
+        return self.requests is not None or self.tokens is not None
+
+
+class SlidingWindow:
+    """Request and token counts over a sliding window, from two buckets."""
+
+    __slots__ = ("start", "current", "previous")
+
+    def __init__(self, now: float):
+        self.start = now
+        # [requests, tokens] of the current and the previous bucket
+        self.current = [0.0, 0.0]
+        self.previous = [0.0, 0.0]
+
+    def roll(self, now: float, window: float) -> None:
+        """Start new buckets for the time that has passed."""
+        elapsed = now - self.start
+        if elapsed >= window:
+            buckets = int(elapsed // window)
+            self.previous = self.current if buckets == 1 else [0.0, 0.0]
+            self.current = [0.0, 0.0]
+            self.start += buckets * window
+
+    def count(self, index: int, now: float, window: float) -> float:
+        """Estimated usage over the last window (0: requests, 1: tokens)."""
+        overlap = 1.0 - (now - self.start) / window
+        return self.previous[index] * overlap + self.current[index]
+
+    def retry_after(
+        self, index: int, limit: float, amount: float, now: float, window: float
+    ) -> float:
+        """
+        Seconds until ``amount`` more fits under ``limit``.
+
+        Args:
+            index: 0 for requests, 1 for tokens
+            limit: Allowed usage per window
+            amount: Usage the request adds (capped at ``limit``)
+            now: Current time
+            window: Window length in seconds
+
+        Returns:
+            Seconds to wait, 0 if it fits now
+        """
+        amount = min(amount, limit)
+        if self.count(index, now, window) + amount <= limit + _EPSILON:
+            return 0.0
+        elapsed = now - self.start
+        current, previous = self.current[index], self.previous[index]
+        if current + amount <= limit:
+            # Fits once enough of the previous bucket has slid out
+            share = (limit - current - amount) / previous
+            return max(0.0, window * (1 - share) - elapsed)
+        # Wait for the next bucket, then for this one to slide out
+        return (window - elapsed) + window * (1 - (limit - amount) / current)
+
+
+class QuotaManager:
+    """Admits requests against per-session and per-user quotas."""
+
+    def __init__(
+        self,
+        session_limits: QuotaLimits,
+        user_limits: QuotaLimits = QuotaLimits(),
+        window: float = 60.0,
+        max_wait: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Initialize the manager.
+
+        Args:
+            session_limits: Quota of every session
+            user_limits: Quota of every user, across their sessions
+            window: Window length in seconds
+            max_wait: Longest a request over quota waits before it is
+                rejected
+            clock: Monotonic clock, injectable for tests
+            sleep: Sleep function, injectable for tests
+
+        Raises:
+            ValueError: If window is not positive
+        """
+        if window <= 0:
+            raise ValueError("window must be positive")
+        self.limits = {"session": session_limits, "user": user_limits}
+        self.window = window
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        # Least recently used first, so idle counters are found in O(1)
+        self._windows: "OrderedDict[Tuple[str, str], SlidingWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _keys(self, session: str, user: Optional[str]) -> List[Tuple[str, str]]:
+        keys = []
+        if self.limits["session"].enabled:
+            keys.append(("session", session))
+        if user is not None and self.limits["user"].enabled:
+            keys.append(("user", user))
+        return keys
+
+    def _window(self, key: Tuple[str, str], now: float) -> SlidingWindow:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = SlidingWindow(now)
+        else:
+            self._windows.move_to_end(key)
+        window.roll(now, self.window)
+        return window
+
+    def _prune(self, now: float) -> None:
+        """Drop counters untouched for two windows; they count nothing."""
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if now - window.start < 2 * self.window:
+                return
+            del self._windows[key]
+
+    def try_admit(
+        self, session: str, tokens: int, user: Optional[str] = None
+    ) -> Optional[QuotaExceeded]:
+        """
+        Count a request if it fits, without waiting.
+
+        Args:
+            session: Session id
+            tokens: Tokens the request may use
+            user: User id, or None for no per-user quota
+
+        Returns:
+            None if the request was admitted, otherwise the reason it was not
+        """
+        with self._lock:
+            now = self._clock()
+            windows = [
+                (key, self._window(key, now)) for key in self._keys(session, user)
+            ]
+            refusal = None
+            for (scope, _), window in windows:
+                limits = self.limits[scope]
+                for index, resource, limit, amount in (
+                    (0, "requests", limits.requests, 1),
+                    (1, "tokens", limits.tokens, tokens),
+                ):
+                    if limit is None:
+                        continue
+                    wait = window.retry_after(index, limit, amount, now, self.window)
+                    if wait > 0 and (refusal is None or wait > refusal.retry_after):
+                        refusal = QuotaExceeded(scope, resource, wait)
+            if refusal is None:
+                for _, window in windows:
+                    window.current[0] += 1
+                    window.current[1] += tokens
+            self._prune(now)
+            return refusal
+
+    def admit(self, session: str, tokens: int, user: Optional[str] = None) -> None:
+        """
+        Count a request, waiting up to ``max_wait`` for quota to free up.
+
+        Args:
+            session: Session id
+            tokens: Tokens the request may use
+            user: User id, or None for no per-user quota
+
+        Raises:
+            QuotaExceeded: If the request does not fit within ``max_wait``
+        """
+        waited = 0.0
+        while True:
+            refusal = self.try_admit(session, tokens, user)
+            if refusal is None:
+                return
+            if waited + refusal.retry_after > self.max_wait:
+                raise refusal
+            self._sleep(refusal.retry_after)
+            waited += refusal.retry_after
+
+    async def admit_async(
+        self, session: str, tokens: int, user: Optional[str] = None
+    ) -> None:
+        """
+        Like :meth:`admit`, but waits on the event loop instead of a thread.
+
+        Args:
+            session: Session id
+            tokens: Tokens the request may use
+            user: User id, or None for no per-user quota
+
+        Raises:
+            QuotaExceeded: If the request does not fit within ``max_wait``
+        """
+        waited = 0.0
+        while True:
+            refusal = self.try_admit(session, tokens, user)
+            if refusal is None:
+                return
+            if waited + refusal.retry_after > self.max_wait:
+                raise refusal
+            await asyncio.sleep(refusal.retry_after)
+            waited += refusal.retry_after
+
+    def _adjust(
+        self, session: str, user: Optional[str], requests: int, tokens: float
+    ) -> None:
+        with self._lock:
+            now = self._clock()
+            for key in self._keys(session, user):
+                current = self._window(key, now).current
+                current[0] = max(0.0, current[0] + requests)
+                current[1] = max(0.0, current[1] + tokens)
+
+    def settle(
+        self, session: str, reserved: int, used: int, user: Optional[str] = None
+    ) -> None:
+        """
+        Replace a request's reserved tokens with the tokens it used.
+
+        Args:
+            session: Session id
+            reserved: Tokens passed to :meth:`admit`
+            used: Tokens the request actually consumed
+            user: User id, or None for no per-user quota
+        """
+        self._adjust(session, user, 0, used - reserved)
+
+    def cancel(self, session: str, tokens: int, user: Optional[str] = None) -> None:
+        """
+        Uncount an admitted request that was never sent.
+
+        Args:
+            session: Session id
+            tokens: Tokens passed to :meth:`admit`
+            user: User id, or None for no per-user quota
+        """
+        self._adjust(session, user, -1, -tokens)
+
+    def usage(
+        self, session: str, user: Optional[str] = None
+    ) -> Dict[str, Tuple[float, float]]:
+        """
+        Report current usage for display.
+
+        Args:
+            session: Session id
+            user: User id
+
+        Returns:
+            (requests, tokens) over the last window, keyed by scope
+        """
+        with self._lock:
+            now = self._clock()
+            report = {}
+            for key in self._keys(session, user):
+                window = self._window(key, now)
+                report[key[0]] = (
+                    window.count(0, now, self.window),
+                    window.count(1, now, self.window),
+                )
+            return report
+
+    def __len__(self) -> int:
+        """Number of tracked counters."""
+        return len(self._windows)
+
+
+@dataclass
+class QuotaReservation:
+    """A request admitted by :class:`QuotaLimiter`."""
+
+    tokens: int
+    inner: object = None
+    released: bool = False
+
+
+class QuotaLimiter:
+    """
+    Token limiter interface that checks quotas before an inner limiter.
+
+    Plugs into every function that takes ``limiter=``; the inner limiter
+    (the scheduler or the token rate limiter) only sees admitted requests.
+    """
+
+    def __init__(
+        self,
+        manager: QuotaManager,
+        session: str,
+        user: Optional[str] = None,
+        inner=None,
+    ):
+        self.manager = manager
+        self.session = session
+        self.user = user
+        self.inner = inner
+
+    def acquire(
+        self, tokens: int, timeout: Optional[float] = None
+    ) -> QuotaReservation:
+        """
+        Admit a request and reserve it with the inner limiter.
+
+        Args:
+            tokens: Tokens the request may use
+            timeout: Passed to the inner limiter
+
+        Returns:
+            The reservation, to be passed to :meth:`release`
+
+        Raises:
+            QuotaExceeded: If the request is over quota
+        """
+        self.manager.admit(self.session, tokens, self.user)
+        inner = None
+        if self.inner is not None:
+            try:
+                inner = self.inner.acquire(tokens, timeout=timeout)
+            except BaseException:
+                # Never sent, so it should not count
+                self.manager.cancel(self.session, tokens, self.user)
+                raise
+        return QuotaReservation(tokens, inner)
+
+    async def acquire_async(
+        self, tokens: int, timeout: Optional[float] = None
+    ) -> QuotaReservation:
+        """
+        Admit a request and reserve it, waiting on the event loop.
+
+        Args:
+            tokens: Tokens the request may use
+            timeout: Passed to the inner limiter
+
+        Returns:
+            The reservation, to be passed to :meth:`release`
+
+        Raises:
+            QuotaExceeded: If the request is over quota
+        """
+        await self.manager.admit_async(self.session, tokens, self.user)
+        inner = None
+        if self.inner is not None:
+            try:
+                inner = await self.inner.acquire_async(tokens, timeout=timeout)
+            except BaseException:
+                # Never sent (or cancelled while waiting), so it should not count
+                self.manager.cancel(self.session, tokens, self.user)
+                raise
+        return QuotaReservation(tokens, inner)
+
+    def release(
+        self, reservation: QuotaReservation, used_tokens: Optional[int] = None
+    ) -> None:
+        """Release the inner reservation and count the tokens actually used."""
+        if reservation.released:
+            return
+        reservation.released = True
+        if reservation.inner is not None:
+            self.inner.release(reservation.inner, used_tokens)
+        if used_tokens is not None:
+            self.manager.settle(
+                self.session, reservation.tokens, used_tokens, self.user
+            )
+
+
+def get_user_id(user_info) -> Optional[str]:
+    """
+    Identify the signed-in user behind a session for per-user quotas.
+
+    Args:
+        user_info: ``st.user``
+
+    Returns:
+        The signed-in user's email, or None for anonymous users
+    """
+    email = user_info.get("email") if hasattr(user_info, "get") else None
+    return f"user:{email}" if email else None
+
+
+def _limit(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+_manager: Optional[QuotaManager] = None
+_configured = False
+_manager_lock = threading.Lock()
+
+
+def get_quota_manager() -> Optional[QuotaManager]:
+    """
+    Return the process-wide quota manager as configured by the environment.
+
+    SESSION_REQUEST_QUOTA and SESSION_TOKEN_QUOTA limit each session;
+    USER_REQUEST_QUOTA and USER_TOKEN_QUOTA each user across sessions.
+    QUOTA_WINDOW_SECONDS sets the window (default 60) and QUOTA_MAX_WAIT
+    how long an over-quota request may wait (default 5 seconds).
+
+    Returns:
+        The manager, or None if no quota is set
+    """
+    global _manager, _configured  # pylint: disable=global-statement
+    if not _configured:
+        with _manager_lock:
+            if not _configured:
+                session = QuotaLimits(
+                    _limit("SESSION_REQUEST_QUOTA"), _limit("SESSION_TOKEN_QUOTA")
+                )
+                user = QuotaLimits(
+                    _limit("USER_REQUEST_QUOTA"), _limit("USER_TOKEN_QUOTA")
+                )
+                if session.enabled or user.enabled:
+                    _manager = QuotaManager(
+                        session,
+                        user,
+                        window=float(os.getenv("QUOTA_WINDOW_SECONDS", "60")),
+                        max_wait=float(os.getenv("QUOTA_MAX_WAIT", "5")),
+                    )
+                _configured = True
+    return _manager
+
+
+def quota_limiter(inner, session: Optional[str], user: Optional[str] = None):
+    """
+    Add the session's quota to a limiter.
+
+    Args:
+        inner: Limiter from :func:`src.scheduler.limiter_for` (or None)
+        session: Session id; without one no quota applies
+        user: User id from :func:`get_user_id`
+
+    Returns:
+        A quota-checking limiter when quotas are configured, else ``inner``
+    """
+    manager = get_quota_manager()
+    if manager is None or session is None:
+        return inner
+    return QuotaLimiter(manager, session, user, inner)
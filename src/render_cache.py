@@ -0,0 +1,144 @@
+"""
+Rendered-markdown cache for chat history reruns.
+
+Streamlit reruns the whole script on every interaction, so every past chat
+message goes through ``st.markdown`` again: the body is dedented, a
+Markdown proto is built and the width is validated, for text that can no
+longer change. Finalized messages carry a stable id and a content hash;
+this module keeps the built proto per content hash in a bounded LRU cache
+and enqueues it directly, so only new messages are processed per rerun.
+"""
+
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from streamlit.elements.lib.layout_utils import LayoutConfig
+from streamlit.proto.Markdown_pb2 import Markdown as MarkdownProto
+from streamlit.string_util import clean_text
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash message content.
+
+    Args:
+        text: Message content
+
+    Returns:
+        32-character hex digest
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def finalize_message(message: Dict[str, str]) -> Dict[str, str]:
+    """
+    Give a message its stable id and content hash.
+
+    Messages are immutable once appended to the history, so the hash is
+    computed once. Messages that already have both are left untouched.
+
+    Args:
+        message: Message with "role" and "content" keys (updated in place)
+
+    Returns:
+        The same message
+    """
+    if "id" not in message:
+        message["id"] = uuid.uuid4().hex
+    if "hash" not in message:
+        message["hash"] = content_hash(message["content"])
+    return message
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of Markdown protos keyed by content hash.
+
+    Shared by all sessions of a process; identical messages (such as the
+    greeting) are built once. Enqueuing copies the proto, so cached protos
+    are never mutated.
+    """
+
+    # Same layout st.markdown uses by default
+    _LAYOUT = LayoutConfig(width="stretch")
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of cached protos
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Serialized size of the cached protos
+        self.nbytes = 0
+        self._protos: "OrderedDict[str, MarkdownProto]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._protos)
+
+    def get_proto(self, message: Dict[str, str]) -> MarkdownProto:
+        """
+        Return the Markdown proto for a finalized message.
+
+        Args:
+            message: Message; finalized on the fly if it has no hash yet
+
+        Returns:
+            The cached (or newly built) proto; do not modify it
+        """
+        key = finalize_message(message)["hash"]
+        with self._lock:
+            proto = self._protos.get(key)
+            if proto is not None:
+                self._protos.move_to_end(key)
+                self.hits += 1
+                return proto
+            self.misses += 1
+
+        proto = MarkdownProto()
+        proto.body = clean_text(message["content"])
+        proto.element_type = MarkdownProto.Type.NATIVE
+        with self._lock:
+            previous = self._protos.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.ByteSize()
+            self._protos[key] = proto
+            self.nbytes += proto.ByteSize()
+            if len(self._protos) > self.maxsize:
+                _, evicted = self._protos.popitem(last=False)
+                self.nbytes -= evicted.ByteSize()
+        return proto
+
+    def render(self, container, message: Dict[str, str]) -> None:
+        """
+        Render a finalized message, equivalent to ``container.markdown``.
+
+        Args:
+            container: DeltaGenerator to render into, e.g. ``st.chat_message``
+            message: Message with "content"
+        """
+        # pylint: disable=protected-access
+        container._enqueue(
+            "markdown", self.get_proto(message), layout_config=self._LAYOUT
+        )
+
+
+_cache: Optional[RenderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """Return the process-wide render cache."""
+    global _cache  # pylint: disable=global-statement
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RenderCache()
+    return _cache
@@ -0,0 +1,274 @@
+"""
+Retrieval-augmented conversation memory.
+
+Instead of resending a fixed window of recent turns, every message is
+embedded once when it is added to the conversation and stored in a small
+per-session vector index. Each new prompt then sends only the earlier turns
+most similar to it plus the last few messages, so prompt size stays flat on
+long sessions while older facts remain recallable.
+"""
+
+import os
+import re
+import zlib
+from typing import Callable, List, Optional, Protocol, Sequence
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+
+class Embedder(Protocol):
+    """Turns texts into L2-normalized vectors."""
+
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return an array of shape (len(texts), dim)."""
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """
+    Offline embedder using the hashing trick over words and word pairs.
+
+    Deterministic across processes and needs no network, which makes it the
+    embedder for tests and a usable fallback for keyword-style recall.
+    """
+
+    def __init__(self, dim: int = 512):
+        """
+        Initialize the embedder.
+
+        Args:
+            dim: Number of hash buckets (vector dimension)
+        """
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Array of shape (len(texts), dim) with unit-length rows
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dim] += sign
+        return _normalize(vectors)
+
+
+class OpenAIEmbedder:
+    """Embedder backed by the OpenAI embeddings endpoint."""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], object],
+        model: str = "text-embedding-3-small",
+        dim: int = 1536,
+    ):
+        """
+        Initialize the embedder.
+
+        Args:
+            client_factory: Returns an OpenAI client (e.g. get_openai_client)
+            model: Embedding model name
+            dim: Dimension of the model's embeddings
+        """
+        self._client_factory = client_factory
+        self.model = model
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed texts with a single API request.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Array of shape (len(texts), dim) with unit-length rows
+        """
+        response = self._client_factory().embeddings.create(
+            model=self.model, input=list(texts)
+        )
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return _normalize(vectors)
+
+
+class VectorIndex:
+    """
+    Append-only in-memory vector index with exact cosine search.
+
+    Storage grows by doubling, so adding a vector is amortized O(1) and a
+    search is one matrix-vector product over the stored rows.
+    """
+
+    def __init__(self, dim: int, capacity: int = 64):
+        """
+        Initialize an empty index.
+
+        Args:
+            dim: Vector dimension
+            capacity: Initial number of rows allocated
+        """
+        self.dim = dim
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vectors: np.ndarray) -> None:
+        """
+        Append unit-length vectors.
+
+        Args:
+            vectors: Array of shape (n, dim)
+        """
+        needed = self._size + len(vectors)
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors))
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+        self._vectors[self._size:needed] = vectors
+        self._size = needed
+
+    def search(
+        self, query: np.ndarray, k: int, limit: Optional[int] = None
+    ) -> List[int]:
+        """
+        Find the rows most similar to a query.
+
+        Args:
+            query: Unit-length query vector
+            k: Number of results
+            limit: Only consider rows before this position
+
+        Returns:
+            Row positions, most similar first
+        """
+        size = self._size if limit is None else min(limit, self._size)
+        if size == 0 or k <= 0:
+            return []
+        scores = self._vectors[:size] @ query
+        if k >= size:
+            return [int(i) for i in np.argsort(-scores)]
+        top = np.argpartition(-scores, k)[:k]
+        return [int(i) for i in top[np.argsort(-scores[top])]]
+
+
+class ConversationMemory:
+    """
+    Per-session index over a conversation's messages.
+
+    Positions in the index match positions in the message history, so the
+    memory only has to embed messages it has not seen yet.
+    """
+
+    def __init__(self, embedder: Embedder, top_k: int = 4, recent: int = 4):
+        """
+        Initialize an empty memory.
+
+        Args:
+            embedder: Embedder used for messages and prompts
+            top_k: Earlier messages recalled per prompt
+            recent: Latest messages always sent
+        """
+        self.embedder = embedder
+        self.top_k = top_k
+        self.recent = recent
+        self.index = VectorIndex(embedder.dim)
+        self._last_text: Optional[str] = None
+        self._last_vector: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def sync(self, history: Sequence[dict]) -> None:
+        """
+        Embed any messages appended since the last call, in one batch.
+
+        Args:
+            history: Full message history
+        """
+        new = [msg["content"] for msg in history[len(self.index):]]
+        if new:
+            vectors = self.embedder.embed(new)
+            self.index.add(vectors)
+            self._last_text, self._last_vector = new[-1], vectors[-1]
+
+    def _embed_query(self, prompt: str) -> np.ndarray:
+        # The prompt was usually just added to the history; reuse its vector
+        if prompt == self._last_text:
+            return self._last_vector
+        return self.embedder.embed([prompt])[0]
+
+    def select(self, history: Sequence[dict], prompt: str) -> List[dict]:
+        """
+        Pick the messages to send along with a prompt.
+
+        Args:
+            history: Full message history
+            prompt: New user prompt
+
+        Returns:
+            Recalled earlier messages followed by the most recent ones,
+            in conversation order
+        """
+        self.sync(history)
+        split = max(0, len(history) - self.recent)
+        recalled = []
+        if split:
+            query = self._embed_query(prompt)
+            recalled = self.index.search(query, self.top_k, limit=split)
+        positions = sorted(recalled) + list(range(split, len(history)))
+        return [history[i] for i in positions]
+
+
+def create_memory_from_env(
+    client_factory: Callable[[], object]
+) -> Optional[ConversationMemory]:
+    """
+    Create a conversation memory as configured by the environment.
+
+    CHAT_RETRIEVAL_MEMORY selects the embedder ("openai" or the offline
+    "hashing"); unset or "off" disables retrieval. RETRIEVAL_TOP_K and
+    RETRIEVAL_RECENT tune how many recalled and recent messages are sent.
+
+    Args:
+        client_factory: Returns an OpenAI client for the "openai" embedder
+
+    Returns:
+        A new memory, or None if retrieval is disabled
+    """
+    mode = os.getenv("CHAT_RETRIEVAL_MEMORY", "off").lower()
+    if mode in ("", "off", "0", "false"):
+        return None
+    if mode == "hashing":
+        embedder: Embedder = HashingEmbedder()
+    elif mode == "openai":
+        embedder = OpenAIEmbedder(client_factory)
+    else:
+        raise ValueError(f"Unknown CHAT_RETRIEVAL_MEMORY embedder: {mode}")
+    return ConversationMemory(
+        embedder,
+        top_k=int(os.getenv("RETRIEVAL_TOP_K", "4")),
+        recent=int(os.getenv("RETRIEVAL_RECENT", "4")),
+    )
@@ -0,0 +1,497 @@
+"""
+Priority scheduling of API requests that share one key.
+
+Every request asks :class:`RequestScheduler` for a slot before it is sent.
+Slots are handed out by priority class (interactive, then prefetch, then
+bulk); within a class, sessions share the slots by weighted fair queuing,
+so one session with many queued requests (a batch job, a long document)
+cannot starve the others. A request that arrives while bulk work is still
+queued goes ahead of it, and bulk work may only hold part of the slots,
+so interactive requests find a free slot without waiting for a batch to
+drain.
+
+When a token rate limiter is attached, tokens are reserved at dispatch,
+in the same order, so the token budget follows the same priorities.
+:meth:`RequestScheduler.for_class` returns an object with the limiter's
+``acquire``/``release`` interface, so the scheduler plugs into every
+function that takes ``limiter=``. Coroutines wait with
+:meth:`RequestScheduler.acquire_async`, in the same queues, without
+holding a thread each.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional
+
+from src.token_budget import Reservation, TokenRateLimiter, get_rate_limiter
+
+INTERACTIVE = "interactive"
+PREFETCH = "prefetch"
+BULK = "bulk"
+# Highest priority first
+PRIORITIES = (INTERACTIVE, PREFETCH, BULK)
+
+# Wait times kept per class for the percentiles
+_WAIT_SAMPLES = 1024
+
+
+@dataclass
+class Grant:
+    """A dispatched request; pass it back to :meth:`RequestScheduler.release`."""
+
+    tokens: int
+    priority: str
+    reservation: Optional[Reservation] = None
+    released: bool = False
+
+
+@dataclass
+class ClassMetrics:
+    """Snapshot of one priority class."""
+
+    queued: int
+    running: int
+    dispatched: int
+    overtaken: int
+    mean_wait: float
+    p95_wait: float
+    max_wait: float
+
+
+class _Ticket:
+    """A request waiting in its class queue."""
+
+    __slots__ = (
+        "priority", "tokens", "finish", "enqueued", "grant", "cancelled", "waiter"
+    )
+
+    def __init__(self, priority: str, tokens: int, finish: float, enqueued: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.finish = finish
+        self.enqueued = enqueued
+        self.grant: Optional[Grant] = None
+        self.cancelled = False
+        # Future of a coroutine waiting in acquire_async, resolved at dispatch
+        self.waiter: Optional[asyncio.Future] = None
+
+    def wake(self) -> None:
+        """Resolve the waiting coroutine's future from any thread."""
+        if self.waiter is not None:
+            try:
+                self.waiter.get_loop().call_soon_threadsafe(_resolve, self.waiter)
+            except RuntimeError:
+                # Its loop is closed; nobody is waiting any more
+                pass
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _ClassQueue:
+    """Weighted fair queue of one priority class."""
+
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.queued = 0
+        self.running = 0
+        self.dispatched = 0
+        self.overtaken = 0
+        self.waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.virtual_time = 0.0
+        # Finish tag of each session's latest request
+        self.session_finish: Dict[str, float] = {}
+
+    def finish_tag(self, session: str, cost: float) -> float:
+        """Virtual finish time of a new request; also advances the session."""
+        start = max(self.virtual_time, self.session_finish.get(session, 0.0))
+        finish = start + cost
+        self.session_finish[session] = finish
+        return finish
+
+    def head(self) -> Optional[_Ticket]:
+        """First live ticket, dropping cancelled ones."""
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+    def pop(self) -> _Ticket:
+        """Remove the head ticket and advance virtual time."""
+        _, _, ticket = heapq.heappop(self.heap)
+        self.queued -= 1
+        self.virtual_time = max(self.virtual_time, ticket.finish)
+        # Sessions at or behind virtual time need no entry; pruning when the
+        # table outgrows the queue keeps it bounded at O(1) amortized cost
+        if len(self.session_finish) > 2 * self.queued + 64:
+            self.session_finish = {
+                session: finish
+                for session, finish in self.session_finish.items()
+                if finish > self.virtual_time
+            }
+        return ticket
+
+
+class RequestScheduler:
+    """
+    Hands out request slots by priority class and fair share.
+
+    Requests of a lower class are only dispatched while no request of a
+    higher class is queued; bulk requests additionally never hold more than
+    ``bulk_slots`` slots at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        limiter: Optional[TokenRateLimiter] = None,
+        bulk_slots: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrent: Requests allowed in flight at once
+            limiter: Token rate limiter reserved from at dispatch
+            bulk_slots: Slots bulk requests may hold at once (defaults to
+                half of ``max_concurrent``, at least one)
+            clock: Monotonic clock, injectable for tests
+
+        Raises:
+            ValueError: If max_concurrent is not positive
+        """
+        if max_concurrent <= 0:
+            raise ValueError("max_concurrent must be positive")
+        self.max_concurrent = max_concurrent
+        self.limiter = limiter
+        self.bulk_slots = (
+            max(1, max_concurrent // 2) if bulk_slots is None else bulk_slots
+        )
+        self._clock = clock
+        self._queues = {priority: _ClassQueue() for priority in PRIORITIES}
+        self._running = 0
+        self._sequence = itertools.count()
+        # Seconds until the head request's tokens are available, if it waits
+        self._token_wait: Optional[float] = None
+        self._cond = threading.Condition()
+
+    def _dispatch(self) -> bool:
+        """Grant slots to queued requests in order; caller holds the lock."""
+        granted = False
+        self._token_wait = None
+        for rank, priority in enumerate(PRIORITIES):
+            queue = self._queues[priority]
+            while self._running < self.max_concurrent:
+                ticket = queue.head()
+                if ticket is None:
+                    break
+                if priority == BULK and queue.running >= self.bulk_slots:
+                    break
+                reservation = None
+                if self.limiter is not None:
+                    reservation = self.limiter.try_acquire(ticket.tokens)
+                    if reservation is None:
+                        # Lower classes must not take the tokens this one waits for
+                        missing = ticket.tokens - self.limiter.available
+                        rate = self.limiter.capacity / 60.0
+                        self._token_wait = max(0.001, missing / rate)
+                        return granted
+                queue.pop()
+                now = self._clock()
+                queue.waits.append(now - ticket.enqueued)
+                queue.running += 1
+                queue.dispatched += 1
+                self._running += 1
+                ticket.grant = Grant(ticket.tokens, priority, reservation)
+                ticket.wake()
+                granted = True
+                for lower in PRIORITIES[rank + 1:]:
+                    if self._queues[lower].queued:
+                        self._queues[lower].overtaken += 1
+            if queue.queued:
+                # Nothing below this class runs while it still has work queued
+                return granted
+        return granted
+
+    def acquire(
+        self,
+        tokens: int = 0,
+        priority: str = INTERACTIVE,
+        session: Optional[str] = None,
+        weight: float = 1.0,
+        timeout: Optional[float] = None,
+    ) -> Grant:
+        """
+        Wait for a request slot.
+
+        Args:
+            tokens: Tokens the request may use (prompt + max_tokens); also
+                its cost for fair queuing
+            priority: One of INTERACTIVE, PREFETCH or BULK
+            session: Session the request belongs to; sessions of a class
+                share its slots fairly
+            weight: Relative share of the session within its class
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            The grant, to be passed to :meth:`release`
+
+        Raises:
+            ValueError: If the priority is unknown
+            TimeoutError: If no slot was granted within ``timeout``
+        """
+        with self._cond:
+            ticket = self._enqueue(tokens, priority, session, weight)
+            deadline = None if timeout is None else ticket.enqueued + timeout
+            while ticket.grant is None:
+                wait = self._token_wait
+                if deadline is not None:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        self._cancel(ticket)
+                        raise TimeoutError(f"No {priority} request slot available")
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+                if ticket.grant is None and self._dispatch():
+                    self._cond.notify_all()
+            return ticket.grant
+
+    async def acquire_async(
+        self,
+        tokens: int = 0,
+        priority: str = INTERACTIVE,
+        session: Optional[str] = None,
+        weight: float = 1.0,
+        timeout: Optional[float] = None,
+    ) -> Grant:
+        """
+        Wait for a request slot without blocking the event loop.
+
+        Queues exactly like :meth:`acquire`; the coroutine is woken when a
+        release (from any thread) dispatches it. A coroutine cancelled
+        while it waits leaves the queue, or hands back a slot granted just
+        before the cancellation.
+
+        Args:
+            tokens: Tokens the request may use (prompt + max_tokens)
+            priority: One of INTERACTIVE, PREFETCH or BULK
+            session: Session the request belongs to
+            weight: Relative share of the session within its class
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            The grant, to be passed to :meth:`release`
+
+        Raises:
+            ValueError: If the priority is unknown
+            TimeoutError: If no slot was granted within ``timeout``
+        """
+        woken = asyncio.get_running_loop().create_future()
+        with self._cond:
+            ticket = self._enqueue(tokens, priority, session, weight, woken)
+        deadline = None if timeout is None else ticket.enqueued + timeout
+        try:
+            while True:
+                with self._cond:
+                    if ticket.grant is not None:
+                        return ticket.grant
+                    # Tokens refill without a release, so poll while short
+                    wait = self._token_wait
+                    if deadline is not None:
+                        remaining = deadline - self._clock()
+                        if remaining <= 0:
+                            self._cancel(ticket)
+                            raise TimeoutError(f"No {priority} request slot available")
+                        wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    await asyncio.wait_for(asyncio.shield(woken), wait)
+                except asyncio.TimeoutError:
+                    with self._cond:
+                        if ticket.grant is None and self._dispatch():
+                            self._cond.notify_all()
+        except asyncio.CancelledError:
+            with self._cond:
+                if ticket.grant is None:
+                    self._cancel(ticket)
+                else:
+                    self.release(ticket.grant, 0)
+            raise
+
+    def _enqueue(
+        self,
+        tokens: int,
+        priority: str,
+        session: Optional[str],
+        weight: float,
+        waiter: Optional[asyncio.Future] = None,
+    ) -> _Ticket:
+        """Queue a request and dispatch what can run; caller holds the lock."""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if self.limiter is not None:
+            tokens = min(tokens, self.limiter.capacity)
+        queue = self._queues[priority]
+        cost = max(tokens, 1) / weight
+        ticket = _Ticket(
+            priority, tokens, queue.finish_tag(session or "", cost), self._clock()
+        )
+        ticket.waiter = waiter
+        heapq.heappush(queue.heap, (ticket.finish, next(self._sequence), ticket))
+        queue.queued += 1
+        if self._dispatch():
+            self._cond.notify_all()
+        return ticket
+
+    def _cancel(self, ticket: _Ticket) -> None:
+        """Drop a request that is still queued; caller holds the lock."""
+        ticket.cancelled = True
+        self._queues[ticket.priority].queued -= 1
+        # The head may have been waiting behind this request
+        if self._dispatch():
+            self._cond.notify_all()
+
+    def release(self, grant: Grant, used_tokens: Optional[int] = None) -> None:
+        """
+        Free a slot and return the unused tokens.
+
+        Args:
+            grant: Grant returned by :meth:`acquire`
+            used_tokens: Tokens actually consumed; None keeps the whole
+                reservation
+        """
+        with self._cond:
+            if grant.released:
+                return
+            grant.released = True
+            self._running -= 1
+            self._queues[grant.priority].running -= 1
+            if grant.reservation is not None:
+                self.limiter.release(grant.reservation, used_tokens)
+            self._dispatch()
+            self._cond.notify_all()
+
+    def for_class(
+        self, priority: str = INTERACTIVE, session: Optional[str] = None
+    ) -> "ScheduledLimiter":
+        """
+        Bind a priority class and session to the token limiter interface.
+
+        Args:
+            priority: Priority class of the requests
+            session: Session the requests belong to
+
+        Returns:
+            Object usable wherever a ``TokenRateLimiter`` is accepted
+        """
+        return ScheduledLimiter(self, priority, session)
+
+    def metrics(self) -> Dict[str, ClassMetrics]:
+        """
+        Report queue depth and wait times per priority class.
+
+        Returns:
+            Metrics keyed by priority class, highest priority first
+        """
+        with self._cond:
+            report = {}
+            for priority, queue in self._queues.items():
+                waits = sorted(queue.waits)
+                report[priority] = ClassMetrics(
+                    queued=queue.queued,
+                    running=queue.running,
+                    dispatched=queue.dispatched,
+                    overtaken=queue.overtaken,
+                    mean_wait=sum(waits) / len(waits) if waits else 0.0,
+                    p95_wait=waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                    max_wait=waits[-1] if waits else 0.0,
+                )
+            return report
+
+
+class ScheduledLimiter:
+    """Token limiter interface whose requests go through a scheduler."""
+
+    def __init__(
+        self,
+        scheduler: RequestScheduler,
+        priority: str = INTERACTIVE,
+        session: Optional[str] = None,
+    ):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.session = session
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> Grant:
+        """Wait for a slot for a request of ``tokens`` tokens."""
+        return self.scheduler.acquire(
+            tokens, self.priority, self.session, timeout=timeout
+        )
+
+    async def acquire_async(
+        self, tokens: int, timeout: Optional[float] = None
+    ) -> Grant:
+        """Wait for a slot on the event loop, without a thread."""
+        return await self.scheduler.acquire_async(
+            tokens, self.priority, self.session, timeout=timeout
+        )
+
+    def release(self, reservation: Grant, used_tokens: Optional[int] = None) -> None:
+        """Free the slot of a finished request."""
+        self.scheduler.release(reservation, used_tokens)
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Optional[RequestScheduler]:
+    """
+    Return the process-wide request scheduler.
+
+    OPENAI_MAX_CONCURRENT_REQUESTS enables it; OPENAI_BULK_SLOTS caps the
+    slots bulk work may hold. Tokens are reserved from the process-wide
+    rate limiter (OPENAI_TOKENS_PER_MINUTE), if configured.
+
+    Returns:
+        The shared scheduler, or None if scheduling is disabled
+    """
+    global _scheduler  # pylint: disable=global-statement
+    if _scheduler is None:
+        value = os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS")
+        if not value:
+            return None
+        with _scheduler_lock:
+            if _scheduler is None:
+                bulk_slots = os.getenv("OPENAI_BULK_SLOTS")
+                _scheduler = RequestScheduler(
+                    int(value),
+                    limiter=get_rate_limiter(),
+                    bulk_slots=int(bulk_slots) if bulk_slots else None,
+                )
+    return _scheduler
+
+
+def limiter_for(priority: str = INTERACTIVE, session: Optional[str] = None):
+    """
+    Return the limiter a request of the given class should use.
+
+    Args:
+        priority: Priority class of the request
+        session: Session the request belongs to
+
+    Returns:
+        A scheduler-backed limiter when scheduling is enabled, otherwise
+        the process-wide token rate limiter (or None)
+    """
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return get_rate_limiter()
+    return scheduler.for_class(priority, session)
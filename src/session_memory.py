@@ -0,0 +1,487 @@
+"""
+Per-session memory accounting and offloading of idle sessions.
+
+Every Streamlit session keeps its chat history (and retrieval memory) in
+``st.session_state`` for as long as the server keeps the session, even if
+the tab was left open and forgotten days ago. :class:`SessionMemoryTracker`
+estimates how many bytes each session holds and, when an idle timeout is
+set, moves idle sessions' state out of memory:
+
+- with an offload directory, the state is pickled to a file there and put
+  back transparently on the session's next rerun;
+- without one, the state is dropped; the apps then reload the history
+  from the shared store or conversation journal, if either is enabled.
+
+Sizes are estimated on each rerun. Chat histories only grow, so only the
+messages added since the last rerun are measured.
+
+A session's state is only referenced while it may have to be moved out,
+so without a timeout the state of closed sessions is freed as usual; their
+accounting is forgotten once they have not been seen for the offload TTL.
+A session is never moved out while one of its script runs (e.g. a long
+streamed answer) is still going; its idle time counts from the run's end.
+"""
+
+import contextvars
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, MutableMapping, Optional, Sequence
+
+from streamlit.runtime.caching.cache_data_api import get_data_cache_stats_provider
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from src.render_cache import get_render_cache
+
+# Session state keys accounted for and offloaded
+DEFAULT_KEYS = ("messages", "memory")
+
+# Offloaded sessions that have not returned after this long are deleted
+DEFAULT_OFFLOAD_TTL = 7 * 24 * 3600
+
+_ATOMIC = (str, bytes, bytearray, int, float, complex, bool, type(None))
+_CONTAINERS = (list, tuple, set, frozenset)
+
+
+def approximate_size(obj) -> int:
+    """
+    Estimate the memory held by an object and everything it references.
+
+    Containers, dicts and the attributes of plain objects are followed;
+    NumPy arrays count their buffers. Functions, classes and modules are
+    shared and not counted. Each object is counted once.
+
+    Args:
+        obj: Object to measure
+
+    Returns:
+        Approximate size in bytes
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or callable(current) or isinstance(
+            current, type(sys)
+        ):
+            continue
+        seen.add(id(current))
+        nbytes = getattr(current, "nbytes", None)
+        if isinstance(nbytes, int) and hasattr(current, "dtype"):
+            # NumPy arrays (and views) report their buffer as nbytes
+            total += nbytes + 128
+            continue
+        total += sys.getsizeof(current)
+        if isinstance(current, _ATOMIC):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, _CONTAINERS):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(vars(current))
+    return total
+
+
+@dataclass(frozen=True)
+class SessionUsage:
+    """Memory accounting for one session."""
+
+    session_id: str
+    bytes: int
+    messages: int
+    idle_seconds: float
+    offloaded: bool
+
+
+@dataclass(frozen=True)
+class MemoryReport:
+    """Totals across the sessions of this process."""
+
+    sessions: int
+    in_memory_bytes: int
+    offloaded_sessions: int
+    offloaded_bytes: int
+
+
+class _Session:
+    """Accounting state of one session."""
+
+    __slots__ = ("state", "last_seen", "runs", "sizes", "history", "path",
+                 "file_bytes")
+
+    def __init__(self, now: float):
+        # Only held while the state may be moved out of memory
+        self.state: Optional[MutableMapping] = None
+        self.last_seen = now
+        # Script runs in progress; the state stays in memory meanwhile
+        self.runs = 0
+        self.sizes: Dict[str, int] = {}
+        # (id, length, bytes) of the measured message list
+        self.history = (0, 0, 0)
+        self.path: Optional[str] = None
+        self.file_bytes = 0
+
+
+class SessionMemoryTracker:
+    """Accounts session state memory and moves idle sessions out of it."""
+
+    def __init__(self, idle_timeout: Optional[float] = None,
+                 offload_dir: Optional[str] = None,
+                 keys: Sequence[str] = DEFAULT_KEYS,
+                 offload_ttl: float = DEFAULT_OFFLOAD_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Create a tracker.
+
+        Args:
+            idle_timeout: Seconds without a rerun after which a session's
+                state leaves memory; None leaves it to the session
+            offload_dir: Directory for offloaded state; None drops it
+            keys: Session state keys to account for and offload
+            offload_ttl: Seconds an offloaded session is kept on disk
+            clock: Time source
+        """
+        self.idle_timeout = idle_timeout
+        self.offload_dir = offload_dir
+        self.keys = tuple(keys)
+        self.offload_ttl = offload_ttl
+        self.evicted = 0
+        self.restored = 0
+        self._clock = clock
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        if offload_dir is not None:
+            os.makedirs(offload_dir, exist_ok=True)
+
+    def touch(self, session_id: str, state: MutableMapping) -> bool:
+        """
+        Record a rerun: restore offloaded state and measure the session.
+
+        Call at the start of every rerun, before the app reads its state.
+
+        Args:
+            session_id: Session id
+            state: The session's state mapping; with an idle timeout it is
+                kept until the session is offloaded, so it must outlive the
+                rerun
+
+        Returns:
+            True if offloaded state was put back
+        """
+        restored = False
+        with self._lock:
+            now = self._clock()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(now)
+            # Without a timeout nothing is offloaded, and holding the state
+            # would keep it alive after its session is closed
+            session.state = state if self.idle_timeout is not None else None
+            session.last_seen = now
+            if session.path is not None:
+                restored = self._restore(session, state)
+            self._measure(session, state)
+        self._start_sweeper()
+        return restored
+
+    def start_run(self, session_id: str) -> None:
+        """
+        Keep a session in memory while one of its script runs is going.
+
+        Args:
+            session_id: Session id, already passed to :meth:`touch`
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.runs += 1
+
+    def end_run(self, session_id: str) -> None:
+        """
+        Mark the end of a run started with :meth:`start_run`.
+
+        The session's idle time counts from here.
+
+        Args:
+            session_id: Session id
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.runs:
+                session.runs -= 1
+                session.last_seen = self._clock()
+
+    def _measure(self, session: _Session, state: MutableMapping) -> None:
+        for key in self.keys:
+            value = state[key] if key in state else None
+            if key == "messages" and isinstance(value, list):
+                list_id, length, size = session.history
+                if list_id != id(value) or length > len(value):
+                    list_id, length, size = id(value), 0, sys.getsizeof(value)
+                added = value[length:]
+                # One walk, so strings shared by the new messages count once
+                size += approximate_size(added) - sys.getsizeof(added)
+                session.history = (list_id, len(value), size)
+                session.sizes[key] = size
+            elif value is not None:
+                session.sizes[key] = approximate_size(value)
+            else:
+                session.sizes.pop(key, None)
+
+    def _restore(self, session: _Session, state: MutableMapping) -> bool:
+        path, session.path, session.file_bytes = session.path, None, 0
+        try:
+            with open(path, "rb") as offloaded:
+                values = pickle.load(offloaded)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        for key, value in values.items():
+            if key not in state:
+                state[key] = value
+        self.restored += 1
+        return True
+
+    def _offload(self, session_id: str, session: _Session) -> bool:
+        # Called without the lock, so pickling a long history does not hold
+        # up the reruns of other sessions
+        with self._lock:
+            state, seen = session.state, session.last_seen
+            if state is None or session.runs:
+                return False
+            values = {key: state[key] for key in self.keys if key in state}
+        path = None
+        if self.offload_dir is not None and values:
+            name = hashlib.sha256(session_id.encode("utf-8")).hexdigest() + ".pkl"
+            path = os.path.join(self.offload_dir, name)
+            try:
+                with open(path, "wb") as offloaded:
+                    pickle.dump(values, offloaded, protocol=pickle.HIGHEST_PROTOCOL)
+            except (OSError, pickle.PicklingError, TypeError, AttributeError,
+                    RuntimeError):
+                # Unpicklable (or concurrently changed) state stays in memory
+                if os.path.exists(path):
+                    os.remove(path)
+                return False
+        with self._lock:
+            if session.state is not state or session.last_seen != seen or session.runs:
+                # The session came back while it was written out
+                if path is not None and session.path != path and os.path.exists(path):
+                    os.remove(path)
+                return False
+            if path is not None:
+                session.path = path
+                session.file_bytes = os.path.getsize(path)
+            for key in values:
+                del state[key]
+            # Release the session; it is registered again when it returns
+            session.state = None
+            session.sizes.clear()
+            session.history = (0, 0, 0)
+            self.evicted += 1
+            if session.path is None:
+                del self._sessions[session_id]
+        return True
+
+    def sweep(self) -> int:
+        """
+        Move the state of sessions idle for longer than the timeout.
+
+        Sessions with a run in progress are skipped. Sessions whose state is
+        not held (offloaded, or tracked without a timeout) are forgotten
+        once unseen for the offload TTL.
+
+        Returns:
+            Number of sessions moved out of memory
+        """
+        idle_sessions = []
+        with self._lock:
+            now = self._clock()
+            for session_id, session in list(self._sessions.items()):
+                idle = now - session.last_seen
+                if session.runs:
+                    continue
+                if session.state is not None:
+                    if idle >= self.idle_timeout:
+                        idle_sessions.append((session_id, session))
+                elif idle >= self.offload_ttl:
+                    if session.path is not None and os.path.exists(session.path):
+                        os.remove(session.path)
+                    del self._sessions[session_id]
+        return sum(
+            self._offload(session_id, session) for session_id, session in idle_sessions
+        )
+
+    def _start_sweeper(self) -> None:
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweep_loop, name="session-sweeper", daemon=True
+                )
+                self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        interval = 60.0
+        if self.idle_timeout is not None:
+            interval = min(max(self.idle_timeout / 4, 0.01), interval)
+        while True:
+            time.sleep(interval)
+            self.sweep()
+
+    def usage(self) -> List[SessionUsage]:
+        """
+        Return every tracked session's usage, largest first.
+
+        Returns:
+            Usage as of each session's last rerun
+        """
+        with self._lock:
+            now = self._clock()
+            usages = [
+                SessionUsage(
+                    session_id,
+                    sum(session.sizes.values()) if session.path is None
+                    else session.file_bytes,
+                    session.history[1],
+                    now - session.last_seen,
+                    session.path is not None,
+                )
+                for session_id, session in self._sessions.items()
+            ]
+        return sorted(usages, key=lambda usage: usage.bytes, reverse=True)
+
+    def session_usage(self, session_id: str) -> Optional[SessionUsage]:
+        """Return one session's usage, or None if it is not tracked."""
+        for usage in self.usage():
+            if usage.session_id == session_id:
+                return usage
+        return None
+
+    def report(self) -> MemoryReport:
+        """Return the totals across sessions."""
+        usages = self.usage()
+        offloaded = [usage for usage in usages if usage.offloaded]
+        return MemoryReport(
+            sessions=len(usages) - len(offloaded),
+            in_memory_bytes=sum(u.bytes for u in usages if not u.offloaded),
+            offloaded_sessions=len(offloaded),
+            offloaded_bytes=sum(usage.bytes for usage in offloaded),
+        )
+
+
+def cache_bytes() -> Dict[str, int]:
+    """
+    Return the memory held by the process-wide response caches.
+
+    Returns:
+        Bytes held by ``st.cache_data`` functions and the render cache
+    """
+    stats = get_data_cache_stats_provider().get_stats()
+    return {
+        "st.cache_data": sum(stat.byte_length for stat in stats),
+        "render cache": get_render_cache().nbytes,
+    }
+
+
+def format_bytes(size: float) -> str:
+    """Format a byte count for display, e.g. ``1.5 MiB``."""
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+_tracker: Optional[SessionMemoryTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_memory_tracker() -> SessionMemoryTracker:
+    """
+    Return the process-wide session memory tracker.
+
+    SESSION_IDLE_TIMEOUT (seconds) enables moving idle sessions out of
+    memory; SESSION_OFFLOAD_DIR keeps their state on disk to restore it.
+
+    Returns:
+        The shared tracker
+    """
+    global _tracker  # pylint: disable=global-statement
+    if _tracker is None:
+        timeout = os.getenv("SESSION_IDLE_TIMEOUT")
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = SessionMemoryTracker(
+                    idle_timeout=float(timeout) if timeout else None,
+                    offload_dir=os.getenv("SESSION_OFFLOAD_DIR") or None,
+                )
+    return _tracker
+
+
+# Session tracked by the current script run, inside session_run()
+_run_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "run_session", default=None
+)
+
+
+@contextmanager
+def session_run() -> Iterator[None]:
+    """
+    Scope one script run, keeping its session in memory until it ends.
+
+    Wrap the whole run; :func:`track_session` inside it marks the session
+    busy, so a long streamed or map-reduced answer is not offloaded midway.
+    """
+    token = _run_session.set("")
+    try:
+        yield
+    finally:
+        session_id = _run_session.get()
+        _run_session.reset(token)
+        if session_id:
+            get_memory_tracker().end_run(session_id)
+
+
+def track_session() -> bool:
+    """
+    Account for the current Streamlit session, restoring offloaded state.
+
+    Sessions are keyed by the runtime session id rather than the one in
+    the URL, so offloaded state only returns to the session it came from,
+    not to another tab or a copied link. Inside :func:`session_run`, the
+    session also stays in memory until the run ends.
+
+    Returns:
+        True if the session's state was restored from disk
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return False
+    session_id = ctx.session_id
+    tracker = get_memory_tracker()
+    restored = tracker.touch(session_id, ctx.session_state)
+    if _run_session.get() == "":
+        _run_session.set(session_id)
+        tracker.start_run(session_id)
+    return restored
+
+
+def current_usage() -> Optional[SessionUsage]:
+    """Return the current Streamlit session's usage, or None if untracked."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    return get_memory_tracker().session_usage(ctx.session_id)
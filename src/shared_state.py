@@ -0,0 +1,296 @@
+"""
+Shared state for several Streamlit processes on one host.
+
+``st.session_state`` and ``@st.cache_data`` live inside a single process, so
+behind a load balancer every process has its own cache and a reconnect to
+another process loses the conversation. This module keeps conversation
+history and cached responses in a local SQLite database in WAL mode, which
+lets many processes read concurrently while one writes. Every write is
+committed before it returns, so a process always reads its own writes and
+other processes see them on their next read.
+
+A session id from the URL is only trusted for the signed-in user who
+created the session, so a copied link does not hand out the conversation.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, MutableMapping, Optional
+
+SESSION_PARAM = "sid"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS response_cache_created ON response_cache (created);
+"""
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Build a stable cache key from JSON-serializable parts.
+
+    Args:
+        *parts: Values identifying a request (prompt, model, settings, ...)
+
+    Returns:
+        Hex digest usable as a cache key
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SharedStateStore:
+    """
+    Conversation history and response cache backed by SQLite WAL.
+
+    Connections are kept per thread, so reads cost one indexed lookup
+    without reconnecting.
+    """
+
+    def __init__(self, path: str, cache_ttl: Optional[float] = None):
+        """
+        Open (and create if needed) the shared database.
+
+        Args:
+            path: Database file; every process must use the same path
+            cache_ttl: Seconds a cached response stays valid, None for forever
+        """
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Durable across process crashes; only a power loss can drop
+            # the last commits, which is acceptable for chat state
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # Conversation history
+
+    def load_messages(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Load the conversation of a session.
+
+        Args:
+            session_id: Session identifier
+
+        Returns:
+            Messages in the order they were appended
+        """
+        rows = self._connection().execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,),
+        )
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append_message(self, session_id: str, message: Dict[str, str]) -> None:
+        """
+        Append a message to a session's conversation.
+
+        Args:
+            session_id: Session identifier
+            message: Message with "role" and "content" keys
+        """
+        self._connection().execute(
+            "INSERT INTO messages (session_id, seq, role, content) "
+            "SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ? FROM messages "
+            "WHERE session_id = ?",
+            (session_id, message["role"], message["content"], session_id),
+        )
+
+    def clear_messages(self, session_id: str) -> None:
+        """
+        Delete a session's conversation.
+
+        Args:
+            session_id: Session identifier
+        """
+        self._connection().execute(
+            "DELETE FROM messages WHERE session_id = ?", (session_id,)
+        )
+
+    def claim_session(self, session_id: str, owner: str) -> None:
+        """
+        Record the owner of a session; the first owner keeps it.
+
+        Args:
+            session_id: Session identifier
+            owner: Signed-in user id
+        """
+        self._connection().execute(
+            "INSERT OR IGNORE INTO sessions (session_id, owner) VALUES (?, ?)",
+            (session_id, owner),
+        )
+
+    def session_owner(self, session_id: str) -> Optional[str]:
+        """
+        Return the owner of a session.
+
+        Args:
+            session_id: Session identifier
+
+        Returns:
+            The owner's user id, or None if the session was never claimed
+        """
+        row = self._connection().execute(
+            "SELECT owner FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # Response cache
+
+    def cache_get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from :func:`make_cache_key`
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        row = self._connection().execute(
+            "SELECT value, created FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (
+            self.cache_ttl is not None and time.time() - row[1] > self.cache_ttl
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def cache_set(self, key: str, value: str) -> None:
+        """
+        Store a response in the cache.
+
+        With a TTL, expired responses are deleted at the same time, so the
+        database does not keep growing with entries nobody can read.
+
+        Args:
+            key: Key from :func:`make_cache_key`
+            value: Response text
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, created) "
+            "VALUES (?, ?, ?)",
+            (key, value, now),
+        )
+        if self.cache_ttl is not None:
+            # A range scan on the created index
+            conn.execute(
+                "DELETE FROM response_cache WHERE created < ?", (now - self.cache_ttl,)
+            )
+
+    def hit_rate(self) -> float:
+        """Return this store's cache hit rate (0.0 when unused)."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def get_session_id(
+    session_state: MutableMapping,
+    query_params: MutableMapping,
+    owner: Optional[str] = None,
+    store: Optional[SharedStateStore] = None,
+) -> str:
+    """
+    Return a session id that survives reconnecting to another process.
+
+    The id is carried in the page URL so any process behind the load
+    balancer can find the conversation in the shared store. An id from
+    the URL is only reused when the store says it belongs to ``owner``;
+    anonymous sessions and other users' links get a new id.
+
+    Args:
+        session_state: ``st.session_state``
+        query_params: ``st.query_params``
+        owner: Signed-in user id, or None for anonymous sessions
+        store: Shared store recording session owners, or None if disabled
+
+    Returns:
+        The session id
+    """
+    session_id = session_state.get("session_id")
+    if not session_id:
+        requested = query_params.get(SESSION_PARAM)
+        if (
+            requested
+            and owner is not None
+            and store is not None
+            and store.session_owner(requested) == owner
+        ):
+            session_id = requested
+        else:
+            session_id = uuid.uuid4().hex
+            if owner is not None and store is not None:
+                store.claim_session(session_id, owner)
+        session_state["session_id"] = session_id
+    if query_params.get(SESSION_PARAM) != session_id:
+        query_params[SESSION_PARAM] = session_id
+    return session_id
+
+
+_store: Optional[SharedStateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store() -> Optional[SharedStateStore]:
+    """
+    Return the process-wide shared store.
+
+    Enabled by setting SHARED_STATE_DB to a database path that all
+    processes can reach; SHARED_STATE_CACHE_TTL optionally limits how long
+    cached responses are reused.
+
+    Returns:
+        The store, or None if shared state is disabled
+    """
+    global _store  # pylint: disable=global-statement
+    if _store is None:
+        path = os.getenv("SHARED_STATE_DB")
+        if not path:
+            return None
+        ttl = os.getenv("SHARED_STATE_CACHE_TTL")
+        with _store_lock:
+            if _store is None:
+                _store = SharedStateStore(path, float(ttl) if ttl else None)
+    return _store
@@ -0,0 +1,135 @@
+"""
+Frame-rate-limited rendering of streamed answers.
+
+Redrawing the answer's placeholder on every streamed delta sends one
+message to the browser per token, hundreds per answer, and each costs
+server CPU to build and serialize. People cannot read faster than a few
+updates per second anyway. :class:`StreamRenderer` keeps the latest text
+and redraws at most ``fps`` times per second, or sooner once
+``max_chars`` new characters are waiting; the final text is always drawn
+at once.
+
+Deltas arrive continuously while a model streams, so the next frame is
+drawn by the first delta after the frame interval. A pause in the stream
+leaves at most the text of one frame interval undrawn until the stream
+resumes or ends.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# Frames per second while streaming, and undrawn characters forcing a frame
+DEFAULT_FPS = 15.0
+DEFAULT_MAX_CHARS = 512
+
+CURSOR = "▌"
+
+
+@dataclass(frozen=True)
+class StreamRenderStats:
+    """Totals over the responses rendered by this process."""
+
+    responses: int = 0
+    deltas: int = 0
+    frames: int = 0
+
+    @property
+    def frames_per_response(self) -> float:
+        """Browser updates per response."""
+        return self.frames / self.responses if self.responses else 0.0
+
+
+class StreamRenderer:
+    """Redraws a placeholder with streamed text at a limited frame rate."""
+
+    def __init__(self, placeholder, fps: Optional[float] = None,
+                 max_chars: Optional[int] = None, cursor: str = CURSOR,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Prepare to render into a placeholder.
+
+        Args:
+            placeholder: ``st.empty()`` (or any element with ``markdown``)
+            fps: Most frames per second; 0 draws every update. Defaults to
+                STREAM_RENDER_FPS, or DEFAULT_FPS
+            max_chars: Draw once this many characters are undrawn.
+                Defaults to STREAM_RENDER_MAX_CHARS, or DEFAULT_MAX_CHARS
+            cursor: Appended to the text while streaming
+            clock: Time source
+        """
+        if fps is None:
+            fps = float(os.getenv("STREAM_RENDER_FPS", str(DEFAULT_FPS)))
+        if max_chars is None:
+            max_chars = int(
+                os.getenv("STREAM_RENDER_MAX_CHARS", str(DEFAULT_MAX_CHARS))
+            )
+        self.placeholder = placeholder
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.max_chars = max_chars
+        self.cursor = cursor
+        self.deltas = 0
+        self.frames = 0
+        self.finished = False
+        self._clock = clock
+        self._drawn = ""
+        self._next_frame = float("-inf")
+
+    def update(self, text: str) -> bool:
+        """
+        Record the text streamed so far, drawing it if a frame is due.
+
+        Args:
+            text: Whole text so far (not just the delta)
+
+        Returns:
+            True if the text was drawn
+        """
+        self.deltas += 1
+        now = self._clock()
+        if now < self._next_frame and len(text) - len(self._drawn) < self.max_chars:
+            return False
+        self._draw(text, text + self.cursor)
+        self._next_frame = now + self.interval
+        return True
+
+    def finish(self, text: str) -> None:
+        """
+        Draw the final text, without the cursor.
+
+        Calling it again redraws only if the text changed; the response is
+        counted in the stats once.
+
+        Args:
+            text: Complete text
+        """
+        if not self.finished:
+            self.finished = True
+            self._draw(text, text)
+            _record(self.deltas, self.frames)
+        elif text != self._drawn:
+            self._draw(text, text)
+
+    def _draw(self, text: str, shown: str) -> None:
+        self.placeholder.markdown(shown)
+        self._drawn = text
+        self.frames += 1
+
+
+_stats = StreamRenderStats()
+_stats_lock = threading.Lock()
+
+
+def _record(deltas: int, frames: int) -> None:
+    global _stats  # pylint: disable=global-statement
+    with _stats_lock:
+        _stats = StreamRenderStats(
+            _stats.responses + 1, _stats.deltas + deltas, _stats.frames + frames
+        )
+
+
+def get_stream_render_stats() -> StreamRenderStats:
+    """Return the totals over responses rendered by this process."""
+    return _stats
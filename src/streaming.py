@@ -0,0 +1,238 @@
+"""
+Cancellable streamed chat completions.
+
+A streamed answer holds an HTTP connection and its rate-limit reservation
+until the last token arrives. :class:`CancellableStream` lets the caller
+stop early: cancelling or closing it closes the underlying HTTP response,
+which returns the connection to the client's pool, and hands the unused
+token reservation back immediately. Text generated so far stays available.
+"""
+
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from src.prompt_cache import cached_prompt_tokens
+from src.token_budget import (
+    CONTINUE_PROMPT,
+    CompletionLengthPredictor,
+    TokenRateLimiter,
+    estimate_prompt_tokens,
+    estimate_tokens,
+    get_predictor,
+    get_rate_limiter,
+)
+
+
+class CancellableStream:
+    """
+    Streamed chat completion that can be stopped from any thread.
+
+    Iterating yields text deltas. Like :func:`create_with_continuation`, an
+    answer cut off by ``max_tokens`` is continued with a follow-up request
+    until ``ceiling`` tokens have been generated. Use it as a context
+    manager so the stream is closed even when the consumer is interrupted.
+    """
+
+    def __init__(
+        self,
+        client,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        ceiling: Optional[int] = None,
+        max_continuations: int = 3,
+        on_close: Optional[Callable[["CancellableStream"], None]] = None,
+        **kwargs,
+    ):
+        """
+        Prepare the stream; the request is sent on first iteration.
+
+        Args:
+            client: OpenAI client
+            messages: Chat messages to send
+            max_tokens: max_tokens for each request
+            ceiling: Total completion tokens allowed across continuations
+            max_continuations: Maximum number of follow-up requests
+            on_close: Called once when the stream finishes, fails or is cancelled
+            **kwargs: Extra arguments for ``chat.completions.create``
+        """
+        self._client = client
+        self._messages = list(messages)
+        self._max_tokens = max_tokens
+        self._ceiling = max_tokens if ceiling is None else ceiling
+        self._max_continuations = max_continuations
+        self._on_close = on_close
+        self._kwargs = kwargs
+        self._parts: List[str] = []
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self.completion_tokens = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.finish_reason: Optional[str] = None
+        self.continuations = 0
+        self.finished = False
+        self.closed = False
+
+    @property
+    def text(self) -> str:
+        """Text generated so far."""
+        return "".join(self._parts)
+
+    @property
+    def cancelled(self) -> bool:
+        """True if the stream was stopped before the answer was complete."""
+        return self._cancel.is_set() and not self.finished
+
+    def __iter__(self) -> Iterator[str]:
+        conversation = self._messages
+        request_tokens = min(self._max_tokens, self._ceiling)
+        try:
+            while not self._cancel.is_set():
+                part_start = len(self._parts)
+                yield from self._stream_once(conversation, request_tokens)
+                if self._cancel.is_set():
+                    return
+                remaining = self._ceiling - self.completion_tokens
+                if (
+                    self.finish_reason != "length"
+                    or self.continuations >= self._max_continuations
+                    or remaining <= 0
+                ):
+                    self.finished = True
+                    return
+                self.continuations += 1
+                request_tokens = min(self._max_tokens, remaining)
+                conversation = conversation + [
+                    {"role": "assistant", "content": "".join(self._parts[part_start:])},
+                    {"role": "user", "content": CONTINUE_PROMPT},
+                ]
+        finally:
+            self.close()
+
+    def _stream_once(self, conversation, request_tokens) -> Iterator[str]:
+        response = self._client.chat.completions.create(
+            messages=conversation,
+            max_tokens=request_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._kwargs,
+        )
+        with self._lock:
+            self._response = response
+        if self._cancel.is_set():
+            response.close()
+            return
+
+        usage_seen = False
+        generated = []
+        try:
+            for chunk in response:
+                if self._cancel.is_set():
+                    break
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    usage_seen = True
+                    self.completion_tokens += usage.completion_tokens
+                    self.prompt_tokens += usage.prompt_tokens
+                    self.cached_tokens += cached_prompt_tokens(usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    self.finish_reason = choice.finish_reason
+                delta = choice.delta.content if choice.delta else None
+                if delta:
+                    self._parts.append(delta)
+                    generated.append(delta)
+                    yield delta
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Closing the response from another thread aborts the read
+            if not self._cancel.is_set():
+                raise
+        finally:
+            response.close()
+            with self._lock:
+                self._response = None
+            if not usage_seen:
+                self.completion_tokens += estimate_tokens("".join(generated))
+
+    def cancel(self) -> None:
+        """
+        Stop generating as soon as possible.
+
+        Safe to call from any thread; closes the HTTP response so the
+        connection is released even while a read is blocked.
+        """
+        self._cancel.set()
+        with self._lock:
+            response = self._response
+        if response is not None:
+            response.close()
+
+    def close(self) -> None:
+        """Release the stream; an unfinished answer counts as cancelled."""
+        if self.closed:
+            return
+        if not self.finished:
+            self.cancel()
+        self.closed = True
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def __enter__(self) -> "CancellableStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def budgeted_stream(
+    client,
+    messages: List[Dict[str, str]],
+    prompt_class: str,
+    ceiling: int,
+    predictor: Optional[CompletionLengthPredictor] = None,
+    limiter: Optional[TokenRateLimiter] = None,
+    **kwargs,
+) -> CancellableStream:
+    """
+    Start a streamed completion with a predicted max_tokens and rate limiting.
+
+    The token reservation is released as soon as the stream finishes or is
+    cancelled. Only completed answers are fed back to the predictor, since
+    a cancelled answer says nothing about how long it would have been.
+
+    Args:
+        client: OpenAI client
+        messages: Chat messages to send
+        prompt_class: Class returned by :meth:`CompletionLengthPredictor.classify`
+        ceiling: Largest completion the caller accepts
+        predictor: Length predictor (defaults to the process-wide one)
+        limiter: Token rate limiter (defaults to the process-wide one, if any)
+        **kwargs: Extra arguments for ``chat.completions.create``
+
+    Returns:
+        The stream, not yet started
+    """
+    predictor = predictor or get_predictor()
+    limiter = limiter if limiter is not None else get_rate_limiter()
+    max_tokens = predictor.predict(prompt_class, ceiling)
+    prompt_estimate = estimate_prompt_tokens(messages)
+
+    reservation = None
+    if limiter is not None:
+        reservation = limiter.acquire(prompt_estimate + max_tokens)
+
+    def on_close(stream: CancellableStream) -> None:
+        if reservation is not None:
+            # A stream closed mid-read has no usage chunk yet
+            completion = stream.completion_tokens or estimate_tokens(stream.text)
+            prompt = stream.prompt_tokens or prompt_estimate
+            limiter.release(reservation, prompt + completion)
+        if stream.finished:
+            predictor.record(prompt_class, stream.completion_tokens)
+
+    return CancellableStream(
+        client, messages, max_tokens, ceiling=ceiling, on_close=on_close, **kwargs
+    )
@@ -0,0 +1,530 @@
+"""
+Adaptive completion budgeting for OpenAI chat requests.
+
+Most answers are far shorter than the fixed ``max_tokens`` ceiling the apps
+use, yet a token-based rate limiter has to reserve the full ceiling for
+every request. This module learns completion lengths per prompt class,
+asks for a high percentile of what has been observed, and transparently
+continues a response that was cut off with ``finish_reason == "length"``.
+"""
+
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from src.prompt_cache import cached_prompt_tokens
+
+# Rough characters-per-token ratio for English text
+CHARS_PER_TOKEN = 4
+
+# Per-message framing overhead the chat format adds to the prompt
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CONTINUE_PROMPT = "Continue exactly where you left off. Do not repeat anything."
+
+_CODE_PATTERN = re.compile(
+    r"\b(code|function|script|class|implement|sql|regex)\b", re.I
+)
+_LONG_PATTERN = re.compile(
+    r"\b(explain|essay|describe|story|article|detail|compare)\b", re.I
+)
+_SHORT_PATTERN = re.compile(r"\b(joke|haiku|yes or no|one word|short|brief)\b", re.I)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a piece of text.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Approximate token count (at least 1 for non-empty text)
+    """
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimate the prompt size of a chat message list.
+
+    Args:
+        messages: Chat messages with "role" and "content" keys
+
+    Returns:
+        Approximate prompt token count
+    """
+    return sum(
+        estimate_tokens(msg.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        for msg in messages
+    )
+
+
+class CompletionLengthPredictor:
+    """
+    Learns completion length distributions per prompt class.
+
+    Each class keeps a bounded window of recent completion lengths. Until a
+    class has ``min_samples`` observations the caller's ceiling is used, so
+    cold starts behave exactly like a fixed ``max_tokens``.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        window: int = 200,
+        min_samples: int = 10,
+        headroom: float = 1.25,
+        floor: int = 64,
+    ):
+        """
+        Initialize the predictor.
+
+        Args:
+            percentile: Percentile of observed lengths to budget for
+            window: Number of recent samples kept per class
+            min_samples: Samples required before predictions replace the ceiling
+            headroom: Multiplier applied on top of the percentile
+            floor: Smallest max_tokens value ever predicted
+        """
+        if not 0 < percentile <= 100:
+            raise ValueError("percentile must be in (0, 100]")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.floor = floor
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def classify(prompt: str, app: str = "chat") -> str:
+        """
+        Map a prompt to a coarse class with similar completion lengths.
+
+        Args:
+            prompt: User prompt
+            app: Name of the calling app, kept separate because system
+                prompts and settings differ between apps
+
+        Returns:
+            Class key such as ``"chat:code:64"``
+        """
+        if _CODE_PATTERN.search(prompt):
+            kind = "code"
+        elif _SHORT_PATTERN.search(prompt):
+            kind = "short"
+        elif _LONG_PATTERN.search(prompt):
+            kind = "long"
+        else:
+            kind = "general"
+        # Power-of-two prompt length bucket
+        size = 2 ** max(4, math.ceil(math.log2(estimate_tokens(prompt) or 1)))
+        return f"{app}:{kind}:{size}"
+
+    def record(self, prompt_class: str, completion_tokens) -> None:
+        """
+        Record the length of a finished completion.
+
+        Args:
+            prompt_class: Class returned by :meth:`classify`
+            completion_tokens: Total completion tokens, ignored if not an int
+        """
+        if not isinstance(completion_tokens, int) or completion_tokens <= 0:
+            return
+        with self._lock:
+            self._samples[prompt_class].append(completion_tokens)
+
+    def sample_count(self, prompt_class: str) -> int:
+        """Return how many samples are held for a class."""
+        with self._lock:
+            return len(self._samples.get(prompt_class, ()))
+
+    def predict(self, prompt_class: str, ceiling: int) -> int:
+        """
+        Predict a max_tokens value for a request.
+
+        Args:
+            prompt_class: Class returned by :meth:`classify`
+            ceiling: Largest value the caller allows
+
+        Returns:
+            max_tokens to request, between ``floor`` and ``ceiling``
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(prompt_class, ()))
+        if len(samples) < self.min_samples:
+            return ceiling
+        rank = max(0, math.ceil(self.percentile / 100 * len(samples)) - 1)
+        predicted = math.ceil(samples[rank] * self.headroom)
+        return max(min(self.floor, ceiling), min(predicted, ceiling))
+
+
+@dataclass
+class Reservation:
+    """Tokens held against a :class:`TokenRateLimiter` by one request."""
+
+    tokens: int
+    released: bool = field(default=False)
+
+
+class TokenRateLimiter:
+    """
+    Token bucket limiting tokens per minute across concurrent requests.
+
+    Requests reserve their worst case (prompt + max_tokens) up front and
+    return the unused part when they finish, so smaller predicted budgets
+    directly translate into more requests admitted at once.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize the limiter.
+
+        Args:
+            tokens_per_minute: Sustained token budget, also the burst size
+            clock: Monotonic clock, injectable for tests
+        """
+        if tokens_per_minute <= 0:
+            raise ValueError("tokens_per_minute must be positive")
+        self.capacity = tokens_per_minute
+        self._rate = tokens_per_minute / 60.0
+        self._clock = clock
+        self._available = float(tokens_per_minute)
+        self._updated = clock()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._available = min(self.capacity, self._available + elapsed * self._rate)
+
+    @property
+    def available(self) -> float:
+        """Tokens currently available for new reservations."""
+        with self._cond:
+            self._refill()
+            return self._available
+
+    @property
+    def in_flight(self) -> int:
+        """Number of reservations not yet released."""
+        with self._cond:
+            return self._in_flight
+
+    def try_acquire(self, tokens: int) -> Optional[Reservation]:
+        """
+        Reserve tokens without waiting.
+
+        Args:
+            tokens: Tokens to reserve (capped at the bucket capacity)
+
+        Returns:
+            A reservation, or None if the budget is exhausted
+        """
+        tokens = min(tokens, self.capacity)
+        with self._cond:
+            self._refill()
+            if self._available < tokens:
+                return None
+            self._available -= tokens
+            self._in_flight += 1
+            return Reservation(tokens)
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> Reservation:
+        """
+        Reserve tokens, waiting for the bucket to refill if necessary.
+
+        Args:
+            tokens: Tokens to reserve (capped at the bucket capacity)
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            The reservation
+
+        Raises:
+            TimeoutError: If the budget did not free up within ``timeout``
+        """
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            while True:
+                self._refill()
+                if self._available >= tokens:
+                    self._available -= tokens
+                    self._in_flight += 1
+                    return Reservation(tokens)
+                wait = (tokens - self._available) / self._rate
+                if deadline is not None:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Token budget unavailable for {tokens} tokens"
+                        )
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+
+    async def acquire_async(
+        self, tokens: int, timeout: Optional[float] = None
+    ) -> Reservation:
+        """
+        Reserve tokens, sleeping on the event loop until the bucket refills.
+
+        Args:
+            tokens: Tokens to reserve (capped at the bucket capacity)
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            The reservation
+
+        Raises:
+            TimeoutError: If the budget did not free up within ``timeout``
+        """
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            reservation = self.try_acquire(tokens)
+            if reservation is not None:
+                return reservation
+            # Refunds arrive early, so check again at least every second
+            wait = min(1.0, (tokens - self.available) / self._rate)
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise TimeoutError(f"Token budget unavailable for {tokens} tokens")
+                wait = min(wait, remaining)
+            await asyncio.sleep(max(wait, 0.001))
+
+    def release(
+        self, reservation: Reservation, used_tokens: Optional[int] = None
+    ) -> None:
+        """
+        Return the unused part of a reservation to the bucket.
+
+        A request that used more than it reserved (the estimates are rough)
+        is debited the difference, which later requests wait for.
+
+        Args:
+            reservation: Reservation returned by acquire/try_acquire
+            used_tokens: Tokens actually consumed; None keeps the whole reservation
+        """
+        with self._cond:
+            if reservation.released:
+                return
+            reservation.released = True
+            self._in_flight -= 1
+            if used_tokens is not None:
+                self._refill()
+                self._available = min(
+                    self.capacity,
+                    self._available + reservation.tokens - used_tokens,
+                )
+            self._cond.notify_all()
+
+
+@dataclass
+class CompletionResult:
+    """Outcome of a (possibly continued) chat completion."""
+
+    content: str
+    completion_tokens: int
+    prompt_tokens: int
+    finish_reason: Optional[str]
+    continuations: int = 0
+    cached_tokens: int = 0
+
+
+def _usage_value(response, name: str) -> Optional[int]:
+    value = getattr(getattr(response, "usage", None), name, None)
+    return value if isinstance(value, int) else None
+
+
+def _reserved_create(client, limiter, messages, max_tokens: int, kwargs) -> tuple:
+    """
+    Send one request, reserving its tokens with the limiter if there is one.
+
+    Returns:
+        The response, its completion tokens and its prompt tokens (0 if
+        the response has no usage)
+    """
+    prompt_estimate = estimate_prompt_tokens(messages)
+    reservation = None
+    if limiter is not None:
+        reservation = limiter.acquire(prompt_estimate + max_tokens)
+    used = None
+    try:
+        response = client.chat.completions.create(
+            messages=messages, max_tokens=max_tokens, **kwargs
+        )
+        completion = _usage_value(response, "completion_tokens")
+        if completion is None:
+            completion = estimate_tokens(response.choices[0].message.content or "")
+        prompt = _usage_value(response, "prompt_tokens") or 0
+        used = (prompt or prompt_estimate) + completion
+    finally:
+        if reservation is not None:
+            limiter.release(reservation, used)
+    return response, completion, prompt
+
+
+def create_with_continuation(
+    client,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    ceiling: Optional[int] = None,
+    max_continuations: int = 3,
+    limiter: Optional[TokenRateLimiter] = None,
+    **kwargs,
+) -> CompletionResult:
+    """
+    Run a chat completion, continuing it while it is cut off by max_tokens.
+
+    With a limiter, every request (the first and each continuation, whose
+    prompt includes the text so far) reserves its own prompt + max_tokens
+    and is settled with its own usage.
+
+    Args:
+        client: OpenAI client
+        messages: Chat messages to send
+        max_tokens: max_tokens for each request
+        ceiling: Total completion tokens allowed across continuations
+            (defaults to ``max_tokens``, i.e. no continuation budget)
+        max_continuations: Maximum number of follow-up requests
+        limiter: Token rate limiter to reserve each request with
+        **kwargs: Extra arguments for ``chat.completions.create``
+
+    Returns:
+        The combined completion
+    """
+    ceiling = max_tokens if ceiling is None else ceiling
+    conversation = list(messages)
+    parts: List[str] = []
+    completion_tokens = 0
+    prompt_tokens = 0
+    cached_tokens = 0
+    continuations = 0
+    request_tokens = min(max_tokens, ceiling)
+
+    while True:
+        response, completion, prompt = _reserved_create(
+            client, limiter, conversation, request_tokens, kwargs
+        )
+        choice = response.choices[0]
+        text = choice.message.content or ""
+        parts.append(text)
+        completion_tokens += completion
+        prompt_tokens += prompt
+        cached_tokens += cached_prompt_tokens(getattr(response, "usage", None))
+
+        remaining = ceiling - completion_tokens
+        if (
+            choice.finish_reason != "length"
+            or continuations >= max_continuations
+            or remaining <= 0
+        ):
+            break
+        continuations += 1
+        request_tokens = min(max_tokens, remaining)
+        conversation = conversation + [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": CONTINUE_PROMPT},
+        ]
+
+    return CompletionResult(
+        content=parts[0] if len(parts) == 1 else "".join(parts),
+        completion_tokens=completion_tokens,
+        prompt_tokens=prompt_tokens,
+        finish_reason=choice.finish_reason,
+        continuations=continuations,
+        cached_tokens=cached_tokens,
+    )
+
+
+def budgeted_completion(
+    client,
+    messages: List[Dict[str, str]],
+    prompt_class: str,
+    ceiling: int,
+    predictor: Optional[CompletionLengthPredictor] = None,
+    limiter: Optional[TokenRateLimiter] = None,
+    **kwargs,
+) -> CompletionResult:
+    """
+    Run a chat completion with a predicted max_tokens and rate limiting.
+
+    Args:
+        client: OpenAI client
+        messages: Chat messages to send
+        prompt_class: Class returned by :meth:`CompletionLengthPredictor.classify`
+        ceiling: Largest completion the caller accepts
+        predictor: Length predictor (defaults to the process-wide one)
+        limiter: Token rate limiter (defaults to the process-wide one, if any)
+        **kwargs: Extra arguments for ``chat.completions.create``
+
+    Returns:
+        The combined completion
+    """
+    predictor = predictor or get_predictor()
+    limiter = limiter if limiter is not None else get_rate_limiter()
+    max_tokens = predictor.predict(prompt_class, ceiling)
+    result = create_with_continuation(
+        client, messages, max_tokens, ceiling=ceiling, limiter=limiter, **kwargs
+    )
+    predictor.record(prompt_class, result.completion_tokens)
+    return result
+
+
+_predictor = CompletionLengthPredictor()
+_limiter: Optional[TokenRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_predictor() -> CompletionLengthPredictor:
+    """Return the process-wide completion length predictor."""
+    return _predictor
+
+
+def get_rate_limiter() -> Optional[TokenRateLimiter]:
+    """
+    Return the process-wide token rate limiter.
+
+    The limiter is configured with OPENAI_TOKENS_PER_MINUTE; when that is
+    unset, requests are not rate limited.
+
+    Returns:
+        The shared limiter, or None if rate limiting is disabled
+
+    Raises:
+        ValueError: If OPENAI_TOKENS_PER_MINUTE is not a positive integer
+    """
+    global _limiter  # pylint: disable=global-statement
+    if _limiter is None:
+        value = os.getenv("OPENAI_TOKENS_PER_MINUTE")
+        if not value:
+            return None
+        try:
+            tokens_per_minute = int(value)
+        except ValueError:
+            tokens_per_minute = 0
+        if tokens_per_minute <= 0:
+            raise ValueError(
+                f"OPENAI_TOKENS_PER_MINUTE must be a positive integer, got {value!r}. "
+                "Please fix it in your .env file."
+            )
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenRateLimiter(tokens_per_minute)
+    return _limiter
@@ -0,0 +1,284 @@
+"""
+Span-based tracing of Streamlit reruns.
+
+Spans are written as Chrome trace events ("complete" events, ``ph: "X"``)
+to a local file that Perfetto or ``chrome://tracing`` can open directly:
+the file starts with ``[`` and every event sits on its own line followed
+by a comma, which the trace event format allows in place of a closing
+``]``. Files rotate by size like :class:`logging.handlers.RotatingFileHandler`.
+
+The outermost span of a thread (normally one rerun) is the root: it
+decides whether the whole trace is sampled, and nested spans follow that
+decision. The session id is carried in a context variable and attached to
+every span. When TRACE_FILE is not set, ``span`` returns a shared no-op
+object, so instrumented code pays for one function call per span.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional
+
+_MAX_BYTES = 10 * 1024 * 1024
+
+_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "trace_session", default=None
+)
+# None: no root span yet; True/False: the current trace is (not) sampled
+_sampled: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar(
+    "trace_sampled", default=None
+)
+
+
+class _TraceFileHandler(RotatingFileHandler):
+    """Rotating handler that starts every file with the JSON array opener."""
+
+    terminator = ",\n"
+
+    def _open(self):
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write("[\n")
+        return stream
+
+
+class Tracer:
+    """Writes finished spans to a rotating trace file."""
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        max_bytes: int = _MAX_BYTES,
+        backups: int = 3,
+    ):
+        """
+        Open the trace file.
+
+        Args:
+            path: Trace file path
+            sample_rate: Fraction of root spans (and their children) recorded
+            max_bytes: Size at which the file is rotated
+            backups: Number of rotated files kept
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.pid = os.getpid()
+        self._handler = _TraceFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def should_sample(self) -> bool:
+        """Decide whether a new trace is recorded."""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """
+        Write one trace event.
+
+        Args:
+            event: Chrome trace event
+        """
+        line = json.dumps(event, separators=(",", ":"), default=str)
+        # handle() takes the handler's lock, so rotation can't race a write
+        self._handler.handle(logging.makeLogRecord({"msg": line}))
+
+    def close(self) -> None:
+        """Flush and close the trace file."""
+        self._handler.close()
+
+
+class _NoopSpan:
+    """Stand-in returned when tracing is disabled or not sampled."""
+
+    __slots__ = ()
+
+    def set(self, **args) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+class _Root(_NoopSpan):
+    """
+    Scope of a root span: the sampling decision and the session id.
+
+    Used directly as the no-op span of an unsampled trace.
+    """
+
+    __slots__ = ("sampled", "_tokens")
+
+    def __init__(self, sampled: bool):
+        self.sampled = sampled
+        # Both are restored on exit, so a reused thread starts clean
+        self._tokens = (_sampled.set(sampled), _session.set(_session.get()))
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _sampled.reset(self._tokens[0])
+        _session.reset(self._tokens[1])
+
+
+class Span:
+    """A timed section of work; use as a context manager."""
+
+    __slots__ = ("tracer", "name", "args", "_root", "_start", "_ts")
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        name: str,
+        args: Dict[str, Any],
+        root: Optional[_Root] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self._root = root
+        self._start = 0.0
+        self._ts = 0
+
+    def set(self, **args) -> None:
+        """Attach extra arguments to the span."""
+        self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        self._ts = time.time_ns() // 1000
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.args["exception"] = exc_type.__name__
+        session = _session.get()
+        if session is not None:
+            self.args.setdefault("session", session)
+        if self._root is not None:
+            self._root.__exit__(exc_type, exc, tb)
+        self.tracer.emit({
+            "name": self.name,
+            "cat": "chat",
+            "ph": "X",
+            "ts": self._ts,
+            "dur": round(duration * 1e6, 1),
+            "pid": self.tracer.pid,
+            "tid": threading.get_native_id(),
+            "args": self.args,
+        })
+
+
+_NOOP = _NoopSpan()
+_tracer: Optional[Tracer] = None
+_configured = False
+_lock = threading.Lock()
+
+
+def get_tracer() -> Optional[Tracer]:
+    """
+    Return the process-wide tracer as configured by the environment.
+
+    TRACE_FILE enables tracing; TRACE_SAMPLE_RATE (default 1.0),
+    TRACE_MAX_BYTES (default 10 MiB) and TRACE_BACKUPS (default 3) tune it.
+
+    Returns:
+        The tracer, or None if tracing is disabled
+    """
+    global _tracer, _configured  # pylint: disable=global-statement
+    if not _configured:
+        with _lock:
+            if not _configured:
+                path = os.getenv("TRACE_FILE")
+                if path:
+                    _tracer = Tracer(
+                        path,
+                        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0")),
+                        max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(_MAX_BYTES))),
+                        backups=int(os.getenv("TRACE_BACKUPS", "3")),
+                    )
+                _configured = True
+    return _tracer
+
+
+def span(name: str, **args):
+    """
+    Time a block of work.
+
+    Args:
+        name: Span name shown in the trace viewer
+        **args: Arguments recorded with the span
+
+    Returns:
+        Context manager yielding an object with ``set(**args)``
+    """
+    tracer = _tracer if _configured else get_tracer()
+    if tracer is None:
+        return _NOOP
+    sampled = _sampled.get()
+    if sampled is None:
+        root = _Root(tracer.should_sample())
+        return Span(tracer, name, args, root) if root.sampled else root
+    return Span(tracer, name, args) if sampled else _NOOP
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorate a function so every call is recorded as a span.
+
+    Args:
+        name: Span name (defaults to the function's qualified name)
+
+    Returns:
+        Decorator
+    """
+    def decorate(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_session(session_id: Optional[str]) -> None:
+    """
+    Tag the spans of the current context with a session id.
+
+    Spans still open when this is called (such as the rerun's root span)
+    are tagged too, as they read the session when they finish.
+
+    Args:
+        session_id: Session id, or None to stop tagging
+    """
+    _session.set(session_id)
+
+
+def read_events(path: str) -> List[Dict[str, Any]]:
+    """
+    Parse a trace file written by :class:`Tracer`.
+
+    Args:
+        path: Trace file path
+
+    Returns:
+        Trace events in the order they were written
+    """
+    events = []
+    with open(path, encoding="utf-8") as trace:
+        for line in trace:
+            line = line.strip().rstrip(",")
+            if line and line not in ("[", "]"):
+                events.append(json.loads(line))
+    return events
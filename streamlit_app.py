@@ -7,14 +7,51 @@ and OpenAI API integration for chat completions.
 
 import streamlit as st
 import os
+from typing import Dict, List
 from dotenv import load_dotenv
+from src.comparison import MODELS, ComparisonRun, Variant
+from src.journal import new_conversation, persist_message, render_search, saved_messages
 from src.openai_example import get_openai_client, simple_chat_completion
+from src.render_cache import finalize_message, get_render_cache
+from src.quotas import QuotaExceeded, get_user_id, quota_limiter
+from src.scheduler import INTERACTIVE, get_scheduler, limiter_for
+from src.session_memory import (
+    cache_bytes,
+    current_usage,
+    format_bytes,
+    get_memory_tracker,
+    session_run,
+    track_session,
+)
+from src.shared_state import get_session_id, get_shared_store, make_cache_key
+from src.stream_render import StreamRenderer, get_stream_render_stats
+from src.token_budget import CompletionLengthPredictor, budgeted_completion
+from src.tracing import set_session, span
 
 # Load environment variables
 load_dotenv()
 
+GREETING = {
+    "role": "assistant", 
+    "content": "Hello! I'm your AI assistant. How can I help you today?"
+}
+
+SYSTEM_PROMPT = "You are a helpful and friendly AI assistant."
+
+# Largest number of settings compared side by side
+MAX_VARIANTS = 4
+
+# Most past messages listed for a conversation search
+SEARCH_RESULTS = 10
+
 def main():
     """Main application function."""
+    # The session stays in memory until the run (and its answer) is done
+    with span("rerun", app="streamlit_app"), session_run():
+        render_page()
+
+def render_page():
+    """Render the page; one call per script rerun."""
     
     # Page configuration
     st.set_page_config(
@@ -53,6 +90,27 @@ def main():
     max_tokens = st.sidebar.slider("Max Response Length", 50, 500, 150)
     temperature = st.sidebar.slider("Creativity (Temperature)", 0.0, 2.0, 1.0, 0.1)
     
+    # Comparison mode sends each prompt to several settings at once
+    st.sidebar.subheader("🔀 Comparison Mode")
+    variants = []
+    if st.sidebar.toggle("Compare settings side by side", key="compare_mode"):
+        variants = comparison_variants(max_tokens, temperature)
+    
+    # Shared store lets another server process pick up this conversation
+    store = get_shared_store()
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = get_user_id(st.user)
+    session_id = get_session_id(
+        st.session_state, st.query_params, st.session_state.user_id, store
+    )
+    set_session(session_id)
+    # Account for this session's memory; puts back state offloaded while idle
+    track_session()
+    # Journal keeps every conversation, searchable, across clears and restarts
+    render_search(st.sidebar, st.session_state, st.query_params, open_conversation,
+                  "Search messages", title="🔎 Past Conversations",
+                  limit=SEARCH_RESULTS)
+    
     # Main content area
     col1, col2 = st.columns([2, 1])
     
@@ -61,53 +119,55 @@ def main():
         
         # Initialize chat history
         if "messages" not in st.session_state:
-            st.session_state.messages = []
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": "Hello! I'm your AI assistant. How can I help you today?"
-            })
+            st.session_state.messages = [dict(GREETING)]
+            if store is not None:
+                st.session_state.messages.extend(store.load_messages(session_id))
+            else:
+                st.session_state.messages.extend(
+                    saved_messages(st.session_state, st.query_params)
+                )
         
-        # Display chat messages
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+        # Display chat messages (past messages reuse their rendered markdown)
+        with span("render_history", messages=len(st.session_state.messages)):
+            render_cache = get_render_cache()
+            for message in st.session_state.messages:
+                render_cache.render(st.chat_message(message["role"]), message)
         
         # Chat input
         if prompt := st.chat_input("Type your message here..."):
             # Add user message to chat history
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            add_message("user", prompt)
             with st.chat_message("user"):
                 st.markdown(prompt)
             
             # Generate AI response
-            if api_configured:
+            if api_configured and variants:
+                with st.chat_message("assistant"):
+                    add_message("assistant", run_comparison(prompt, variants))
+            elif api_configured:
                 with st.chat_message("assistant"):
                     with st.spinner("Thinking..."):
                         try:
-                            # Get response from OpenAI
-                            response = get_ai_response(prompt, max_tokens, temperature)
-                            st.markdown(response)
+                            # Get response from OpenAI (spans a st.cache_data hit too)
+                            with span("get_ai_response"):
+                                response = get_ai_response(prompt, max_tokens, temperature)
+                            with span("render_response", chars=len(response)):
+                                st.markdown(response)
                             
                             # Add assistant response to chat history
-                            st.session_state.messages.append({
-                                "role": "assistant", 
-                                "content": response
-                            })
+                            add_message("assistant", response)
+                        except QuotaExceeded as e:
+                            st.warning(str(e))
+                            add_message("assistant", f"⏳ {e}")
                         except Exception as e:
                             error_msg = f"Sorry, I encountered an error: {str(e)}"
                             st.error(error_msg)
-                            st.session_state.messages.append({
-                                "role": "assistant", 
-                                "content": error_msg
-                            })
+                            add_message("assistant", error_msg)
             else:
                 with st.chat_message("assistant"):
                     error_msg = "Please configure your OpenAI API key to use chat functionality."
                     st.error(error_msg)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": error_msg
-                    })
+                    add_message("assistant", error_msg)
     
     with col2:
         st.header("📊 App Info")
@@ -116,6 +176,40 @@ def main():
         st.metric("Messages in Chat", len(st.session_state.messages))
         st.metric("API Status", "✅ Ready" if api_configured else "❌ Not Ready")
         
+        # Requests waiting for the shared API quota, per priority class
+        scheduler = get_scheduler()
+        if scheduler is not None:
+            st.subheader("🚦 Request Queue")
+            for priority, stats in scheduler.metrics().items():
+                st.caption(
+                    f"{priority}: {stats.queued} queued · {stats.running} running · "
+                    f"wait p95 {stats.p95_wait:.2f}s"
+                )
+        
+        # Approximate memory held by chat state, as of each session's last rerun
+        st.subheader("🧠 Memory")
+        tracker = get_memory_tracker()
+        usage = current_usage()
+        st.metric("This Session", format_bytes(usage.bytes if usage else 0))
+        report = tracker.report()
+        st.caption(
+            f"{report.sessions} sessions · {format_bytes(report.in_memory_bytes)} "
+            f"in memory · {report.offloaded_sessions} idle offloaded "
+            f"({format_bytes(report.offloaded_bytes)} on disk)"
+        )
+        st.caption(" · ".join(
+            f"{name}: {format_bytes(size)}" for name, size in cache_bytes().items()
+        ))
+        
+        # Browser updates per streamed answer, across this process
+        render_stats = get_stream_render_stats()
+        if render_stats.responses:
+            st.caption(
+                f"📡 {render_stats.frames_per_response:.1f} updates per streamed "
+                f"answer ({render_stats.deltas / render_stats.responses:.0f} "
+                f"deltas) over {render_stats.responses} answers"
+            )
+        
         # Sample prompts
         st.subheader("💡 Try These Prompts")
         sample_prompts = [
@@ -130,15 +224,15 @@ def main():
             if st.button(prompt, key=f"sample_{prompt}"):
                 if api_configured:
                     # Add to chat
-                    st.session_state.messages.append({"role": "user", "content": prompt})
+                    add_message("user", prompt)
                     st.rerun()
         
         # Clear chat button
         if st.button("🗑️ Clear Chat", type="secondary"):
-            st.session_state.messages = [{
-                "role": "assistant", 
-                "content": "Hello! I'm your AI assistant. How can I help you today?"
-            }]
+            st.session_state.messages = [dict(GREETING)]
+            if store is not None:
+                store.clear_messages(session_id)
+            new_conversation(st.session_state, st.query_params)
             st.rerun()
     
     # Footer
@@ -149,33 +243,174 @@ def main():
     *This is a demo application showing Streamlit + OpenAI integration.*
     """)
 
+def comparison_variants(max_tokens: int, temperature: float) -> list:
+    """
+    Render the sidebar controls for the settings to compare.
+    
+    Args:
+        max_tokens: Default response length (from the chat settings)
+        temperature: Default temperature (from the chat settings)
+    
+    Returns:
+        The configured variants
+    """
+    count = st.sidebar.number_input(
+        "Variants", 2, MAX_VARIANTS, 2, key="variant_count"
+    )
+    variants = []
+    for i in range(int(count)):
+        with st.sidebar.expander(f"Variant {i + 1}", expanded=i < 2):
+            model = st.selectbox(
+                "Model", MODELS, index=i % len(MODELS), key=f"variant_model_{i}"
+            )
+            variant_temperature = st.slider(
+                "Temperature", 0.0, 2.0, temperature, 0.1,
+                key=f"variant_temperature_{i}"
+            )
+            variant_tokens = st.slider(
+                "Max tokens", 50, 500, max_tokens, key=f"variant_tokens_{i}"
+            )
+        variants.append(Variant(model, variant_temperature, variant_tokens))
+    return variants
+
+def run_comparison(prompt: str, variants: list) -> str:
+    """
+    Stream a prompt through several variants at once into side-by-side columns.
+    
+    Every variant streams on its own worker thread; this thread only
+    redraws the columns, so the wait is that of the slowest variant.
+    
+    Args:
+        prompt: User input prompt
+        variants: Settings to compare
+    
+    Returns:
+        Markdown with every variant's answer and metrics, for the history
+    """
+    run = ComparisonRun(
+        get_openai_client(),
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        variants,
+        limiter=session_limiter()
+    )
+    slots = []
+    for column, variant in zip(st.columns(len(variants)), variants):
+        with column:
+            st.markdown(f"**{variant.label}**")
+            # Each column redraws at a limited frame rate, not once per token
+            slots.append((StreamRenderer(st.empty()), st.empty()))
+    summaries = [None] * len(variants)
+    
+    with span("comparison", variants=len(variants)) as comparison:
+        for changed in run.updates():
+            for index in changed:
+                result = run.results[index]
+                renderer, metrics = slots[index]
+                if result.done:
+                    renderer.finish(result.text)
+                else:
+                    renderer.update(result.text)
+                if result.summary() != summaries[index]:
+                    summaries[index] = result.summary()
+                    metrics.caption(summaries[index])
+        comparison.set(frames=sum(renderer.frames for renderer, _ in slots))
+    
+    return "\n\n".join(
+        f"**{result.variant.label}** ({result.summary()})\n\n{result.text}"
+        for result in run.results
+    )
+
+def session_limiter():
+    """
+    Return the limiter for this session's requests.
+    
+    Requests wait for the session's share of the scheduler (when enabled)
+    and are checked against the session's and user's quotas (when set).
+    
+    Returns:
+        Limiter to pass as ``limiter=``, or None if nothing is limited
+    """
+    session_id = st.session_state.get("session_id")
+    return quota_limiter(
+        limiter_for(INTERACTIVE, session_id),
+        session_id,
+        st.session_state.get("user_id"),
+    )
+
+def add_message(role: str, content: str) -> None:
+    """
+    Append a message to the chat history and the shared store.
+    
+    Args:
+        role: Message role ("user" or "assistant")
+        content: Message text
+    """
+    message = finalize_message({"role": role, "content": content})
+    st.session_state.messages.append(message)
+    persist_message(st.session_state, message)
+
+def open_conversation(messages: List[Dict[str, str]]) -> None:
+    """
+    Show a journaled conversation the user opened from the search.
+    
+    Args:
+        messages: The conversation's messages
+    """
+    st.session_state.messages = [dict(GREETING)] + messages
+
 @st.cache_data
 def get_ai_response(prompt: str, max_tokens: int = 150, temperature: float = 1.0) -> str:
     """
     Get response from OpenAI API with caching.
     
+    ``st.cache_data`` only caches within this process; when a shared store
+    is configured, responses are also shared with the other processes.
+    
     Args:
         prompt: User input prompt
-        max_tokens: Maximum tokens in response
+        max_tokens: Maximum tokens in response (the request itself asks for
+            a predicted, usually smaller, budget and continues if cut off)
         temperature: Creativity level (0.0 to 2.0)
     
     Returns:
         AI response string
     """
+    store = get_shared_store()
+    cache_key = make_cache_key("streamlit_app", prompt, max_tokens, temperature)
+    if store is not None:
+        with span("shared_cache_lookup") as lookup:
+            cached = store.cache_get(cache_key)
+            lookup.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+    
     try:
         client = get_openai_client()
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful and friendly AI assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature
-        )
+        prompt_class = CompletionLengthPredictor.classify(prompt, app="streamlit_app")
+        with span("api_call", prompt_class=prompt_class) as call:
+            result = budgeted_completion(
+                client,
+                [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                prompt_class,
+                ceiling=max_tokens,
+                limiter=session_limiter(),
+                model="gpt-3.5-turbo",
+                temperature=temperature
+            )
+            call.set(completion_tokens=result.completion_tokens)
         
-        return response.choices[0].message.content
+        if store is not None:
+            store.cache_set(cache_key, result.content)
+        return result.content
+    except QuotaExceeded:
+        raise
     except Exception as e:
         raise Exception(f"OpenAI API error: {str(e)}")
 
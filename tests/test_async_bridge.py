@@ -0,0 +1,138 @@
+"""
+Tests for the background event loop bridge.
+"""
+
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from src import async_bridge
+from src.async_bridge import (
+    BackgroundLoop,
+    get_background_loop,
+    iterate_async,
+    run_async,
+)
+
+
+@pytest.fixture
+def loop():
+    """A background loop closed after the test."""
+    background = BackgroundLoop(name="test-loop")
+    yield background
+    background.close()
+
+
+async def numbers(count, delay=0.0, fail_at=None, state=None):
+    """Async generator recording whether it was closed."""
+    try:
+        for number in range(count):
+            if number == fail_at:
+                raise RuntimeError("stream broke")
+            await asyncio.sleep(delay)
+            yield number
+    finally:
+        if state is not None:
+            state["closed"] = True
+
+
+class TestBackgroundLoop:
+    """Test cases for BackgroundLoop."""
+
+    def test_run_returns_result(self, loop):
+        """Test running a coroutine from synchronous code."""
+        async def add(a, b):
+            await asyncio.sleep(0)
+            return a + b
+        assert loop.run(add(2, 3)) == 5
+
+    def test_run_raises_coroutine_errors(self, loop):
+        """Test that exceptions reach the caller."""
+        async def fail():
+            raise KeyError("missing")
+        with pytest.raises(KeyError):
+            loop.run(fail())
+
+    def test_timeout_cancels_coroutine(self, loop):
+        """Test that giving up on a result cancels its task."""
+        cancelled = threading.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        with pytest.raises(TimeoutError):
+            loop.run(slow(), timeout=0.05)
+        assert cancelled.wait(1)
+
+    def test_many_requests_share_one_thread(self, loop):
+        """Test that concurrent waits cost coroutines, not threads."""
+        async def request():
+            await asyncio.sleep(0.2)
+            return threading.get_ident()
+
+        async def fan_out():
+            return await asyncio.gather(*(request() for _ in range(2000)))
+
+        threads_before = threading.active_count()
+        started = time.perf_counter()
+        idents = loop.run(fan_out())
+        assert time.perf_counter() - started < 1.5
+        assert len(set(idents)) == 1
+        assert threading.active_count() == threads_before
+
+    def test_iterate_yields_items(self, loop):
+        """Test consuming an async generator."""
+        assert list(loop.iterate(numbers(5))) == [0, 1, 2, 3, 4]
+
+    def test_iterate_raises_stream_errors(self, loop):
+        """Test that an error mid-stream follows the items before it."""
+        received = []
+        with pytest.raises(RuntimeError, match="stream broke"):
+            for number in loop.iterate(numbers(5, fail_at=2)):
+                received.append(number)
+        assert received == [0, 1]
+
+    def test_leaving_early_closes_stream(self, loop):
+        """Test that abandoning the iterator closes the async generator."""
+        state = {}
+        for number in loop.iterate(numbers(1000, delay=0.01, state=state)):
+            if number == 2:
+                break
+        deadline = time.monotonic() + 1
+        while "closed" not in state and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert state == {"closed": True}
+
+    def test_close_stops_thread(self):
+        """Test shutting the loop down."""
+        background = BackgroundLoop()
+        assert background.running
+        background.close()
+        assert not background.running
+
+
+class TestProcessLoop:
+    """Test cases for the process-wide loop."""
+
+    def test_shared_loop(self):
+        """Test that the helpers use one loop per process."""
+        async def current_loop():
+            return asyncio.get_running_loop()
+        assert run_async(current_loop()) is get_background_loop().loop
+        assert list(iterate_async(numbers(3))) == [0, 1, 2]
+
+    def test_new_loop_after_fork(self):
+        """Test that a forked process does not reuse the parent's loop."""
+        parent = get_background_loop()
+        with patch.object(async_bridge, "_loop_pid", -1):
+            child = get_background_loop()
+        try:
+            assert child is not parent
+            assert child.running
+        finally:
+            child.close()
+            async_bridge._loop = parent
@@ -0,0 +1,58 @@
+"""
+Microbenchmark regression gates.
+
+The benchmark-marked tests are deselected by default; run them with
+``pytest -m benchmark --no-cov`` (coverage tracing distorts timings).
+"""
+
+import json
+import os
+import sys
+import pytest
+from unittest.mock import patch
+from benchmarks import micro
+
+
+class TestBaselines:
+    """Test cases for baseline handling."""
+
+    def test_check_within_tolerance(self):
+        """Test that measurements inside the tolerance pass."""
+        with patch.dict(os.environ, {"BENCHMARK_TOLERANCE": "0.5"}):
+            assert micro.check("b", 1.4, {"b": 1.0}) is None
+            assert micro.check("new", 100.0, {"b": 1.0}) is None
+
+    def test_check_regression(self):
+        """Test that slow measurements fail with a readable message."""
+        with patch.dict(os.environ, {"BENCHMARK_TOLERANCE": "0.5"}):
+            failure = micro.check("b", 2.0, {"b": 1.0})
+        assert failure.startswith("b: ")
+        assert "100% slower" in failure
+
+    def test_ungated_benchmarks_only_report(self):
+        """Test that noisy benchmarks never fail the gate."""
+        assert "openai_client_construction" in micro.UNGATED
+        baselines = {"openai_client_construction": 1.0}
+        assert micro.check("openai_client_construction", 10.0, baselines) is None
+
+    def test_baselines_round_trip(self, tmp_path):
+        """Test saving and loading baselines."""
+        path = str(tmp_path / "baselines.json")
+        assert micro.load_baselines(path) == {}
+        micro.save_baselines({"b": 0.25}, path)
+        assert micro.load_baselines(path) == {"b": 0.25}
+
+    def test_every_benchmark_has_a_baseline(self):
+        """Test that the stored baselines cover the whole suite."""
+        with open(micro.BASELINE_PATH, encoding="utf-8") as baseline_file:
+            assert set(json.load(baseline_file)) == set(micro.BENCHMARKS)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("name", sorted(micro.BENCHMARKS))
+def test_benchmark(name):
+    """Fail when a hot path regresses beyond the allowed tolerance."""
+    if sys.gettrace() is not None:
+        pytest.skip("benchmarks need --no-cov and no debugger")
+    failure = micro.check(name, micro.measure(name), micro.load_baselines())
+    assert failure is None, failure
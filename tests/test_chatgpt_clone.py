@@ -12,6 +12,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import the module we're testing
 import chatgpt_clone
+from src import quotas
+from src.quotas import QuotaExceeded, QuotaLimits, QuotaManager
 
 
 class TestChatGPTClone:
@@ -141,6 +143,103 @@ class TestChatGPTClone:
             assert messages[0]["role"] == "system"
             assert messages[1]["content"] == "Hello"
 
+    @patch('chatgpt_clone.get_openai_client')
+    def test_get_chat_response_with_retrieval_memory(self, mock_get_client):
+        """Test that retrieval memory replaces the fixed history window."""
+        from src.retrieval_memory import ConversationMemory, HashingEmbedder
+        
+        history = [{"role": "user", "content": "My favourite colour is teal"}]
+        for i in range(30):
+            history.append({"role": "user", "content": f"Filler question {i}"})
+            history.append({"role": "assistant", "content": f"Filler answer {i}"})
+        
+        mock_client = Mock()
+        mock_choice = Mock()
+        mock_choice.message.content = "Teal"
+        mock_client.chat.completions.create.return_value.choices = [mock_choice]
+        mock_get_client.return_value = mock_client
+        
+        mock_session_state = Mock()
+        mock_session_state.messages = history
+        memory = ConversationMemory(HashingEmbedder(), top_k=2, recent=4)
+        
+        with patch('chatgpt_clone.st') as mock_st:
+            mock_st.session_state = mock_session_state
+            
+            chatgpt_clone.get_chat_response("What is my favourite colour?", memory)
+            
+            messages = mock_client.chat.completions.create.call_args[1]["messages"]
+            
+            # system + 2 recalled + 4 recent + new prompt
+            assert len(messages) == 8
+            assert messages[1]["content"] == "My favourite colour is teal"
+
+
+    @patch('chatgpt_clone.get_openai_client')
+    def test_embedding_errors_fall_back_to_history_window(self, mock_get_client):
+        """Test that a failing embedder degrades to answering without retrieval."""
+        from src.retrieval_memory import ConversationMemory
+        
+        embedder = Mock(dim=8)
+        embedder.embed.side_effect = TimeoutError("embeddings timed out")
+        memory = ConversationMemory(embedder, top_k=2, recent=4)
+        history = [{"role": "user", "content": f"Question {i}"} for i in range(6)]
+        
+        mock_client = Mock()
+        mock_client.chat.completions.create.return_value.choices = [
+            Mock(finish_reason="stop")
+        ]
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "Hi"
+        mock_get_client.return_value = mock_client
+        
+        mock_session_state = Mock()
+        mock_session_state.messages = history
+        mock_session_state.get.return_value = memory
+        
+        with patch('chatgpt_clone.st') as mock_st, \
+                patch('chatgpt_clone.persist_message'):
+            mock_st.session_state = mock_session_state
+            
+            chatgpt_clone.add_message("user", "Question 6")
+            assert history[-1]["content"] == "Question 6"
+            
+            assert chatgpt_clone.get_chat_response("Question 7", memory) == "Hi"
+            messages = mock_client.chat.completions.create.call_args[1]["messages"]
+            # system + the whole (short) history window + new prompt
+            assert len(messages) == len(history) + 2
+        
+        assert len(memory) == 0
+
+    @patch('chatgpt_clone.get_openai_client')
+    def test_get_chat_response_over_session_quota(self, mock_get_client):
+        """Test that a session over its quota is refused before the API call."""
+        mock_client = Mock()
+        mock_response = Mock()
+        mock_response.choices = [Mock(finish_reason="stop")]
+        mock_response.choices[0].message.content = "AI response"
+        mock_client.chat.completions.create.return_value = mock_response
+        mock_get_client.return_value = mock_client
+        manager = QuotaManager(QuotaLimits(requests=1))
+        
+        mock_session_state = Mock()
+        mock_session_state.messages = []
+        mock_session_state.session_id = "heavy-user"
+        mock_session_state.get.return_value = None
+        
+        with patch('chatgpt_clone.st') as mock_st, \
+                patch.object(quotas, "_manager", manager), \
+                patch.object(quotas, "_configured", True):
+            mock_st.session_state = mock_session_state
+            
+            assert chatgpt_clone.get_chat_response("First") == "AI response"
+            with pytest.raises(QuotaExceeded, match="try again in"):
+                chatgpt_clone.get_chat_response("Second")
+            
+            mock_session_state.session_id = "someone-else"
+            assert chatgpt_clone.get_chat_response("Third") == "AI response"
+        
+        assert mock_client.chat.completions.create.call_count == 2
+
 
 class TestChatGPTCloneIntegration:
     """Integration tests for ChatGPT clone."""
@@ -0,0 +1,191 @@
+"""
+Tests for concurrent multi-variant comparison.
+"""
+
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from streamlit.testing.v1 import AppTest
+from benchmarks.mock_server import MockCompletionServer
+from src.comparison import ComparisonRun, Variant, VariantResult
+from src.token_budget import TokenRateLimiter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def chunk(content=None, finish_reason=None):
+    """Build a streamed chunk with one choice."""
+    choice = SimpleNamespace(
+        delta=SimpleNamespace(content=content), finish_reason=finish_reason
+    )
+    return SimpleNamespace(choices=[choice], usage=None)
+
+
+class SlowStream:
+    """Stream yielding words with a delay, like a remote model."""
+
+    def __init__(self, words, delay):
+        self.words = words
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for word in self.words:
+            if self.closed:
+                return
+            time.sleep(self.delay)
+            yield chunk(word)
+        usage = SimpleNamespace(
+            completion_tokens=len(self.words), prompt_tokens=7
+        )
+        yield chunk(None, "stop")
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(delay=0.02, fail_model=None):
+    """Client whose answer names the requested model."""
+    client = Mock()
+
+    def create(model, max_tokens, **kwargs):
+        if model == fail_model:
+            raise RuntimeError("model unavailable")
+        words = [model, " answers", f" with {max_tokens}"] + [" word"] * 7
+        return SlowStream(words, delay)
+    client.chat.completions.create.side_effect = create
+    return client
+
+
+VARIANTS = [
+    Variant("gpt-3.5-turbo", 0.2, 100),
+    Variant("gpt-4o-mini", 1.0, 200),
+    Variant("gpt-4o", 0.7, 300),
+]
+
+
+class TestComparisonRun:
+    """Test cases for ComparisonRun."""
+
+    def test_variants_stream_concurrently(self):
+        """Test that the wait is the slowest variant, not the sum."""
+        run = ComparisonRun(fake_client(), [], VARIANTS, limiter=None)
+
+        started = time.perf_counter()
+        batches = list(run.updates())
+        elapsed = time.perf_counter() - started
+
+        # Each variant takes 0.2 seconds; one after another would take 0.6
+        assert elapsed < 0.4
+        assert all(r.done and r.error is None for r in run.results)
+        assert run.results[1].text.startswith("gpt-4o-mini answers with 200")
+        assert run.results[2].completion_tokens == 10
+        assert {index for batch in batches for index in batch} == {0, 1, 2}
+
+    def test_requests_use_variant_settings(self):
+        """Test that each request gets its own model settings."""
+        client = fake_client(delay=0)
+        messages = [{"role": "user", "content": "x"}]
+        list(ComparisonRun(client, messages, VARIANTS).updates())
+        sent = {
+            call.kwargs["model"]: (
+                call.kwargs["temperature"], call.kwargs["max_tokens"]
+            )
+            for call in client.chat.completions.create.call_args_list
+        }
+        assert sent == {v.model: (v.temperature, v.max_tokens) for v in VARIANTS}
+
+    def test_failing_variant_does_not_stop_others(self):
+        """Test that one variant's error is reported on its own."""
+        run = ComparisonRun(fake_client(fail_model="gpt-4o"), [], VARIANTS)
+        list(run.updates())
+        assert run.results[2].error == "model unavailable"
+        assert run.results[2].summary() == "❌ model unavailable"
+        assert run.results[0].text
+
+    def test_leaving_early_cancels_streams(self):
+        """Test that abandoning the updates stops every variant."""
+        run = ComparisonRun(fake_client(delay=0.05), [], VARIANTS)
+        updates = run.updates()
+        next(updates)
+        updates.close()
+        time.sleep(0.15)
+        assert all(result.done for result in run.results)
+        assert all(len(result.text) < 40 for result in run.results)
+
+    def test_not_done_while_deltas_are_queued(self):
+        """Test that a variant is done only once its whole text was taken."""
+        run = ComparisonRun(fake_client(delay=0), [], VARIANTS[:1], limiter=None)
+        # The worker has streamed everything; the deltas are still queued
+        run._run_variant(0)
+        assert not run.results[0].done
+        assert run.results[0].text == ""
+
+        updates = run.updates()
+        with patch.object(run, "_run_variant"):
+            for _ in updates:
+                pass
+        assert run.results[0].done
+        assert run.results[0].text.startswith("gpt-3.5-turbo answers with 100")
+        assert run.results[0].text.endswith(" word" * 7)
+
+    def test_reservations_are_released(self):
+        """Test that every variant goes through the rate limiter."""
+        limiter = TokenRateLimiter(100_000)
+        run = ComparisonRun(fake_client(delay=0), [], VARIANTS, limiter=limiter)
+        list(run.updates())
+        assert limiter.in_flight == 0
+        assert 100_000 - 100 < limiter.available < 100_000
+
+
+class TestVariantResult:
+    """Test cases for variant metrics."""
+
+    def test_tokens_per_second(self):
+        """Test that speed is measured after the first token."""
+        result = VariantResult(
+            Variant("m", 1.0, 100), text="x", first_token_seconds=0.5,
+            latency_seconds=1.5, completion_tokens=51, prompt_tokens=9,
+        )
+        assert result.tokens_per_second == 50
+        assert result.summary() == (
+            "⏱️ 1.50s · first token 0.50s · 50 tok/s · 9 + 51 tokens"
+        )
+
+    def test_pending_summary(self):
+        """Test the summary while streaming."""
+        pending = VariantResult(Variant("m", 1.0, 100))
+        assert pending.summary() == "⏳ streaming..."
+        assert Variant("m", 0.5, 100).label == "m · T=0.5 · 100 tok"
+
+
+class TestComparisonMode:
+    """Test cases for the comparison mode in streamlit_app."""
+
+    def test_prompt_fans_out_to_columns(self):
+        """Test a comparison through the app and the real client."""
+        with MockCompletionServer(latency=1.0) as server, patch.dict(
+            os.environ,
+            {"OPENAI_API_KEY": "sk-test", "OPENAI_BASE_URL": server.base_url},
+        ):
+            app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"))
+            app.run()
+            app.toggle(key="compare_mode").set_value(True).run()
+            app.number_input(key="variant_count").set_value(3).run()
+            app.slider(key="variant_tokens_1").set_value(50).run()
+
+            started = time.perf_counter()
+            app.chat_input[0].set_value("Tell me a story").run()
+            elapsed = time.perf_counter() - started
+
+        assert not app.exception
+        assert server.requests == 3
+        # One variant after another would take at least 3 * 1.0 seconds
+        assert elapsed < 2.5
+        metrics = [c for c in app.caption if c.value.startswith("⏱️")]
+        assert len(metrics) == 3
+        assert all("tokens" in caption.value for caption in metrics)
+        answer = app.session_state.messages[-1]["content"]
+        assert "gpt-4o-mini · T=1 · 50 tok" in answer
@@ -0,0 +1,240 @@
+"""
+Tests for the record/replay HTTP transports.
+"""
+
+import json
+import os
+import threading
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+from openai import AsyncOpenAI, NotFoundError, OpenAI
+from benchmarks.mock_server import MockCompletionServer
+from src import http_replay
+from src.async_bridge import run_async
+from src.http_replay import (
+    RecordingTransport,
+    ReplayTransport,
+    exchange_key,
+    get_env_transport,
+    load_exchanges,
+)
+from src.openai_example import get_openai_client
+from src.streaming import CancellableStream
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "hello.jsonl")
+MESSAGES = [{"role": "user", "content": "Hello! How are you?"}]
+STREAM = {"stream": True, "stream_options": {"include_usage": True}}
+
+
+def replay_client(**kwargs):
+    """Build a real OpenAI client replaying the hello fixture."""
+    transport = ReplayTransport.from_file(FIXTURE, **kwargs)
+    return OpenAI(api_key="sk-test", http_client=httpx.Client(transport=transport))
+
+
+def create(client, **kwargs):
+    """Send the fixture's request."""
+    return client.chat.completions.create(
+        model="gpt-3.5-turbo", messages=MESSAGES, max_tokens=150, **kwargs
+    )
+
+
+class TestRecordingTransport:
+    """Test cases for RecordingTransport."""
+
+    def test_records_plain_and_streamed_exchanges(self, tmp_path):
+        """Test that exchanges round-trip through a fixture."""
+        path = str(tmp_path / "rec.jsonl")
+        with MockCompletionServer(chunk_delay=0.01) as server:
+            client = OpenAI(
+                api_key="sk-secret",
+                base_url=server.base_url,
+                http_client=httpx.Client(transport=RecordingTransport(path)),
+            )
+            plain = create(client).choices[0].message.content
+            streamed = "".join(
+                chunk.choices[0].delta.content or ""
+                for chunk in create(client, stream=True)
+                if chunk.choices
+            )
+
+        exchanges = load_exchanges(path)
+        assert len(exchanges) == 2
+        assert exchanges[1]["request"]["body"]["stream"] is True
+        assert exchanges[1]["headers"]["content-type"] == "text/event-stream"
+        # Streamed chunks arrive over time
+        offsets = [offset for offset, _ in exchanges[1]["chunks"]]
+        assert offsets == sorted(offsets) and offsets[-1] > offsets[0]
+        assert "sk-secret" not in open(path, encoding="utf-8").read()
+
+        client = OpenAI(
+            api_key="sk-test",
+            http_client=httpx.Client(
+                transport=ReplayTransport(exchanges, time_scale=0)
+            ),
+        )
+        assert create(client).choices[0].message.content == plain == streamed
+
+    def test_records_async_exchanges(self, tmp_path):
+        """Test that the async client is recorded in the same format."""
+        path = str(tmp_path / "rec.jsonl")
+
+        async def exchange(base_url):
+            client = AsyncOpenAI(
+                api_key="sk-secret",
+                base_url=base_url,
+                http_client=httpx.AsyncClient(transport=RecordingTransport(path)),
+            )
+            plain = await create(client)
+            stream = await create(client, **STREAM)
+            streamed = "".join([
+                chunk.choices[0].delta.content or ""
+                async for chunk in stream
+                if chunk.choices
+            ])
+            await client.close()
+            return plain.choices[0].message.content, streamed
+
+        with MockCompletionServer(chunk_delay=0.01) as server:
+            plain, streamed = run_async(exchange(server.base_url))
+
+        exchanges = load_exchanges(path)
+        assert plain == streamed
+        assert [e["request"]["body"].get("stream") for e in exchanges] == [None, True]
+        assert len(exchanges[1]["chunks"]) > 1
+
+
+class TestReplayTransport:
+    """Test cases for ReplayTransport."""
+
+    def test_replays_through_openai_client(self):
+        """Test a plain and a streamed replay."""
+        client = replay_client(time_scale=0)
+        plain = create(client)
+        assert plain.usage.completion_tokens == 20
+        stream = CancellableStream(client, MESSAGES, 150, model="gpt-3.5-turbo")
+        assert "".join(stream) == plain.choices[0].message.content
+        assert stream.finished and stream.completion_tokens == 20
+
+    def test_replays_at_recorded_pace(self):
+        """Test that time_scale stretches the recorded timings."""
+        last_chunk = load_exchanges(FIXTURE)[1]["chunks"][-1][0] / 1000
+
+        started = time.perf_counter()
+        list(create(replay_client(time_scale=0.5), **STREAM))
+        paced = time.perf_counter() - started
+
+        started = time.perf_counter()
+        list(create(replay_client(time_scale=0), **STREAM))
+        fast = time.perf_counter() - started
+
+        assert paced >= last_chunk * 0.5 * 0.9
+        assert fast < paced / 2
+
+    def test_cancel_interrupts_paced_replay(self):
+        """Test that closing the response stops waiting for chunks."""
+        stream = CancellableStream(
+            replay_client(time_scale=5), MESSAGES, 150, model="gpt-3.5-turbo"
+        )
+        threading.Timer(0.1, stream.cancel).start()
+        started = time.perf_counter()
+        list(stream)
+        assert stream.cancelled
+        assert time.perf_counter() - started < 1
+
+    def test_replays_to_async_client(self):
+        """Test that the async client replays the same fixture at its pace."""
+        last_chunk = load_exchanges(FIXTURE)[1]["chunks"][-1][0] / 1000
+        transport = ReplayTransport.from_file(FIXTURE, time_scale=0.5)
+
+        async def replay():
+            client = AsyncOpenAI(
+                api_key="sk-test", http_client=httpx.AsyncClient(transport=transport)
+            )
+            plain = await create(client)
+            started = time.perf_counter()
+            stream = await create(client, **STREAM)
+            chunks = [chunk async for chunk in stream]
+            return plain, chunks, time.perf_counter() - started
+
+        plain, chunks, elapsed = run_async(replay())
+        assert plain.choices[0].message.content.startswith("This is a mock")
+        assert chunks[-1].usage.completion_tokens == 20
+        assert elapsed >= last_chunk * 0.5 * 0.9
+
+    def test_unmatched_request_is_not_found(self):
+        """Test that requests missing from the fixture fail without retries."""
+        transport = ReplayTransport.from_file(FIXTURE, time_scale=0)
+        client = OpenAI(
+            api_key="sk-test", http_client=httpx.Client(transport=transport)
+        )
+        with pytest.raises(NotFoundError, match="No recorded exchange"):
+            client.chat.completions.create(model="gpt-4", messages=MESSAGES)
+        assert transport.requests == 1
+
+    def test_repeated_requests_cycle(self):
+        """Test that recordings are reused once exhausted."""
+        exchange = load_exchanges(FIXTURE)[0]
+        second = json.loads(json.dumps(exchange).replace("This is", "That was"))
+        client = OpenAI(
+            api_key="sk-test",
+            http_client=httpx.Client(
+                transport=ReplayTransport([exchange, second], time_scale=0)
+            ),
+        )
+        answers = [create(client).choices[0].message.content[:7] for _ in range(3)]
+        assert answers == ["This is", "That wa", "This is"]
+
+    def test_match_on_path_only(self):
+        """Test that match_body=False ignores request bodies."""
+        transport = ReplayTransport.from_file(FIXTURE, time_scale=0, match_body=False)
+        client = OpenAI(
+            api_key="sk-test", http_client=httpx.Client(transport=transport)
+        )
+        response = client.chat.completions.create(model="other", messages=[])
+        assert response.choices[0].message.content.startswith("This is")
+
+    def test_exchange_key_ignores_key_order(self):
+        """Test that body keys are compared canonically."""
+        assert exchange_key("post", "/p", {"a": 1, "b": 2}) == exchange_key(
+            "POST", "/p", {"b": 2, "a": 1}
+        )
+        assert exchange_key("POST", "/p", {"a": 1}, match_body=False) == "POST /p"
+        assert exchange_key("POST", "/p", {"stream": True}, False) == "POST /p stream"
+
+
+class TestEnvTransport:
+    """Test cases for environment configuration."""
+
+    @patch.dict(
+        os.environ,
+        {"OPENAI_REPLAY_FIXTURE": FIXTURE, "OPENAI_REPLAY_TIME_SCALE": "0"},
+        clear=True,
+    )
+    @patch.object(http_replay, "_env_transport", None)
+    def test_get_openai_client_replays_without_api_key(self):
+        """Test that a replay fixture needs no API key."""
+        client = get_openai_client()
+        assert create(client).choices[0].message.content.startswith("This is")
+        assert get_env_transport() is get_env_transport()
+
+    @patch.dict(
+        os.environ,
+        {"OPENAI_API_KEY": "sk-test", "OPENAI_RECORD_FIXTURE": "out.jsonl"},
+        clear=True,
+    )
+    @patch.object(http_replay, "_env_transport", None)
+    def test_record_fixture_from_env(self):
+        """Test that OPENAI_RECORD_FIXTURE selects the recorder."""
+        transport = get_env_transport()
+        assert isinstance(transport, RecordingTransport)
+        assert transport.path == "out.jsonl"
+        assert get_openai_client()._client._transport is transport
+
+    @patch.dict(os.environ, {}, clear=True)
+    @patch.object(http_replay, "_env_transport", None)
+    def test_no_transport_by_default(self):
+        """Test that the network is used when nothing is configured."""
+        assert get_env_transport() is None
@@ -0,0 +1,376 @@
+"""
+Tests for the conversation journal.
+"""
+
+import os
+import pytest
+from unittest.mock import Mock, patch
+from streamlit.testing.v1 import AppTest
+from src import journal as journal_module
+from src.journal import (
+    CONVERSATION_PARAM,
+    ConversationJournal,
+    decode_postings,
+    get_conversation_id,
+    get_journal,
+    new_conversation,
+    persist_message,
+    render_search,
+    saved_messages,
+    switch_conversation,
+    tokenize,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Owner of AppTest sessions, whose user is test@example.com
+OWNER = "user:test@example.com"
+
+
+def message(content, role="user"):
+    """Build a chat message."""
+    return {"role": role, "content": content}
+
+
+@pytest.fixture
+def directory(tmp_path):
+    """Directory for a fresh journal."""
+    return str(tmp_path / "journal")
+
+
+def fill(journal, count, conversations=3):
+    """Append numbered messages round-robin to a few conversations."""
+    for i in range(count):
+        journal.append(f"c{i % conversations}", message(f"note {i} tag{i % 5}"))
+
+
+class TestConversationJournal:
+    """Test cases for ConversationJournal."""
+
+    def test_append_and_load(self, directory):
+        """Test loading a conversation in order."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        assert journal.append("a", message("Hi")) == 0
+        journal.append("b", message("Other"))
+        journal.append("a", message("Hello!", "assistant"))
+        assert journal.load_messages("a") == [
+            message("Hi"), message("Hello!", "assistant")
+        ]
+        assert journal.load_messages("missing") == []
+        assert len(journal) == 3
+        journal.close()
+
+    def test_search_needs_every_word(self, directory):
+        """Test case-insensitive AND search, newest first."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        journal.append("a", message("The capital of France is Paris"))
+        journal.append("b", message("Paris, Texas is a film"))
+        journal.append("b", message("France has many cheeses"))
+        hits = journal.search("paris")
+        assert [hit.conversation for hit in hits] == ["b", "a"]
+        [hit] = journal.search("FRANCE paris")
+        assert (hit.message_id, hit.role) == (0, "user")
+        assert hit.content == "The capital of France is Paris"
+        assert journal.search("paris berlin") == []
+        assert journal.search("  ") == []
+        journal.close()
+
+    def test_owners_only_see_their_messages(self, directory):
+        """Test that searches and loads filtered by owner skip other users."""
+        journal = ConversationJournal(directory, segment_bytes=300, sync_interval=None)
+        for i in range(20):
+            owner = "user:alice" if i % 2 else "user:bob"
+            journal.append(f"{owner}-chat", message(f"secret plan {i}"), owner)
+        journal.append("user:bob-chat", message("secret plan B"), "user:alice")
+        journal.close()
+
+        reopened = ConversationJournal(directory, segment_bytes=300, sync_interval=None)
+        hits = reopened.search("secret", limit=100, owner="user:alice")
+        assert len(hits) == 11
+        assert {hit.conversation for hit in hits} == {
+            "user:alice-chat", "user:bob-chat"
+        }
+        assert reopened.search("secret", owner="user:carol") == []
+        assert len(reopened.search("secret", limit=100)) == 21
+        assert reopened.load_messages("user:bob-chat", owner="user:alice") == [
+            message("secret plan B")
+        ]
+        assert reopened.load_messages("user:alice-chat", owner="user:bob") == []
+        assert len(reopened.load_messages("user:bob-chat")) == 11
+        reopened.close()
+
+    def test_reads_do_not_hold_the_append_lock(self, directory):
+        """Test that records are read after the lock is released."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        fill(journal, 30)
+        original = journal._read
+
+        def read(segment, local):
+            assert not journal._lock.locked()
+            return original(segment, local)
+
+        with patch.object(journal, "_read", read):
+            assert len(journal.search("tag1", limit=100)) == 6
+            assert len(journal.load_messages("c1")) == 10
+        journal.close()
+
+    def test_short_writes_are_completed(self, directory):
+        """Test that a record written in several pieces is stored whole."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        real_write = os.write
+
+        def short_write(fd, data):
+            return real_write(fd, bytes(data[:7]))
+
+        with patch("src.journal.os.write", short_write):
+            journal.append("a", message("written seven bytes at a time"))
+        journal.append("a", message("then whole"))
+        journal.close()
+
+        reopened = ConversationJournal(directory, sync_interval=None)
+        assert reopened.load_messages("a") == [
+            message("written seven bytes at a time"), message("then whole")
+        ]
+        reopened.close()
+
+    def test_segments_rotate_and_reopen(self, directory):
+        """Test that sealed segments keep their index across restarts."""
+        journal = ConversationJournal(directory, segment_bytes=1000, sync_interval=None)
+        fill(journal, 200)
+        expected = [hit.message_id for hit in journal.search("tag3", limit=100)]
+        journal.close()
+        names = os.listdir(directory)
+        logs = [name for name in names if name.endswith(".log")]
+        assert len(logs) > 5
+        assert len([name for name in names if name.endswith(".idx")]) == len(logs) - 1
+
+        reopened = ConversationJournal(
+            directory, segment_bytes=1000, sync_interval=None
+        )
+        assert len(reopened) == 200
+        hits = reopened.search("tag3", limit=100)
+        assert [hit.message_id for hit in hits] == expected
+        assert len(expected) == 40
+        assert reopened.append("c0", message("later")) == 200
+        assert reopened.load_messages("c0", limit=2) == [
+            message("note 198 tag3"), message("later")
+        ]
+        reopened.close()
+
+    def test_resume_reads_only_the_conversation(self, directory):
+        """Test that loading a conversation does not read other records."""
+        journal = ConversationJournal(directory, segment_bytes=2000, sync_interval=None)
+        fill(journal, 300, conversations=30)
+        with patch("src.journal.os.pread", wraps=os.pread) as pread:
+            messages = journal.load_messages("c7")
+        assert len(messages) == 10
+        # Two reads (header and payload) per message
+        assert pread.call_count == 20
+        with patch("src.journal.os.pread", wraps=os.pread) as pread:
+            assert journal.load_messages("c7", limit=3)[-1] == message("note 277 tag2")
+        assert pread.call_count == 6
+        journal.close()
+
+    def test_torn_write_is_dropped(self, directory):
+        """Test that a partial record at the end is discarded on reopen."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        journal.append("a", message("kept"))
+        journal.close()
+        with open(os.path.join(directory, "00000001.log"), "ab") as log:
+            log.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{\"c\":")
+
+        reopened = ConversationJournal(directory, sync_interval=None)
+        assert len(reopened) == 1
+        reopened.append("a", message("next"))
+        assert reopened.load_messages("a") == [message("kept"), message("next")]
+        reopened.close()
+
+    def test_directory_is_locked(self, directory):
+        """Test that a second journal cannot open a directory in use."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        with pytest.raises(RuntimeError, match="already in use"):
+            ConversationJournal(directory, sync_interval=None)
+        journal.close()
+
+        reopened = ConversationJournal(directory, sync_interval=None)
+        reopened.close()
+
+    def test_stale_index_is_rebuilt(self, directory):
+        """Test that a sealed segment whose index is missing is rescanned."""
+        journal = ConversationJournal(directory, segment_bytes=500, sync_interval=None)
+        fill(journal, 40)
+        journal.close()
+        os.remove(os.path.join(directory, "00000001.idx"))
+
+        reopened = ConversationJournal(directory, segment_bytes=500, sync_interval=None)
+        assert os.path.exists(os.path.join(directory, "00000001.idx"))
+        assert len(reopened.search("tag0", limit=100)) == 8
+        reopened.close()
+
+    def test_syncs_are_batched(self, directory):
+        """Test that many appends share one background fsync."""
+        journal = ConversationJournal(directory, sync_interval=0.05)
+        with patch("src.journal.os.fsync") as fsync:
+            fill(journal, 500)
+            journal._stop.wait(0.2)
+            assert 1 <= fsync.call_count <= 4
+        assert journal.syncs == fsync.call_count
+        journal.close()
+
+
+class TestPostings:
+    """Test cases for the posting list encoding."""
+
+    def test_gaps_round_trip(self, directory):
+        """Test varint gaps, including multi-byte ones."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        for i in range(400):
+            journal.append("a", message("rare" if i in (3, 4, 300) else "common"))
+        segment = journal._segments[-1]
+        assert decode_postings(segment.terms["rare"]) == [3, 4, 300]
+        # Gaps of 4, 1 and 296: one, one and two bytes
+        assert len(segment.terms["rare"]) == 4
+        assert len(segment.terms["common"]) == 397
+        journal.close()
+
+    def test_tokenize(self):
+        """Test word splitting for the index."""
+        assert tokenize("Déjà vu, DÉJÀ vu!") == {"déjà", "vu"}
+        assert tokenize("x" * 65 + " ok") == {"ok"}
+
+
+class TestConfiguration:
+    """Test cases for the process-wide journal and conversation ids."""
+
+    def test_disabled_by_default(self):
+        """Test that journaling is off without CHAT_JOURNAL_DIR."""
+        with patch.dict(os.environ, {}, clear=True), \
+                patch.object(journal_module, "_journal", None):
+            assert get_journal() is None
+
+    def test_enabled_from_environment(self, directory):
+        """Test that CHAT_JOURNAL_DIR enables a single journal."""
+        env = {"CHAT_JOURNAL_DIR": directory, "CHAT_JOURNAL_SYNC_SECONDS": "0.5"}
+        with patch.dict(os.environ, env), \
+                patch.object(journal_module, "_journal", None):
+            journal = get_journal()
+            assert journal.sync_interval == 0.5
+            assert get_journal() is journal
+            journal.close()
+
+    def test_conversation_id_follows_url(self):
+        """Test that the conversation id is carried in the URL."""
+        session_state, query_params = {}, {CONVERSATION_PARAM: "old"}
+        assert get_conversation_id(session_state, query_params) == "old"
+        new = get_conversation_id(session_state, query_params, new=True)
+        assert new != "old"
+        assert session_state["conversation_id"] == new
+        assert query_params[CONVERSATION_PARAM] == new
+
+    def test_app_helpers_without_journal(self):
+        """Test that the app helpers leave the URL alone when disabled."""
+        session_state, query_params = {"user_id": OWNER}, {}
+        with patch.dict(os.environ, {}, clear=True), \
+                patch.object(journal_module, "_journal", None):
+            assert saved_messages(session_state, query_params) == []
+            new_conversation(session_state, query_params)
+        assert session_state == {"user_id": OWNER}
+        assert query_params == {}
+
+
+class TestAppIntegration:
+    """Test cases for journaling in the chat apps."""
+
+    def test_chat_resumes_and_searches(self, directory):
+        """Test resuming after a restart and opening a search result."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        journal.append("old", message("What is the capital of France?"), OWNER)
+        journal.append("old", message("Paris.", "assistant"), OWNER)
+        journal.append("other", message("Unrelated"), OWNER)
+
+        with patch.object(journal_module, "_journal", journal):
+            app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"))
+            app.query_params[CONVERSATION_PARAM] = "old"
+            app.run()
+            assert [m["content"] for m in app.session_state.messages] == [
+                "What is the capital of France?", "Paris."
+            ]
+
+            app.button[0].click().run()  # Clear Chat
+            assert app.session_state.messages == []
+            assert app.session_state.conversation_id != "old"
+
+            app.text_input(key="journal_query").set_value("capital").run()
+            app.button(key="open_0").click().run()
+
+        assert not app.exception
+        assert app.session_state.conversation_id == "old"
+        assert len(app.session_state.messages) == 2
+        journal.close()
+
+    def test_other_users_conversations_stay_private(self, directory):
+        """Test that a user can neither find nor open another user's chat."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        journal.append("theirs", message("My bank password hint"), "user:other@x.com")
+        journal.append("mine", message("My bank opens at nine"), OWNER)
+
+        with patch.object(journal_module, "_journal", journal):
+            app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"))
+            # A conversation id copied from someone else's URL
+            app.query_params[CONVERSATION_PARAM] = "theirs"
+            app.run()
+            assert app.session_state.messages == []
+
+            app.text_input(key="journal_query").set_value("bank").run()
+            assert [button.key for button in app.button
+                    if button.key and button.key.startswith("open_")] == ["open_1"]
+            assert not any("password" in caption.value for caption in app.caption)
+
+            session_state = {"user_id": OWNER, "session_id": "s",
+                             "conversation_id": "mine"}
+            query_params = {}
+            assert switch_conversation(session_state, query_params, "theirs") is None
+            assert session_state["conversation_id"] == "mine"
+            assert switch_conversation(session_state, query_params, "mine") == [
+                message("My bank opens at nine")
+            ]
+            assert query_params == {CONVERSATION_PARAM: "mine"}
+
+        assert not app.exception
+        journal.close()
+
+    def test_anonymous_sessions_are_not_journaled(self, directory):
+        """Test that anonymous users, who may share an address, get no journal."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        journal.append("theirs", message("Another visitor's plans"), OWNER)
+        session_state = {"user_id": None, "session_id": "s", "conversation_id": "c"}
+        query_params = {CONVERSATION_PARAM: "theirs"}
+        sidebar = Mock()
+        with patch.object(journal_module, "_journal", journal), \
+                patch("src.journal.get_shared_store", return_value=None):
+            persist_message(session_state, message("My plans"))
+            assert saved_messages(session_state, query_params) == []
+            assert switch_conversation(session_state, query_params, "theirs") is None
+            render_search(sidebar, session_state, query_params, Mock(), "Search")
+
+        hits = journal.search("plans", limit=100)
+        assert [hit.conversation for hit in hits] == ["theirs"]
+        assert session_state["conversation_id"] == "c"
+        sidebar.text_input.assert_not_called()
+        journal.close()
+
+    def test_messages_are_journaled(self, directory):
+        """Test that chat messages are appended to the journal."""
+        journal = ConversationJournal(directory, sync_interval=None)
+        with patch.object(journal_module, "_journal", journal), \
+                patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}):
+            app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"))
+            app.run()
+            app.button(key="sample_Tell me a joke").click().run()
+
+        assert not app.exception
+        conversation = app.session_state.conversation_id
+        assert journal.load_messages(conversation, owner=OWNER) == [
+            message("Tell me a joke")
+        ]
+        journal.close()
@@ -0,0 +1,120 @@
+"""
+Tests for the load test harness and mock completion server.
+"""
+
+import os
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+from openai import OpenAI
+from benchmarks.load_test import (
+    mock_server_process,
+    percentile,
+    run_level,
+    shared_runtime,
+    turn_failed,
+)
+from benchmarks.mock_server import MockCompletionServer, server_process
+
+
+class TestMockServer:
+    """Test cases for the mock completion server."""
+
+    def test_completion(self):
+        """Test a plain completion through the real client."""
+        with MockCompletionServer(answer="one two three") as server:
+            client = OpenAI(api_key="sk-test", base_url=server.base_url)
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": "Hi"}],
+            )
+        assert response.choices[0].message.content == "one two three"
+        assert response.choices[0].finish_reason == "stop"
+        assert response.usage.completion_tokens == 3
+        assert server.requests == 1
+
+    def test_truncated_completion(self):
+        """Test that max_tokens cuts the answer with finish_reason length."""
+        with MockCompletionServer(answer="one two three") as server:
+            client = OpenAI(api_key="sk-test", base_url=server.base_url)
+            response = client.chat.completions.create(
+                model="m", messages=[], max_tokens=2
+            )
+        assert response.choices[0].message.content == "one two"
+        assert response.choices[0].finish_reason == "length"
+
+    def test_streamed_completion(self):
+        """Test a streamed completion with usage."""
+        with MockCompletionServer(answer="one two three") as server:
+            client = OpenAI(api_key="sk-test", base_url=server.base_url)
+            stream = client.chat.completions.create(
+                model="m", messages=[], stream=True,
+                stream_options={"include_usage": True},
+            )
+            chunks = list(stream)
+        text = "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+        assert text == "one two three"
+        assert chunks[-1].usage.completion_tokens == 3
+
+
+    @pytest.mark.slow
+    def test_server_process(self):
+        """Test the server started in its own process for benchmarks."""
+        with server_process("--answer-words", "3") as base_url:
+            client = OpenAI(api_key="sk-test", base_url=base_url)
+            response = client.chat.completions.create(model="m", messages=[])
+        assert response.choices[0].message.content == "word0 word1 word2"
+
+
+class TestLoadTest:
+    """Test cases for the load test harness."""
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile([], 95) == 0.0
+
+    def test_turn_failed(self):
+        """Test that error and quota replies count as failed turns."""
+        def session(content, exception=()):
+            messages = [{"role": "user", "content": "Hi"}]
+            if content is not None:
+                messages.append({"role": "assistant", "content": content})
+            return SimpleNamespace(
+                exception=list(exception), session_state={"messages": messages}
+            )
+
+        assert not turn_failed(session("Hello!"))
+        assert turn_failed(session("I'm sorry, I encountered an error: 500"))
+        assert turn_failed(session("Sorry, I encountered an error: timeout"))
+        assert turn_failed(session("⏳ You have reached the requests limit"))
+        assert turn_failed(session(None))
+        assert turn_failed(session("Hello!", exception=["boom"]))
+        assert turn_failed(SimpleNamespace(exception=[], session_state={}))
+
+    @pytest.mark.slow
+    def test_run_level_against_mock_server(self):
+        """Test concurrent sessions of the chat app end to end."""
+        root = os.path.dirname(os.path.dirname(__file__))
+        app_path = os.path.join(root, "chatgpt_clone.py")
+        with MockCompletionServer(answer="Mock answer") as server, shared_runtime():
+            env = {"OPENAI_API_KEY": "sk-test", "OPENAI_BASE_URL": server.base_url}
+            with patch.dict(os.environ, env):
+                result = run_level(app_path, sessions=2, turns=2, timeout=60)
+
+        assert result.errors == 0
+        # One initial run plus two turns per session
+        assert len(result.latencies) == 6
+        assert server.requests == 4
+        # Script threads run inside the process, so their CPU is a part of it
+        assert 0 < result.script_cpu_per_session <= result.cpu_per_session
+
+    @pytest.mark.slow
+    def test_mock_server_process(self):
+        """Test serving completions from a separate process."""
+        with mock_server_process(latency=0.0) as base_url:
+            client = OpenAI(api_key="sk-test", base_url=base_url)
+            response = client.chat.completions.create(model="m", messages=[])
+        assert response.choices[0].message.content
@@ -0,0 +1,201 @@
+"""
+Tests for map-reduce answering over long documents.
+"""
+
+import io
+import os
+import threading
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from streamlit.testing.v1 import AppTest
+from benchmarks.load_test import chat_input_files
+from src import http_replay, long_input
+from src.long_input import (
+    DEFAULT_QUESTION,
+    estimate_chunk_count,
+    is_long_input,
+    iter_document_chunks,
+    map_reduce,
+    split_chunks,
+    split_question,
+)
+from src.token_budget import TokenRateLimiter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, "tests", "fixtures", "hello.jsonl")
+DOCUMENT = "".join(
+    f"Paragraph {i}: déjà vu, naïve café. " * 20 + "\n\n" for i in range(60)
+)
+
+
+def completion(content):
+    """Build a finished chat completion."""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content),
+                                 finish_reason="stop")],
+        usage=SimpleNamespace(completion_tokens=10, prompt_tokens=100),
+    )
+
+
+def fake_client(delay=0.0, note=None, reduced_chars=1000):
+    """Client answering map requests with their part number (or ``note``)."""
+    client = Mock()
+
+    def create(messages, **kwargs):
+        time.sleep(delay)
+        user = messages[-1]["content"]
+        if "Document part" in user:
+            number = user.split("Document part ")[1].split(":")[0]
+            return completion(note or f"note {number}")
+        return completion(("combined: " + user.split("Notes:\n")[1])[:reduced_chars])
+    client.chat.completions.create.side_effect = create
+    return client
+
+
+class TestChunking:
+    """Test cases for splitting documents."""
+
+    def test_split_chunks_keeps_text_and_words(self):
+        """Test that chunks cover the text and end between words."""
+        chunks = list(split_chunks([DOCUMENT[:5000], DOCUMENT[5000:]], 200))
+        assert "".join(chunks) == DOCUMENT
+        assert all(len(chunk) <= 800 for chunk in chunks)
+        assert all(chunk.endswith((" ", "\n")) for chunk in chunks[:-1])
+
+    def test_streamed_bytes_decode_across_blocks(self):
+        """Test that multi-byte characters split between blocks survive."""
+        with patch.object(long_input, "READ_BLOCK_BYTES", 7):
+            chunks = list(iter_document_chunks(io.BytesIO(DOCUMENT.encode()), 300))
+        assert "".join(chunks) == DOCUMENT
+
+    def test_plain_reader(self):
+        """Test a file-like object without a buffer or file descriptor."""
+        reader = io.BufferedReader(io.BytesIO(DOCUMENT.encode()))
+        assert "".join(iter_document_chunks(reader, 300)) == DOCUMENT
+
+    def test_memory_mapped_file(self, tmp_path):
+        """Test that large files are read through mmap."""
+        path = tmp_path / "doc.txt"
+        path.write_bytes(DOCUMENT.encode())
+        with patch.object(long_input, "MMAP_MIN_BYTES", 1), \
+                patch("src.long_input.mmap.mmap", wraps=long_input.mmap.mmap) as mapped:
+            chunks = list(iter_document_chunks(path, 300))
+        assert mapped.called
+        assert "".join(chunks) == DOCUMENT
+
+    def test_estimate_chunk_count(self):
+        """Test the progress estimate."""
+        text = "word " * 10000
+        actual = len(list(iter_document_chunks(text, 300)))
+        assert abs(estimate_chunk_count(text, 300) - actual) <= 1
+        assert estimate_chunk_count(io.BytesIO(b"")) == 1
+
+
+class TestLongInputDetection:
+    """Test cases for deciding on map-reduce."""
+
+    def test_is_long_input(self):
+        """Test the token threshold and its environment override."""
+        assert not is_long_input("short question")
+        assert is_long_input(DOCUMENT)
+        with patch.dict(os.environ, {"LONG_INPUT_TOKENS": "2"}):
+            assert is_long_input("a longer question")
+
+    def test_split_question(self):
+        """Test that a short leading question is separated."""
+        assert split_question("What is the plot?\n" + DOCUMENT) == (
+            "What is the plot?", DOCUMENT
+        )
+        assert split_question(DOCUMENT) == (DEFAULT_QUESTION, DOCUMENT)
+
+
+class TestMapReduce:
+    """Test cases for map_reduce."""
+
+    def test_maps_concurrently_and_reduces_in_order(self):
+        """Test that wall-clock time scales with concurrency."""
+        progress = []
+        chunks = [f"chunk {i}" for i in range(16)]
+
+        started = time.perf_counter()
+        result = map_reduce(
+            fake_client(delay=0.05), iter(chunks), "Q?", max_workers=8,
+            on_progress=lambda done, total: progress.append(
+                (done, total, threading.current_thread())
+            ),
+            total_hint=16, limiter=None,
+        )
+        elapsed = time.perf_counter() - started
+
+        # 17 sequential requests would take 0.85 seconds
+        assert elapsed < 0.5
+        assert result.chunks == 16 and result.reduce_rounds == 1
+        notes = [f"[Part {i}]\nnote {i}" for i in range(1, 17)]
+        assert result.content.startswith("combined: " + notes[0])
+        assert all(note in result.content for note in notes)
+        assert progress[-1][:2] == (17, 17)
+        # Progress is reported on the caller's thread
+        assert {entry[2] for entry in progress} == {threading.current_thread()}
+
+    def test_reduces_hierarchically(self):
+        """Test that notes too long for one prompt are reduced in rounds."""
+        client = fake_client(note="x " * 3000)
+        result = map_reduce(client, ["a", "b", "c"], "Q?", limiter=None)
+        assert result.reduce_rounds == 2
+        # Three map requests, three partial reductions, one final one
+        assert client.chat.completions.create.call_count == 7
+
+    def test_reduction_that_does_not_shrink_stops(self):
+        """Test that reduction ends even if the answers do not get shorter."""
+        client = fake_client(note="x " * 3000, reduced_chars=10**6)
+        result = map_reduce(client, ["a", "b", "c"], "Q?", limiter=None)
+        assert result.reduce_rounds == 2
+
+    def test_uses_rate_limiter(self):
+        """Test that every request reserves and releases budget."""
+        limiter = TokenRateLimiter(1_000_000)
+        map_reduce(fake_client(), ["a", "b"], "Q?", limiter=limiter)
+        assert limiter.in_flight == 0
+        assert limiter.available < 1_000_000
+
+    def test_workers_read_from_environment_per_call(self):
+        """Test that LONG_INPUT_WORKERS is read when the executor is built."""
+        with patch.dict(os.environ, {"LONG_INPUT_WORKERS": "3"}), \
+                patch.object(long_input, "ThreadPoolExecutor",
+                             wraps=long_input.ThreadPoolExecutor) as executor:
+            map_reduce(fake_client(), ["a", "b"], "Q?", limiter=None)
+        executor.assert_called_once_with(max_workers=3)
+
+    def test_empty_document(self):
+        """Test that an empty document is rejected."""
+        with pytest.raises(ValueError, match="empty"):
+            map_reduce(fake_client(), iter([]), "Q?", limiter=None)
+
+
+class TestChatIntegration:
+    """Test cases for long input in the chat app."""
+
+    @patch.dict(
+        os.environ,
+        {
+            "OPENAI_API_KEY": "sk-test",
+            "OPENAI_REPLAY_FIXTURE": FIXTURE,
+            "OPENAI_REPLAY_TIME_SCALE": "0",
+            "OPENAI_REPLAY_MATCH": "path",
+        },
+    )
+    @patch.object(http_replay, "_env_transport", None)
+    def test_long_paste_is_answered_from_chunks(self):
+        """Test that a long paste is answered without storing the document."""
+        with chat_input_files():
+            app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"))
+            app.run()
+            app.chat_input[0].set_value("Summarize this:\n" + DOCUMENT * 3).run()
+
+        assert not app.exception
+        user, assistant = app.session_state.messages
+        assert user["content"].startswith("Summarize this:\n\n📄 pasted text")
+        assert len(user["content"]) < 200
+        assert assistant["content"].startswith("This is a mock response")
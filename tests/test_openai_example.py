@@ -2,10 +2,26 @@
 Tests for OpenAI integration example.
 """
 
+import asyncio
 import os
+import time
 import pytest
-from unittest.mock import patch, Mock
-from src.openai_example import get_openai_client, simple_chat_completion
+from unittest.mock import AsyncMock, patch, Mock
+from src import http_replay, quotas
+from src.async_bridge import BackgroundLoop, iterate_async, run_async
+from src.openai_example import (
+    async_chat_completion,
+    async_get_client,
+    async_stream_chat_completion,
+    batch_chat_completion,
+    get_openai_client,
+    shared_async_client,
+    simple_chat_completion,
+)
+from src.quotas import QuotaExceeded, QuotaLimits, QuotaManager
+from src.scheduler import BULK, RequestScheduler
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "hello.jsonl")
 
 
 class TestOpenAIIntegration:
@@ -54,4 +70,144 @@ class TestOpenAIIntegration:
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": "Hello! How are you?"}],
             max_tokens=150
-        )
\ No newline at end of file
+        )
+
+    @patch.dict(
+        os.environ,
+        {"OPENAI_REPLAY_FIXTURE": FIXTURE, "OPENAI_REPLAY_TIME_SCALE": "0"},
+        clear=True,
+    )
+    @patch.object(http_replay, "_env_transport", None)
+    def test_simple_chat_completion_replayed(self):
+        """Test the full request path against a recorded exchange."""
+        result = simple_chat_completion("Hello! How are you?")
+
+        assert result.startswith("This is a mock response")
+
+    @patch('src.openai_example.get_openai_client')
+    def test_batch_chat_completion_runs_as_bulk(self, mock_get_client):
+        """Test that batch requests are scheduled in the bulk class."""
+        def create(messages, **kwargs):
+            response = Mock()
+            response.choices = [Mock()]
+            response.choices[0].message.content = messages[0]["content"].upper()
+            response.usage.total_tokens = 12
+            return response
+        mock_get_client.return_value.chat.completions.create.side_effect = create
+        scheduler = RequestScheduler(4, bulk_slots=2)
+        
+        with patch("src.scheduler._scheduler", scheduler):
+            result = batch_chat_completion(["a", "b", "c"], max_workers=3)
+        
+        assert result == ["A", "B", "C"]
+        assert scheduler.metrics()[BULK].dispatched == 3
+        assert scheduler.metrics()[BULK].running == 0
+
+
+REPLAY_ENV = {"OPENAI_REPLAY_FIXTURE": FIXTURE, "OPENAI_REPLAY_TIME_SCALE": "0"}
+
+
+class TestAsyncAPI:
+    """Test cases for the asyncio client path."""
+    
+    @patch.dict(os.environ, {}, clear=True)
+    def test_async_get_client_missing_api_key(self):
+        """Test that the async client needs a key like the sync one."""
+        with pytest.raises(ValueError, match="OPENAI_API_KEY not found"):
+            async_get_client()
+    
+    @patch.dict(os.environ, REPLAY_ENV, clear=True)
+    @patch.object(http_replay, "_env_transport", None)
+    def test_async_chat_completion_replayed(self):
+        """Test a completion on the background loop through the real client."""
+        result = run_async(async_chat_completion("Hello! How are you?"))
+        
+        assert result.startswith("This is a mock response")
+    
+    @patch.dict(os.environ, REPLAY_ENV, clear=True)
+    @patch.object(http_replay, "_env_transport", None)
+    def test_async_stream_replayed(self):
+        """Test streaming deltas into synchronous code."""
+        stream = async_stream_chat_completion("Hello! How are you?")
+        deltas = list(iterate_async(stream))
+        
+        assert len(deltas) > 1
+        assert "".join(deltas).startswith("This is a mock response")
+    
+    def test_async_requests_use_the_scheduler(self):
+        """Test that async requests reserve and release scheduler slots."""
+        response = Mock()
+        response.choices = [Mock()]
+        response.choices[0].message.content = "Async answer"
+        response.usage.total_tokens = 30
+        client = Mock()
+        client.chat.completions.create = AsyncMock(return_value=response)
+        scheduler = RequestScheduler(2)
+        
+        async def fan_out():
+            return await asyncio.gather(*(
+                async_chat_completion(f"Q{i}", client, BULK, "job") for i in range(5)
+            ))
+        
+        with patch("src.scheduler._scheduler", scheduler):
+            results = run_async(fan_out())
+        
+        assert results == ["Async answer"] * 5
+        assert scheduler.metrics()[BULK].dispatched == 5
+        assert scheduler.metrics()[BULK].running == 0
+    
+    def test_async_requests_use_quotas(self):
+        """Test that async requests count against the session's quota."""
+        response = Mock()
+        response.choices = [Mock()]
+        response.choices[0].message.content = "Async answer"
+        response.usage.total_tokens = 30
+        client = Mock()
+        client.chat.completions.create = AsyncMock(return_value=response)
+        manager = QuotaManager(QuotaLimits(requests=1))
+        
+        with patch.object(quotas, "_configured", True), \
+                patch.object(quotas, "_manager", manager), \
+                patch("src.scheduler._scheduler", None):
+            assert run_async(async_chat_completion("Q", client, session="s")) == (
+                "Async answer"
+            )
+            with pytest.raises(QuotaExceeded):
+                run_async(async_chat_completion("Q", client, session="s"))
+        
+        assert client.chat.completions.create.await_count == 1
+        assert manager.usage("s")["session"] == (1, 30)
+    
+    def test_cancelled_wait_returns_reservation(self):
+        """Test that a request cancelled while queued frees its slot."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, BULK)
+        client = Mock()
+        
+        with patch("src.scheduler._scheduler", scheduler):
+            with pytest.raises(TimeoutError):
+                run_async(async_chat_completion("Q", client, BULK), timeout=0.1)
+            # The abandoned request leaves the queue once its task is cancelled
+            deadline = time.monotonic() + 1
+            while scheduler.metrics()[BULK].queued and time.monotonic() < deadline:
+                time.sleep(0.005)
+            assert scheduler.metrics()[BULK].queued == 0
+            scheduler.release(blocker)
+            assert scheduler.acquire(1, BULK, timeout=1).priority == BULK
+        client.chat.completions.create.assert_not_called()
+    
+    @patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}, clear=True)
+    @patch.object(http_replay, "_env_transport", None)
+    def test_one_client_per_loop_closed_on_shutdown(self):
+        """Test that requests on a loop share a client that the loop closes."""
+        background = BackgroundLoop(name="client-loop")
+        
+        async def client():
+            return shared_async_client()
+        
+        first = background.run(client())
+        assert background.run(client()) is first
+        assert run_async(client()) is not first
+        assert not first.is_closed()
+        background.close()
+        assert first.is_closed()
@@ -0,0 +1,182 @@
+"""
+Tests for the cache-friendly history layout and cache hit reporting.
+"""
+
+import pytest
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+import chatgpt_clone
+from src.prompt_cache import (
+    CacheUsage,
+    PromptCacheStats,
+    block_window,
+    cached_prompt_tokens,
+)
+from src.streaming import CancellableStream
+from src.token_budget import create_with_continuation
+
+
+def make_usage(prompt_tokens, cached_tokens, completion_tokens=5):
+    """Build a usage object as the API reports it."""
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+def make_history(count):
+    """Build alternating user and assistant messages."""
+    roles = ("user", "assistant")
+    return [{"role": roles[i % 2], "content": f"Message {i}"} for i in range(count)]
+
+
+def common_prefix(first, second):
+    """Number of leading messages two prompts share."""
+    shared = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        shared += 1
+    return shared
+
+
+class TestBlockWindow:
+    """Test cases for block_window."""
+
+    def test_short_history_is_sent_whole(self):
+        """Test that histories within the minimum window are not cut."""
+        history = make_history(7)
+        assert block_window(history, 10, 10) == history
+
+    def test_start_moves_in_blocks(self):
+        """Test the window size and start as the history grows."""
+        starts = []
+        for count in range(10, 45):
+            window = block_window(make_history(count), 10, 10)
+            assert 10 <= len(window) <= 19
+            starts.append(count - len(window))
+        assert sorted(set(starts)) == [0, 10, 20, 30]
+
+    def test_prompts_extend_each_other(self):
+        """Test that most turns reuse the whole previous prompt."""
+        history = make_history(2)
+        previous = None
+        reused = turns = 0
+        for _ in range(40):
+            messages = chatgpt_clone.build_chat_messages(history, "Next question")
+            if previous is not None:
+                turns += 1
+                reused += common_prefix(previous, messages) == len(previous) - 1
+            previous = messages
+            history = history + make_history(2)
+        # Only every fifth turn (ten messages, two per turn) starts anew
+        assert reused == turns - turns // 5
+
+    def test_invalid_block(self):
+        """Test argument validation."""
+        with pytest.raises(ValueError):
+            block_window([], 0, 10)
+
+
+class TestPromptCacheStats:
+    """Test cases for PromptCacheStats."""
+
+    def test_hit_ratio_per_session(self):
+        """Test that each session has its own totals."""
+        stats = PromptCacheStats()
+        stats.record("a", 2000, 0)
+        stats.record("a", 2100, 1920)
+        stats.record("b", 1500, 1024)
+        assert stats.usage("a") == CacheUsage(2, 4100, 1920)
+        assert stats.usage("a").hit_ratio == pytest.approx(1920 / 4100)
+        assert stats.usage("b").hit_ratio == pytest.approx(1024 / 1500)
+        assert stats.usage("c").hit_ratio == 0.0
+
+    def test_requests_without_usage_are_skipped(self):
+        """Test that missing sessions or usage are not counted."""
+        stats = PromptCacheStats()
+        stats.record(None, 2000, 1000)
+        stats.record("a", 0, 0)
+        assert stats.snapshot() == {}
+
+    def test_keeps_recent_sessions(self):
+        """Test that the least recently updated sessions are dropped."""
+        stats = PromptCacheStats(max_sessions=2)
+        stats.record("a", 100, 0)
+        stats.record("b", 100, 0)
+        stats.record("a", 100, 50)
+        stats.record("c", 100, 0)
+        assert set(stats.snapshot()) == {"a", "c"}
+
+    def test_cached_prompt_tokens(self):
+        """Test reading cached tokens from usage objects."""
+        assert cached_prompt_tokens(make_usage(2000, 1024)) == 1024
+        assert cached_prompt_tokens(SimpleNamespace(prompt_tokens=10)) == 0
+        assert cached_prompt_tokens(None) == 0
+        assert cached_prompt_tokens(Mock()) == 0
+
+
+class TestCachedTokenCounts:
+    """Test cases for collecting cached tokens from responses."""
+
+    def test_completion_sums_continuations(self):
+        """Test cached tokens over a continued completion."""
+        def response(finish_reason, usage):
+            choice = SimpleNamespace(
+                message=SimpleNamespace(content="text"), finish_reason=finish_reason
+            )
+            return SimpleNamespace(choices=[choice], usage=usage)
+
+        client = Mock()
+        client.chat.completions.create.side_effect = [
+            response("length", make_usage(1500, 0)),
+            response("stop", make_usage(1520, 1408)),
+        ]
+        result = create_with_continuation(
+            client, [{"role": "user", "content": "x"}], 5, ceiling=20
+        )
+        assert (result.prompt_tokens, result.cached_tokens) == (3020, 1408)
+
+    def test_stream_reads_final_usage(self):
+        """Test cached tokens from a stream's usage chunk."""
+        delta = SimpleNamespace(
+            delta=SimpleNamespace(content="Hi"), finish_reason="stop"
+        )
+        response = Mock()
+        response.__iter__ = Mock(return_value=iter([
+            SimpleNamespace(choices=[delta], usage=None),
+            SimpleNamespace(choices=[], usage=make_usage(1800, 1536)),
+        ]))
+        client = Mock()
+        client.chat.completions.create.return_value = response
+        stream = CancellableStream(client, [{"role": "user", "content": "x"}], 50)
+        assert list(stream) == ["Hi"]
+        assert (stream.prompt_tokens, stream.cached_tokens) == (1800, 1536)
+
+
+class TestChatReporting:
+    """Test cases for per-session reporting in the chat app."""
+
+    @patch("chatgpt_clone.get_openai_client")
+    def test_response_is_recorded_for_session(self, mock_get_client):
+        """Test that a chat response adds to its session's totals."""
+        choice = SimpleNamespace(
+            message=SimpleNamespace(content="Answer"), finish_reason="stop"
+        )
+        client = Mock()
+        client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[choice], usage=make_usage(2048, 1792)
+        )
+        mock_get_client.return_value = client
+        stats = PromptCacheStats()
+        session_state = Mock()
+        session_state.messages = make_history(4)
+        session_state.get.return_value = "session-1"
+
+        with patch("chatgpt_clone.st") as mock_st, \
+                patch("chatgpt_clone.get_prompt_cache_stats", return_value=stats):
+            mock_st.session_state = session_state
+            assert chatgpt_clone.get_chat_response("Question") == "Answer"
+
+        assert stats.usage("session-1") == CacheUsage(1, 2048, 1792)
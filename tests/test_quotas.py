@@ -0,0 +1,242 @@
+"""
+Tests for per-session and per-user quotas.
+"""
+
+import asyncio
+import os
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from src import quotas
+from src.quotas import (
+    QuotaExceeded,
+    QuotaLimiter,
+    QuotaLimits,
+    QuotaManager,
+    SlidingWindow,
+    get_user_id,
+    quota_limiter,
+)
+from src.token_budget import TokenRateLimiter
+
+
+class FakeClock:
+    """Manually advanced clock whose sleep advances it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_manager(session=QuotaLimits(), user=QuotaLimits(), max_wait=0.0):
+    """Build a manager with a 60 second window on a fake clock."""
+    clock = FakeClock()
+    manager = QuotaManager(
+        session, user, window=60, max_wait=max_wait, clock=clock, sleep=clock.sleep
+    )
+    return manager, clock
+
+
+class TestSlidingWindow:
+    """Test cases for the two-bucket counter."""
+
+    def test_previous_bucket_slides_out(self):
+        """Test that the previous bucket counts by its overlap."""
+        window = SlidingWindow(0.0)
+        window.current = [10.0, 1000.0]
+        window.roll(60.0, 60)
+        assert window.count(0, 60.0, 60) == 10
+        assert window.count(1, 75.0, 60) == 750
+        window.roll(150.0, 60)
+        assert window.count(1, 150.0, 60) == 0
+
+    def test_retry_after(self):
+        """Test the wait until a request fits."""
+        window = SlidingWindow(0.0)
+        window.current = [0.0, 1000.0]
+        window.roll(60.0, 60)
+        # 1000 at full weight; 500 more fits once half has slid out
+        assert window.retry_after(1, 1000, 500, 60.0, 60) == pytest.approx(30)
+        # Over the limit in the current bucket: wait for the next one too
+        window.current = [0.0, 800.0]
+        assert window.retry_after(1, 1000, 500, 60.0, 60) == pytest.approx(60 + 22.5)
+        assert window.retry_after(0, 5, 1, 60.0, 60) == 0
+
+
+class TestQuotaManager:
+    """Test cases for QuotaManager."""
+
+    def test_request_quota_per_session(self):
+        """Test that one session's requests do not use another's quota."""
+        manager, _ = make_manager(QuotaLimits(requests=2))
+        assert manager.try_admit("a", 10) is None
+        assert manager.try_admit("a", 10) is None
+        refusal = manager.try_admit("a", 10)
+        assert isinstance(refusal, QuotaExceeded)
+        assert (refusal.scope, refusal.resource) == ("session", "requests")
+        # Next window, once half of this one's two requests slid out
+        assert refusal.retry_after == pytest.approx(90)
+        assert manager.try_admit("b", 10) is None
+
+    def test_rejection_carries_retry_hint(self):
+        """Test that a rejected request says when to try again."""
+        manager, clock = make_manager(QuotaLimits(tokens=1000))
+        manager.admit("a", 1000)
+        clock.now += 30
+        with pytest.raises(QuotaExceeded, match="try again in 60 seconds") as error:
+            manager.admit("a", 500)
+        assert error.value.retry_after == pytest.approx(60)
+
+    def test_waits_when_quota_frees_up_soon(self):
+        """Test that short waits are queued instead of rejected."""
+        manager, clock = make_manager(QuotaLimits(requests=1), max_wait=150)
+        manager.admit("a", 10)
+        manager.admit("a", 10)
+        assert clock.slept == [pytest.approx(120)]
+
+    def test_user_quota_spans_sessions(self):
+        """Test that a user cannot dodge the quota with new sessions."""
+        manager, _ = make_manager(
+            QuotaLimits(requests=10), QuotaLimits(tokens=1500)
+        )
+        manager.admit("tab-1", 1000, user="ip:1.2.3.4")
+        with pytest.raises(QuotaExceeded) as error:
+            manager.admit("tab-2", 1000, user="ip:1.2.3.4")
+        assert error.value.scope == "user"
+        # A refused request is not counted against the session either
+        assert manager.usage("tab-2", "ip:1.2.3.4")["session"] == (0, 0)
+        manager.admit("tab-3", 1000, user="ip:5.6.7.8")
+
+    def test_settle_counts_actual_tokens(self):
+        """Test that unused reserved tokens are returned."""
+        manager, _ = make_manager(QuotaLimits(tokens=1000))
+        manager.admit("a", 900)
+        manager.settle("a", 900, 200)
+        assert manager.usage("a")["session"] == (1, 200)
+        manager.admit("a", 800)
+        manager.cancel("a", 800)
+        assert manager.usage("a")["session"] == (1, 200)
+
+    def test_oversized_request_fits_an_empty_window(self):
+        """Test that a request larger than the quota is not refused forever."""
+        manager, _ = make_manager(QuotaLimits(tokens=500))
+        manager.admit("a", 2000)
+        with pytest.raises(QuotaExceeded):
+            manager.admit("a", 1)
+
+    def test_idle_counters_are_dropped(self):
+        """Test that counters of idle sessions do not accumulate."""
+        manager, clock = make_manager(QuotaLimits(requests=5))
+        for number in range(1000):
+            manager.admit(f"session-{number}", 10)
+        assert len(manager) == 1000
+        clock.now += 121
+        manager.admit("active", 10)
+        assert len(manager) == 1
+
+    def test_invalid_window(self):
+        """Test argument validation."""
+        with pytest.raises(ValueError):
+            QuotaManager(QuotaLimits(requests=1), window=0)
+
+
+class TestQuotaLimiter:
+    """Test cases for the limiter interface."""
+
+    def test_wraps_inner_limiter(self):
+        """Test that admitted requests reach the inner limiter."""
+        manager, _ = make_manager(QuotaLimits(tokens=1000))
+        inner = TokenRateLimiter(10_000)
+        limiter = QuotaLimiter(manager, "a", inner=inner)
+
+        reservation = limiter.acquire(600)
+        assert inner.in_flight == 1
+        limiter.release(reservation, used_tokens=100)
+        limiter.release(reservation, used_tokens=100)
+        assert inner.in_flight == 0
+        assert manager.usage("a")["session"] == (1, 100)
+
+    def test_rejected_requests_skip_inner_limiter(self):
+        """Test that over-quota requests never take scheduler slots."""
+        manager, _ = make_manager(QuotaLimits(requests=1))
+        inner = Mock()
+        limiter = QuotaLimiter(manager, "a", inner=inner)
+        limiter.acquire(10)
+        with pytest.raises(QuotaExceeded):
+            limiter.acquire(10)
+        assert inner.acquire.call_count == 1
+
+    def test_inner_failure_uncounts_request(self):
+        """Test that a request the inner limiter refused does not count."""
+        manager, _ = make_manager(QuotaLimits(requests=1))
+        inner = Mock()
+        inner.acquire.side_effect = TimeoutError
+        limiter = QuotaLimiter(manager, "a", inner=inner)
+        with pytest.raises(TimeoutError):
+            limiter.acquire(10)
+        assert manager.usage("a")["session"] == (0, 0)
+
+    def test_acquire_async(self):
+        """Test that async requests are checked against the same quota."""
+        manager, _ = make_manager(QuotaLimits(requests=1))
+        inner = TokenRateLimiter(10_000)
+        limiter = QuotaLimiter(manager, "a", inner=inner)
+
+        reservation = asyncio.run(limiter.acquire_async(600))
+        assert inner.in_flight == 1
+        with pytest.raises(QuotaExceeded):
+            asyncio.run(limiter.acquire_async(600))
+        assert inner.in_flight == 1
+        limiter.release(reservation, used_tokens=100)
+        assert manager.usage("a")["session"] == (1, 100)
+
+    def test_async_inner_failure_uncounts_request(self):
+        """Test that an async request the inner limiter refused does not count."""
+        manager, _ = make_manager(QuotaLimits(requests=1))
+        inner = Mock()
+        inner.acquire_async = AsyncMock(side_effect=TimeoutError)
+        limiter = QuotaLimiter(manager, "a", inner=inner)
+        with pytest.raises(TimeoutError):
+            asyncio.run(limiter.acquire_async(10))
+        assert manager.usage("a")["session"] == (0, 0)
+
+
+class TestConfiguration:
+    """Test cases for environment configuration and user ids."""
+
+    def test_disabled_without_quotas(self):
+        """Test that the inner limiter is used unchanged by default."""
+        inner = object()
+        with patch.object(quotas, "_configured", False), \
+                patch.object(quotas, "_manager", None), \
+                patch.dict(os.environ, {}, clear=True):
+            assert quota_limiter(inner, "a") is inner
+
+    def test_enabled_from_environment(self):
+        """Test reading limits from the environment."""
+        env = {
+            "SESSION_TOKEN_QUOTA": "20000",
+            "USER_REQUEST_QUOTA": "30",
+            "QUOTA_WINDOW_SECONDS": "120",
+            "QUOTA_MAX_WAIT": "2",
+        }
+        with patch.object(quotas, "_configured", False), \
+                patch.object(quotas, "_manager", None), \
+                patch.dict(os.environ, env, clear=True):
+            limiter = quota_limiter(None, "a", "user:x@example.com")
+            assert limiter.manager.limits["session"] == QuotaLimits(None, 20000)
+            assert limiter.manager.limits["user"] == QuotaLimits(30, None)
+            assert (limiter.manager.window, limiter.manager.max_wait) == (120, 2)
+            assert quota_limiter(None, None) is None
+
+    def test_get_user_id(self):
+        """Test that only signed-in users get a user quota."""
+        assert get_user_id({"email": "x@example.com"}) == "user:x@example.com"
+        # Everyone behind one proxy shares its address; sessions stay apart
+        assert get_user_id({}) is None
@@ -0,0 +1,71 @@
+"""
+Tests for the rendered-markdown cache.
+"""
+
+from unittest.mock import Mock
+from src.render_cache import RenderCache, content_hash, finalize_message, get_render_cache
+
+
+class TestFinalizeMessage:
+    """Test cases for message ids and hashes."""
+
+    def test_adds_id_and_hash_once(self):
+        """Test that finalizing is idempotent."""
+        message = finalize_message({"role": "user", "content": "Hi"})
+        first_id = message["id"]
+        assert message["hash"] == content_hash("Hi")
+        assert finalize_message(message)["id"] == first_id
+
+    def test_ids_are_unique(self):
+        """Test that equal contents still get distinct ids."""
+        a = finalize_message({"role": "user", "content": "Hi"})
+        b = finalize_message({"role": "user", "content": "Hi"})
+        assert a["id"] != b["id"]
+        assert a["hash"] == b["hash"]
+
+
+class TestRenderCache:
+    """Test cases for RenderCache."""
+
+    def test_reuses_protos_by_content(self):
+        """Test that identical content is built once."""
+        cache = RenderCache()
+        first = cache.get_proto({"role": "user", "content": "Hello"})
+        second = cache.get_proto({"role": "assistant", "content": "Hello"})
+        assert first is second
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_matches_st_markdown_body(self):
+        """Test that the body is cleaned like st.markdown does."""
+        proto = RenderCache().get_proto({"role": "user", "content": "  \n    code\n  "})
+        assert proto.body == "code"
+
+    def test_is_bounded(self):
+        """Test that the least recently used entries are evicted."""
+        cache = RenderCache(maxsize=2)
+        a = {"role": "user", "content": "a"}
+        cache.get_proto(a)
+        cache.get_proto({"role": "user", "content": "b"})
+        cache.get_proto(a)
+        cache.get_proto({"role": "user", "content": "c"})
+        assert len(cache) == 2
+        cache.get_proto({"role": "user", "content": "b"})
+        assert cache.misses == 4
+
+    def test_render_enqueues_cached_proto(self):
+        """Test that rendering enqueues the proto like st.markdown."""
+        cache = RenderCache()
+        container = Mock()
+        message = {"role": "assistant", "content": "- a\n- b"}
+
+        cache.render(container, message)
+
+        name, proto = container._enqueue.call_args[0]
+        assert name == "markdown"
+        assert proto is cache.get_proto(message)
+        assert proto.body == "- a\n- b"
+        assert container._enqueue.call_args[1]["layout_config"].width == "stretch"
+
+    def test_process_wide_cache(self):
+        """Test that the shared cache is a singleton."""
+        assert get_render_cache() is get_render_cache()
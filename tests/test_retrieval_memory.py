@@ -0,0 +1,161 @@
+"""
+Tests for retrieval-augmented conversation memory.
+"""
+
+import os
+import numpy as np
+import pytest
+from unittest.mock import Mock, patch
+from src.retrieval_memory import (
+    ConversationMemory,
+    HashingEmbedder,
+    OpenAIEmbedder,
+    VectorIndex,
+    create_memory_from_env,
+)
+
+
+def make_history(count):
+    """Build a filler conversation about unrelated topics."""
+    topics = ["weather", "football", "cooking pasta", "train schedules", "gardening"]
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": f"Some chat about {topics[i % len(topics)]} number {i}"}
+        for i in range(count)
+    ]
+
+
+class CountingEmbedder(HashingEmbedder):
+    """Hashing embedder that counts embedded texts."""
+
+    def __init__(self):
+        super().__init__(dim=64)
+        self.embedded = 0
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return super().embed(texts)
+
+
+class TestHashingEmbedder:
+    """Test cases for the offline embedder."""
+
+    def test_unit_length_and_deterministic(self):
+        """Test that vectors are normalized and stable."""
+        embedder = HashingEmbedder(dim=128)
+        first = embedder.embed(["hello world", ""])
+        second = embedder.embed(["hello world"])
+        assert first.shape == (2, 128)
+        assert np.isclose(np.linalg.norm(first[0]), 1.0)
+        assert np.allclose(first[0], second[0])
+        assert not first[1].any()
+
+    def test_similar_texts_score_higher(self):
+        """Test that shared words raise similarity."""
+        a, b, c = HashingEmbedder().embed(
+            ["my dog is called Biscuit", "what is my dog called", "train to Paris"]
+        )
+        assert a @ b > a @ c
+
+
+class TestOpenAIEmbedder:
+    """Test cases for the API embedder."""
+
+    def test_embed_uses_one_request(self):
+        """Test that texts are embedded in a single batched request."""
+        client = Mock()
+        client.embeddings.create.return_value.data = [
+            Mock(embedding=[3.0, 4.0]), Mock(embedding=[0.0, 2.0])
+        ]
+        embedder = OpenAIEmbedder(lambda: client, model="m", dim=2)
+
+        vectors = embedder.embed(["a", "b"])
+
+        client.embeddings.create.assert_called_once_with(model="m", input=["a", "b"])
+        assert np.allclose(vectors, [[0.6, 0.8], [0.0, 1.0]])
+
+
+class TestVectorIndex:
+    """Test cases for the vector index."""
+
+    def test_grows_and_searches(self):
+        """Test that the index grows past its capacity and finds neighbours."""
+        index = VectorIndex(dim=2, capacity=1)
+        index.add(np.array([[1.0, 0.0]], dtype=np.float32))
+        index.add(np.array([[0.0, 1.0], [0.6, 0.8]], dtype=np.float32))
+
+        assert len(index) == 3
+        assert index.search(np.array([0.0, 1.0]), k=2) == [1, 2]
+        assert index.search(np.array([0.0, 1.0]), k=10) == [1, 2, 0]
+        assert index.search(np.array([0.0, 1.0]), k=1, limit=1) == [0]
+        assert index.search(np.array([0.0, 1.0]), k=0) == []
+
+
+class TestConversationMemory:
+    """Test cases for the conversation memory."""
+
+    def test_short_history_is_sent_whole(self):
+        """Test that conversations shorter than the recent window are unchanged."""
+        memory = ConversationMemory(HashingEmbedder(), top_k=2, recent=4)
+        history = make_history(3)
+        assert memory.select(history, "anything") == history
+
+    def test_recalls_old_fact(self):
+        """Test that an early fact is recalled on a long session."""
+        history = [{"role": "user", "content": "My dog's name is Biscuit"}]
+        history += make_history(200)
+        memory = ConversationMemory(HashingEmbedder(), top_k=3, recent=4)
+
+        selected = memory.select(history, "What is my dog's name?")
+
+        assert history[0] in selected
+        assert len(selected) == 7
+        assert selected[-4:] == history[-4:]
+        # Far fewer tokens than resending the whole conversation
+        sent = sum(len(m["content"]) for m in selected)
+        assert sent < sum(len(m["content"]) for m in history) / 20
+
+    def test_each_message_embedded_once(self):
+        """Test that syncing only embeds new messages and reuses the prompt."""
+        embedder = CountingEmbedder()
+        memory = ConversationMemory(embedder, top_k=2, recent=2)
+        history = make_history(10)
+
+        memory.sync(history)
+        assert embedder.embedded == 10
+        history.append({"role": "user", "content": "new prompt"})
+        memory.sync(history)
+        assert embedder.embedded == 11
+
+        # The prompt was just added, so selecting needs no new embedding
+        memory.select(history, "new prompt")
+        assert embedder.embedded == 11
+        assert len(memory) == 11
+
+
+class TestCreateMemoryFromEnv:
+    """Test cases for environment configuration."""
+
+    def test_disabled_by_default(self):
+        """Test that retrieval is off without configuration."""
+        with patch.dict(os.environ, {}, clear=True):
+            assert create_memory_from_env(Mock()) is None
+
+    def test_hashing_embedder(self):
+        """Test the offline embedder selection and tuning."""
+        env = {"CHAT_RETRIEVAL_MEMORY": "hashing", "RETRIEVAL_TOP_K": "6", "RETRIEVAL_RECENT": "2"}
+        with patch.dict(os.environ, env, clear=True):
+            memory = create_memory_from_env(Mock())
+        assert isinstance(memory.embedder, HashingEmbedder)
+        assert (memory.top_k, memory.recent) == (6, 2)
+
+    def test_openai_embedder(self):
+        """Test the API embedder selection."""
+        with patch.dict(os.environ, {"CHAT_RETRIEVAL_MEMORY": "openai"}, clear=True):
+            assert isinstance(create_memory_from_env(Mock()).embedder, OpenAIEmbedder)
+
+    def test_unknown_embedder(self):
+        """Test that a typo is reported."""
+        with patch.dict(os.environ, {"CHAT_RETRIEVAL_MEMORY": "bogus"}, clear=True):
+            with pytest.raises(ValueError, match="bogus"):
+                create_memory_from_env(Mock())
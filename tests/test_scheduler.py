@@ -0,0 +1,310 @@
+"""
+Tests for the priority request scheduler.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import pytest
+from unittest.mock import Mock, patch
+from src import scheduler as scheduler_module
+from src.scheduler import (
+    BULK,
+    INTERACTIVE,
+    PREFETCH,
+    RequestScheduler,
+    ScheduledLimiter,
+    limiter_for,
+)
+from src.token_budget import TokenRateLimiter, budgeted_completion
+
+
+def wait_queued(scheduler, count, timeout=2.0):
+    """Wait until ``count`` requests are queued in total."""
+    deadline = time.monotonic() + timeout
+    while sum(m.queued for m in scheduler.metrics().values()) < count:
+        assert time.monotonic() < deadline, "requests were never queued"
+        time.sleep(0.005)
+
+
+def start_requests(scheduler, requests, order):
+    """Queue (priority, session, tokens) requests, one thread each."""
+    threads = []
+    for priority, session, tokens in requests:
+        def run(priority=priority, session=session, tokens=tokens):
+            grant = scheduler.acquire(tokens, priority, session)
+            order.append((priority, session))
+            scheduler.release(grant, used_tokens=0)
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        # Arrival order matters for ties, so queue one at a time
+        wait_queued(scheduler, len(threads))
+    return threads
+
+
+class TestRequestScheduler:
+    """Test cases for RequestScheduler."""
+
+    def test_free_slots_are_granted_immediately(self):
+        """Test that an idle scheduler does not block."""
+        scheduler = RequestScheduler(2)
+        first = scheduler.acquire(10, BULK)
+        second = scheduler.acquire(10, INTERACTIVE)
+        assert (first.priority, second.priority) == (BULK, INTERACTIVE)
+        assert scheduler.metrics()[BULK].running == 1
+        scheduler.release(first)
+        scheduler.release(first)
+        assert scheduler.metrics()[BULK].running == 0
+
+    def test_higher_classes_overtake_queued_work(self):
+        """Test that queued bulk work waits for later interactive requests."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        order = []
+        threads = start_requests(scheduler, [
+            (BULK, "job", 1), (PREFETCH, "a", 1), (INTERACTIVE, "b", 1),
+        ], order)
+        scheduler.release(blocker)
+        for thread in threads:
+            thread.join(2)
+
+        assert [priority for priority, _ in order] == [INTERACTIVE, PREFETCH, BULK]
+        metrics = scheduler.metrics()
+        assert metrics[BULK].overtaken == 2
+        assert metrics[PREFETCH].overtaken == 1
+        assert metrics[INTERACTIVE].overtaken == 0
+
+    def test_sessions_share_a_class_fairly(self):
+        """Test that a session with a backlog does not starve another."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        order = []
+        backlog = [(INTERACTIVE, "batch", 100)] * 4 + [(INTERACTIVE, "user", 100)] * 2
+        threads = start_requests(scheduler, backlog, order)
+        scheduler.release(blocker)
+        for thread in threads:
+            thread.join(2)
+
+        assert [session for _, session in order] == [
+            "batch", "user", "batch", "user", "batch", "batch"
+        ]
+
+    def test_fair_share_counts_tokens(self):
+        """Test that large requests use up a session's share faster."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        order = []
+        threads = start_requests(scheduler, [
+            (INTERACTIVE, "large", 400), (INTERACTIVE, "large", 400),
+            (INTERACTIVE, "small", 100), (INTERACTIVE, "small", 100),
+            (INTERACTIVE, "small", 100),
+        ], order)
+        scheduler.release(blocker)
+        for thread in threads:
+            thread.join(2)
+
+        assert [session for _, session in order] == [
+            "small", "small", "small", "large", "large"
+        ]
+
+    def test_bulk_keeps_slots_free_for_interactive(self):
+        """Test that bulk work only holds its share of the slots."""
+        scheduler = RequestScheduler(4, bulk_slots=1)
+        bulk = scheduler.acquire(1, BULK)
+        with pytest.raises(TimeoutError):
+            scheduler.acquire(1, BULK, timeout=0.05)
+
+        started = time.perf_counter()
+        interactive = [scheduler.acquire(1, INTERACTIVE) for _ in range(3)]
+        assert time.perf_counter() - started < 0.05
+        assert scheduler.metrics()[BULK].queued == 0
+
+        for grant in interactive + [bulk]:
+            scheduler.release(grant)
+        assert scheduler.acquire(1, BULK, timeout=0.05).priority == BULK
+
+    def test_tokens_follow_priority(self):
+        """Test that refunded tokens go to interactive work first."""
+        limiter = TokenRateLimiter(100, clock=lambda: 0.0)
+        scheduler = RequestScheduler(4, limiter=limiter)
+        first = scheduler.acquire(100, BULK)
+        grants = {}
+
+        def run(priority):
+            grants[priority] = scheduler.acquire(60, priority)
+        threads = []
+        for priority in (BULK, INTERACTIVE):
+            threads.append(threading.Thread(target=run, args=(priority,)))
+            threads[-1].start()
+            wait_queued(scheduler, len(threads))
+
+        # The refund covers only one of the two waiting requests
+        scheduler.release(first, used_tokens=0)
+        threads[1].join(2)
+        assert list(grants) == [INTERACTIVE]
+        assert scheduler.metrics()[BULK].queued == 1
+
+        scheduler.release(grants[INTERACTIVE], used_tokens=0)
+        threads[0].join(2)
+        assert grants[BULK].reservation.tokens == 60
+        scheduler.release(grants[BULK], used_tokens=0)
+        assert limiter.in_flight == 0
+
+    def test_timeout_leaves_the_queue(self):
+        """Test that a timed-out request no longer blocks others."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        with pytest.raises(TimeoutError):
+            scheduler.acquire(1, INTERACTIVE, timeout=0.02)
+        assert scheduler.metrics()[INTERACTIVE].queued == 0
+
+        scheduler.release(blocker)
+        assert scheduler.acquire(1, BULK, timeout=0.05).priority == BULK
+
+    def test_wait_metrics(self):
+        """Test that wait times are reported per class."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        threads = start_requests(scheduler, [(BULK, "job", 1)], [])
+        time.sleep(0.05)
+        assert scheduler.metrics()[BULK].queued == 1
+        scheduler.release(blocker)
+        threads[0].join(2)
+
+        metrics = scheduler.metrics()
+        assert metrics[BULK].dispatched == 1
+        assert metrics[BULK].queued == 0
+        assert metrics[BULK].max_wait >= 0.05
+        assert metrics[INTERACTIVE].dispatched == 1
+        assert metrics[INTERACTIVE].max_wait < 0.05
+
+    def test_invalid_arguments(self):
+        """Test argument validation."""
+        with pytest.raises(ValueError):
+            RequestScheduler(0)
+        with pytest.raises(ValueError):
+            RequestScheduler(1).acquire(1, "urgent")
+
+
+class TestAsyncAcquire:
+    """Test cases for coroutines waiting in the scheduler."""
+
+    def test_queued_coroutines_hold_no_threads(self):
+        """Test that many waiting coroutines don't delay a later interactive one."""
+        scheduler = RequestScheduler(2, bulk_slots=1)
+        order = []
+
+        async def request(priority, name, hold):
+            grant = await scheduler.acquire_async(1, priority, name)
+            order.append(name)
+            await asyncio.sleep(hold)
+            scheduler.release(grant)
+
+        async def scenario():
+            threads = threading.active_count()
+            bulk = [
+                asyncio.ensure_future(request(BULK, f"bulk{i}", 0.01))
+                for i in range(60)
+            ]
+            await asyncio.sleep(0.05)
+            assert threading.active_count() == threads
+            started = time.monotonic()
+            await request(INTERACTIVE, "interactive", 0)
+            waited = time.monotonic() - started
+            await asyncio.gather(*bulk)
+            return waited
+
+        waited = asyncio.run(scenario())
+        assert waited < 0.1
+        assert order.index("interactive") < 10
+        assert scheduler.metrics()[BULK].dispatched == 60
+
+    def test_release_from_another_thread_wakes_coroutine(self):
+        """Test that a thread's release dispatches a waiting coroutine."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+        threading.Timer(0.05, scheduler.release, args=(blocker,)).start()
+
+        grant = asyncio.run(asyncio.wait_for(scheduler.acquire_async(1, BULK), 2))
+
+        assert grant.priority == BULK
+        assert scheduler.metrics()[BULK].running == 1
+
+    def test_timeout_and_cancel_leave_the_queue(self):
+        """Test that abandoned coroutines don't keep or leak a slot."""
+        scheduler = RequestScheduler(1)
+        blocker = scheduler.acquire(1, INTERACTIVE)
+
+        async def scenario():
+            with pytest.raises(TimeoutError):
+                await scheduler.acquire_async(1, BULK, timeout=0.02)
+            waiting = asyncio.ensure_future(scheduler.acquire_async(1, BULK))
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+
+        asyncio.run(scenario())
+        assert scheduler.metrics()[BULK].queued == 0
+        scheduler.release(blocker)
+        assert scheduler.metrics()[BULK].running == 0
+
+    def test_waits_for_tokens_without_a_release(self):
+        """Test that a coroutine short of tokens is dispatched once they refill."""
+        limiter = TokenRateLimiter(6000)
+        scheduler = RequestScheduler(4, limiter=limiter)
+        limiter.try_acquire(6000)
+
+        grant = asyncio.run(asyncio.wait_for(scheduler.acquire_async(50), 2))
+
+        assert grant.reservation is not None
+
+
+class TestScheduledLimiter:
+    """Test cases for the limiter interface."""
+
+    def test_budgeted_completion_goes_through_scheduler(self):
+        """Test that the view plugs into functions taking a limiter."""
+        scheduler = RequestScheduler(2, limiter=TokenRateLimiter(10_000))
+        response = Mock()
+        response.choices = [Mock(finish_reason="stop")]
+        response.choices[0].message.content = "Answer"
+        response.usage.completion_tokens = 5
+        response.usage.prompt_tokens = 20
+        client = Mock()
+        client.chat.completions.create.return_value = response
+
+        limiter = scheduler.for_class(BULK, "job")
+        result = budgeted_completion(
+            client, [{"role": "user", "content": "Hi"}], "test", 100,
+            limiter=limiter,
+        )
+
+        assert result.content == "Answer"
+        assert scheduler.metrics()[BULK].dispatched == 1
+        assert scheduler.metrics()[BULK].running == 0
+        assert scheduler.limiter.available > 10_000 - 30
+
+
+class TestLimiterFor:
+    """Test cases for the environment configuration."""
+
+    def test_disabled_falls_back_to_rate_limiter(self):
+        """Test that without the setting requests are only rate limited."""
+        with patch.object(scheduler_module, "_scheduler", None), \
+                patch.dict(os.environ, {}, clear=True):
+            assert limiter_for(BULK) is None
+
+    def test_enabled_from_environment(self):
+        """Test that the setting enables the shared scheduler."""
+        env = {"OPENAI_MAX_CONCURRENT_REQUESTS": "6", "OPENAI_BULK_SLOTS": "2"}
+        with patch.object(scheduler_module, "_scheduler", None), \
+                patch.dict(os.environ, env, clear=True):
+            limiter = limiter_for(PREFETCH, "session-1")
+            assert isinstance(limiter, ScheduledLimiter)
+            assert (limiter.priority, limiter.session) == (PREFETCH, "session-1")
+            assert limiter.scheduler.max_concurrent == 6
+            assert limiter.scheduler.bulk_slots == 2
+            assert limiter_for().scheduler is limiter.scheduler
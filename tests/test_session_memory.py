@@ -0,0 +1,350 @@
+"""
+Tests for session memory accounting and idle-session offloading.
+"""
+
+import os
+import gc
+import sys
+import threading
+import weakref
+import pytest
+from unittest.mock import Mock, patch
+from streamlit.testing.v1 import AppTest
+from src import session_memory
+from src.render_cache import RenderCache
+from src.retrieval_memory import ConversationMemory, HashingEmbedder
+from src.session_memory import (
+    SessionMemoryTracker,
+    approximate_size,
+    format_bytes,
+    get_memory_tracker,
+    session_run,
+    track_session,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def history(count, size=100):
+    """Build chat messages of roughly ``size`` characters."""
+    return [
+        {"role": "user", "content": f"{i:04d}" + "x" * size} for i in range(count)
+    ]
+
+
+class SessionState(dict):
+    """Session state that can be weakly referenced, like Streamlit's."""
+
+
+def make_tracker(tmp_path=None, timeout=60.0):
+    """Build a tracker on a fake clock, offloading to tmp_path if given."""
+    clock = FakeClock()
+    tracker = SessionMemoryTracker(
+        idle_timeout=timeout,
+        offload_dir=str(tmp_path) if tmp_path is not None else None,
+        clock=clock,
+    )
+    # Sweep explicitly instead of from the background thread
+    tracker._sweeper = threading.current_thread()
+    return tracker, clock
+
+
+class TestApproximateSize:
+    """Test cases for approximate_size."""
+
+    def test_counts_nested_contents(self):
+        """Test that strings inside containers are counted."""
+        messages = history(10, size=1000)
+        assert 10_000 < approximate_size(messages) < 13_000
+
+    def test_shared_objects_count_once(self):
+        """Test that an object referenced twice is counted once."""
+        text = "x" * 10_000
+        assert approximate_size([text, text]) < approximate_size([text, "y" * 10_000])
+
+    def test_arrays_count_their_buffers(self):
+        """Test NumPy arrays inside objects."""
+        memory = ConversationMemory(HashingEmbedder(dim=256))
+        memory.sync(history(50))
+        assert approximate_size(memory) >= memory.index._vectors.nbytes
+
+    def test_skips_functions_and_modules(self):
+        """Test that shared code objects are not counted."""
+        assert approximate_size({"f": approximate_size, "m": sys}) < 1000
+
+
+class TestSessionMemoryTracker:
+    """Test cases for SessionMemoryTracker."""
+
+    def test_measures_only_new_messages(self):
+        """Test that each rerun measures the messages added since the last."""
+        tracker, _ = make_tracker(timeout=None)
+        state = {"messages": history(100)}
+        with patch("src.session_memory.approximate_size",
+                   wraps=approximate_size) as measure:
+            tracker.touch("a", state)
+            assert len(measure.call_args.args[0]) == 100
+            state["messages"].extend(history(2))
+            tracker.touch("a", state)
+            assert len(measure.call_args.args[0]) == 2
+        usage = tracker.session_usage("a")
+        assert usage.messages == 102
+        expected = approximate_size(state["messages"])
+        assert usage.bytes == pytest.approx(expected, rel=0.1)
+
+    def test_new_history_is_measured_again(self):
+        """Test that clearing the chat resets the measurement."""
+        tracker, _ = make_tracker(timeout=None)
+        state = {"messages": history(100, size=1000)}
+        tracker.touch("a", state)
+        state["messages"] = history(1)
+        tracker.touch("a", state)
+        assert tracker.session_usage("a").bytes < 1000
+
+    def test_idle_session_is_offloaded_and_restored(self, tmp_path):
+        """Test moving idle state to disk and back on return."""
+        tracker, clock = make_tracker(tmp_path)
+        idle = {"messages": history(20), "memory": {"vectors": [1, 2]}, "other": 1}
+        active = {"messages": history(5)}
+        tracker.touch("idle", idle)
+        clock.now += 50
+        tracker.touch("active", active)
+        clock.now += 20
+
+        assert tracker.sweep() == 1
+        assert idle == {"other": 1}
+        assert len(os.listdir(tmp_path)) == 1
+        report = tracker.report()
+        assert (report.sessions, report.offloaded_sessions) == (1, 1)
+        assert report.offloaded_bytes > 0
+
+        assert tracker.touch("idle", idle)
+        assert idle["messages"] == history(20)
+        assert idle["memory"] == {"vectors": [1, 2]}
+        assert os.listdir(tmp_path) == []
+        assert tracker.report().offloaded_sessions == 0
+        assert (tracker.evicted, tracker.restored) == (1, 1)
+
+    def test_without_offload_dir_state_is_dropped(self):
+        """Test that idle state is released when it cannot be offloaded."""
+        tracker, clock = make_tracker()
+        state = {"messages": history(20)}
+        tracker.touch("a", state)
+        clock.now += 61
+        assert tracker.sweep() == 1
+        assert state == {}
+        assert tracker.usage() == []
+        assert not tracker.touch("a", state)
+
+    def test_unpicklable_state_stays(self, tmp_path):
+        """Test that state which cannot be pickled is kept in memory."""
+        tracker, clock = make_tracker(tmp_path)
+        state = {"messages": history(2), "memory": threading.Lock()}
+        tracker.touch("a", state)
+        clock.now += 61
+        assert tracker.sweep() == 0
+        assert "messages" in state
+        assert os.listdir(tmp_path) == []
+
+    def test_abandoned_offloads_expire(self, tmp_path):
+        """Test that sessions that never return are deleted from disk."""
+        tracker, clock = make_tracker(tmp_path)
+        tracker.offload_ttl = 3600
+        tracker.touch("a", {"messages": history(2)})
+        clock.now += 61
+        tracker.sweep()
+        clock.now += 3600
+        tracker.sweep()
+        assert os.listdir(tmp_path) == []
+        assert tracker.usage() == []
+
+    def test_no_timeout_keeps_everything(self):
+        """Test that sessions stay in memory without an idle timeout."""
+        tracker, clock = make_tracker(timeout=None)
+        state = {"messages": history(2)}
+        tracker.touch("a", state)
+        clock.now += 10**6
+        assert tracker.sweep() == 0
+        assert "messages" in state
+
+    def test_no_timeout_holds_no_state(self):
+        """Test that closed sessions' state is freed without a timeout."""
+        tracker, clock = make_tracker(timeout=None)
+        state = SessionState(messages=history(2))
+        tracker.touch("a", state)
+        closed = weakref.ref(state)
+        del state
+        gc.collect()
+        assert closed() is None
+        # Still accounted for until unseen for the offload TTL
+        assert tracker.session_usage("a").messages == 2
+        clock.now += tracker.offload_ttl
+        assert tracker.sweep() == 0
+        assert tracker.usage() == []
+
+    def test_running_session_is_not_offloaded(self, tmp_path):
+        """Test that a session stays in memory until its run ends."""
+        tracker, clock = make_tracker(tmp_path)
+        state = {"messages": history(2)}
+        tracker.touch("a", state)
+        tracker.start_run("a")
+        # A long streamed answer outlasts the idle timeout
+        clock.now += 120
+        assert tracker.sweep() == 0
+        assert "messages" in state
+        tracker.end_run("a")
+        assert tracker.sweep() == 0
+        assert tracker.session_usage("a").idle_seconds == 0
+        clock.now += 61
+        assert tracker.sweep() == 1
+        assert "messages" not in state
+
+    def test_pickles_outside_the_lock(self, tmp_path):
+        """Test that other sessions can rerun while state is written out."""
+        tracker, clock = make_tracker(tmp_path)
+        locked = []
+
+        class Probe:
+            """Records whether the tracker lock is held while pickled."""
+
+            def __reduce__(self):
+                locked.append(tracker._lock.locked())
+                return (dict, ())
+
+        tracker.touch("a", {"messages": history(2), "memory": Probe()})
+        clock.now += 61
+        assert tracker.sweep() == 1
+        assert locked == [False]
+
+    def test_session_back_while_pickling_stays(self, tmp_path):
+        """Test that a session returning during the write keeps its state."""
+        tracker, clock = make_tracker(tmp_path)
+        state = {"messages": history(2)}
+
+        class Rerun:
+            """Reruns the session while it is being pickled."""
+
+            def __reduce__(self):
+                clock.now += 1
+                tracker.touch("a", state)
+                return (dict, ())
+
+        state["memory"] = Rerun()
+        tracker.touch("a", state)
+        clock.now += 61
+        assert tracker.sweep() == 0
+        assert "messages" in state
+        assert os.listdir(tmp_path) == []
+
+
+class TestSessionRun:
+    """Test cases for scoping tracked sessions to a script run."""
+
+    def test_session_is_busy_for_the_run(self):
+        """Test that track_session keeps the session until the run ends."""
+        tracker, clock = make_tracker()
+        ctx = Mock(session_id="a", session_state={"messages": history(2)})
+        with patch.object(session_memory, "_tracker", tracker), \
+                patch("src.session_memory.get_script_run_ctx", return_value=ctx):
+            with session_run():
+                track_session()
+                clock.now += 120
+                assert tracker.sweep() == 0
+            clock.now += 61
+            assert tracker.sweep() == 1
+            assert "messages" not in ctx.session_state
+
+    def test_run_ends_when_interrupted(self):
+        """Test that a run stopped by an exception (e.g. a rerun) still ends."""
+        tracker, clock = make_tracker()
+        ctx = Mock(session_id="a", session_state={"messages": history(2)})
+        with patch.object(session_memory, "_tracker", tracker), \
+                patch("src.session_memory.get_script_run_ctx", return_value=ctx):
+            with pytest.raises(KeyboardInterrupt), session_run():
+                track_session()
+                raise KeyboardInterrupt
+            # Outside a run, tracking does not mark the session busy
+            track_session()
+            clock.now += 61
+            assert tracker.sweep() == 1
+
+    def test_offload_keyed_by_runtime_session(self, tmp_path):
+        """Test that another tab with the same URL does not get the state."""
+        tracker, clock = make_tracker(tmp_path)
+        ctx = Mock(session_id="a", session_state={"messages": history(2)})
+        with patch.object(session_memory, "_tracker", tracker), \
+                patch("src.session_memory.get_script_run_ctx", return_value=ctx):
+            track_session()
+            clock.now += 61
+            assert tracker.sweep() == 1
+            ctx.session_id, ctx.session_state = "b", {}
+            assert not track_session()
+            assert ctx.session_state == {}
+            ctx.session_id = "a"
+            assert track_session()
+            assert ctx.session_state["messages"] == history(2)
+
+
+class TestReporting:
+    """Test cases for the reporting helpers."""
+
+    def test_render_cache_bytes(self):
+        """Test that the render cache tracks its size through evictions."""
+        cache = RenderCache(maxsize=2)
+        for text in ("a" * 100, "b" * 200, "c" * 300):
+            cache.get_proto({"role": "user", "content": text})
+        protos = cache._protos.values()
+        assert cache.nbytes == sum(proto.ByteSize() for proto in protos)
+        assert 500 <= cache.nbytes < 600
+
+    def test_format_bytes(self):
+        """Test human-readable sizes."""
+        assert format_bytes(512) == "512 B"
+        assert format_bytes(1536) == "1.5 KiB"
+        assert format_bytes(3 * 1024**3) == "3.0 GiB"
+
+    def test_configured_from_environment(self, tmp_path):
+        """Test reading the idle policy from the environment."""
+        env = {"SESSION_IDLE_TIMEOUT": "900", "SESSION_OFFLOAD_DIR": str(tmp_path)}
+        with patch.dict(os.environ, env), \
+                patch.object(session_memory, "_tracker", None):
+            tracker = get_memory_tracker()
+            assert tracker.idle_timeout == 900
+            assert tracker.offload_dir == str(tmp_path)
+            assert get_memory_tracker() is tracker
+
+
+class TestAppIntegration:
+    """Test cases for the memory panel and offloading in the app."""
+
+    def test_offloaded_session_resumes(self, tmp_path):
+        """Test that an offloaded session gets its history back on return."""
+        tracker, clock = make_tracker(tmp_path)
+        with patch.object(session_memory, "_tracker", tracker), \
+                patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}):
+            app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"))
+            app.run()
+            app.button(key="sample_Tell me a joke").click().run()
+            messages = list(app.session_state.messages)
+            assert tracker.report().in_memory_bytes > 0
+
+            clock.now += 61
+            assert tracker.sweep() == 1
+            assert "messages" not in app.session_state
+
+            app.run()
+
+        assert not app.exception
+        assert app.session_state.messages == messages
+        assert tracker.restored == 1
+        assert any("sessions" in caption.value for caption in app.caption)
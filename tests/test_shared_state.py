@@ -0,0 +1,174 @@
+"""
+Tests for the SQLite-backed shared state store.
+"""
+
+import multiprocessing
+import os
+import pytest
+from unittest.mock import patch
+from src import shared_state
+from src.shared_state import (
+    SESSION_PARAM,
+    SharedStateStore,
+    get_session_id,
+    get_shared_store,
+    make_cache_key,
+)
+
+
+def _append_from_child(path, session_id, count):
+    """Append messages from a separate process."""
+    store = SharedStateStore(path)
+    for i in range(count):
+        store.append_message(session_id, {"role": "user", "content": f"child {i}"})
+    store.close()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Path for a fresh shared database."""
+    return str(tmp_path / "state.sqlite3")
+
+
+class TestSharedStateStore:
+    """Test cases for SharedStateStore."""
+
+    def test_uses_wal_mode(self, db_path):
+        """Test that the database is opened in WAL mode."""
+        store = SharedStateStore(db_path)
+        mode = store._connection().execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+
+    def test_messages_round_trip(self, db_path):
+        """Test appending, loading and clearing a conversation."""
+        store = SharedStateStore(db_path)
+        store.append_message("s1", {"role": "user", "content": "Hi"})
+        store.append_message("s1", {"role": "assistant", "content": "Hello!"})
+        store.append_message("s2", {"role": "user", "content": "Other"})
+
+        assert store.load_messages("s1") == [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello!"},
+        ]
+
+        store.clear_messages("s1")
+        assert store.load_messages("s1") == []
+        assert len(store.load_messages("s2")) == 1
+
+    def test_writes_visible_to_other_connections(self, db_path):
+        """Test that another process's store reads committed writes."""
+        writer = SharedStateStore(db_path)
+        reader = SharedStateStore(db_path)
+
+        writer.append_message("s", {"role": "user", "content": "x"})
+        writer.cache_set("k", "value")
+
+        assert reader.load_messages("s") == [{"role": "user", "content": "x"}]
+        assert reader.cache_get("k") == "value"
+
+    def test_concurrent_processes_append(self, db_path):
+        """Test that appends from several processes are all kept in order."""
+        SharedStateStore(db_path)
+        ctx = multiprocessing.get_context("spawn")
+        workers = [
+            ctx.Process(target=_append_from_child, args=(db_path, "s", 20))
+            for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=30)
+            assert worker.exitcode == 0
+
+        messages = SharedStateStore(db_path).load_messages("s")
+        assert len(messages) == 60
+
+    def test_cache_hits_and_misses(self, db_path):
+        """Test cache lookups and hit rate accounting."""
+        store = SharedStateStore(db_path)
+        assert store.hit_rate() == 0.0
+        assert store.cache_get("k") is None
+        store.cache_set("k", "v")
+        assert store.cache_get("k") == "v"
+        assert store.hits == 1
+        assert store.misses == 1
+        assert store.hit_rate() == 0.5
+
+    def test_cache_ttl(self, db_path):
+        """Test that expired entries are treated as misses."""
+        store = SharedStateStore(db_path, cache_ttl=60)
+        with patch("src.shared_state.time.time", return_value=1000.0):
+            store.cache_set("k", "v")
+        with patch("src.shared_state.time.time", return_value=1030.0):
+            assert store.cache_get("k") == "v"
+        with patch("src.shared_state.time.time", return_value=1061.0):
+            assert store.cache_get("k") is None
+
+    def test_expired_entries_purged_on_write(self, db_path):
+        """Test that writing to the cache deletes expired entries."""
+        store = SharedStateStore(db_path, cache_ttl=60)
+        with patch("src.shared_state.time.time", return_value=1000.0):
+            store.cache_set("old", "v")
+        with patch("src.shared_state.time.time", return_value=1040.0):
+            store.cache_set("recent", "v")
+        with patch("src.shared_state.time.time", return_value=1070.0):
+            store.cache_set("new", "v")
+        rows = store._connection().execute(  # pylint: disable=protected-access
+            "SELECT key FROM response_cache ORDER BY key"
+        ).fetchall()
+        assert [key for (key,) in rows] == ["new", "recent"]
+
+
+class TestHelpers:
+    """Test cases for module helpers."""
+
+    def test_make_cache_key_is_stable(self):
+        """Test that equal inputs give equal keys."""
+        assert make_cache_key("p", 150, 1.0) == make_cache_key("p", 150, 1.0)
+        assert make_cache_key("p", 150, 1.0) != make_cache_key("p", 151, 1.0)
+
+    def test_get_session_id_creates_and_publishes(self):
+        """Test that a new session id is stored and put in the URL."""
+        session_state, query_params = {}, {}
+        session_id = get_session_id(session_state, query_params)
+        assert session_state["session_id"] == session_id
+        assert query_params[SESSION_PARAM] == session_id
+
+    def test_get_session_id_from_url(self, db_path):
+        """Test that a reconnect of the session's owner reuses the URL id."""
+        store = SharedStateStore(db_path)
+        query_params = {}
+        session_id = get_session_id({}, query_params, "user:alice", store)
+        assert store.session_owner(session_id) == "user:alice"
+        session_state = {}
+        assert get_session_id(session_state, query_params, "user:alice", store) == (
+            session_id
+        )
+        assert session_state["session_id"] == session_id
+
+    def test_get_session_id_ignores_foreign_url(self, db_path):
+        """Test that a copied URL does not reuse another user's session."""
+        store = SharedStateStore(db_path)
+        session_id = get_session_id({}, {}, "user:alice", store)
+        for owner in ("user:bob", None):
+            query_params = {SESSION_PARAM: session_id}
+            other = get_session_id({}, query_params, owner, store)
+            assert other != session_id
+            assert query_params[SESSION_PARAM] == other
+        assert store.session_owner(session_id) == "user:alice"
+        assert get_session_id({}, {SESSION_PARAM: "unknown"}) != "unknown"
+
+    def test_get_shared_store_disabled(self):
+        """Test that shared state is off without SHARED_STATE_DB."""
+        with patch.dict(os.environ, {}, clear=True), \
+                patch.object(shared_state, "_store", None):
+            assert get_shared_store() is None
+
+    def test_get_shared_store_enabled(self, db_path):
+        """Test that SHARED_STATE_DB enables a single shared store."""
+        env = {"SHARED_STATE_DB": db_path, "SHARED_STATE_CACHE_TTL": "30"}
+        with patch.dict(os.environ, env), patch.object(shared_state, "_store", None):
+            store = get_shared_store()
+            assert store.path == db_path
+            assert store.cache_ttl == 30.0
+            assert get_shared_store() is store
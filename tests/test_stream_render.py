@@ -0,0 +1,133 @@
+"""
+Tests for frame-rate-limited stream rendering.
+"""
+
+import os
+from unittest.mock import Mock, patch
+from streamlit.testing.v1 import AppTest
+from benchmarks.load_test import chat_input_files
+from benchmarks.mock_server import MockCompletionServer
+from src import stream_render
+from src.stream_render import (
+    DEFAULT_FPS,
+    StreamRenderer,
+    StreamRenderStats,
+    get_stream_render_stats,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def stream_words(renderer, clock, count, seconds_per_word):
+    """Feed a renderer one word at a time; return the final text."""
+    text = ""
+    for i in range(count):
+        text += f"w{i} "
+        renderer.update(text)
+        clock.now += seconds_per_word
+    return text
+
+
+class TestStreamRenderer:
+    """Test cases for StreamRenderer."""
+
+    def test_frames_are_rate_limited(self):
+        """Test that a fast stream is drawn at most fps times per second."""
+        clock = FakeClock()
+        placeholder = Mock()
+        renderer = StreamRenderer(placeholder, fps=10, max_chars=10_000, clock=clock)
+        # 200 words over two seconds
+        text = stream_words(renderer, clock, 200, 0.01)
+        assert renderer.deltas == 200
+        assert renderer.frames == 20
+        assert placeholder.markdown.call_args.args[0].endswith("▌")
+
+        renderer.finish(text)
+        assert renderer.frames == 21
+        placeholder.markdown.assert_called_with(text)
+
+    def test_first_delta_is_drawn_at_once(self):
+        """Test that the first token appears without waiting for a frame."""
+        renderer = StreamRenderer(Mock(), fps=1, clock=FakeClock())
+        assert renderer.update("Hello")
+        assert not renderer.update("Hello there")
+
+    def test_character_threshold_forces_a_frame(self):
+        """Test that a large burst of text is drawn before the next frame."""
+        clock = FakeClock()
+        renderer = StreamRenderer(Mock(), fps=1, max_chars=100, clock=clock)
+        renderer.update("x")
+        assert not renderer.update("x" * 100)
+        assert renderer.update("x" * 101)
+
+    def test_zero_fps_draws_every_delta(self):
+        """Test that the limit can be turned off."""
+        clock = FakeClock()
+        renderer = StreamRenderer(Mock(), fps=0, clock=clock)
+        stream_words(renderer, clock, 50, 0.001)
+        assert renderer.frames == 50
+
+    def test_defaults_from_environment(self):
+        """Test reading the frame rate and threshold from the environment."""
+        env = {"STREAM_RENDER_FPS": "4", "STREAM_RENDER_MAX_CHARS": "64"}
+        with patch.dict(os.environ, env):
+            renderer = StreamRenderer(Mock())
+        assert (renderer.interval, renderer.max_chars) == (0.25, 64)
+        with patch.dict(os.environ, {}, clear=True):
+            assert StreamRenderer(Mock()).interval == 1 / DEFAULT_FPS
+
+    def test_finish_records_stats_once(self):
+        """Test the per-response totals."""
+        clock = FakeClock()
+        with patch.object(stream_render, "_stats", StreamRenderStats()):
+            renderer = StreamRenderer(Mock(), fps=10, clock=clock)
+            text = stream_words(renderer, clock, 30, 0.01)
+            renderer.finish(text)
+            renderer.finish(text)
+            stats = get_stream_render_stats()
+        assert (stats.responses, stats.deltas, stats.frames) == (1, 30, 4)
+        assert stats.frames_per_response == 4
+
+    def test_finish_redraws_changed_text(self):
+        """Test that a later, longer final text is still drawn."""
+        placeholder = Mock()
+        renderer = StreamRenderer(placeholder, fps=0)
+        renderer.finish("partial")
+        renderer.finish("partial")
+        renderer.finish("partial answer")
+        assert [call.args[0] for call in placeholder.markdown.call_args_list] == [
+            "partial", "partial answer"
+        ]
+
+
+class TestChatStreaming:
+    """Test cases for streaming into the chat app."""
+
+    def test_answer_is_drawn_in_few_frames(self):
+        """Test that a streamed answer sends far fewer updates than tokens."""
+        answer = " ".join(f"word{i}" for i in range(100))
+        env = {"OPENAI_API_KEY": "sk-test", "STREAM_RENDER_FPS": "5"}
+        with MockCompletionServer(chunk_delay=0.005, answer=answer) as server, \
+                patch.dict(os.environ, {**env, "OPENAI_BASE_URL": server.base_url}), \
+                patch.object(stream_render, "_stats", StreamRenderStats()), \
+                chat_input_files():
+            app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"))
+            app.run()
+            app.chat_input[0].set_value("Tell me a story").run(timeout=10)
+            stats = get_stream_render_stats()
+
+        assert not app.exception
+        assert app.session_state.messages[-1]["content"] == answer
+        assert stats.responses == 1
+        assert stats.deltas >= 100
+        assert stats.frames <= 10
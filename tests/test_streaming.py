@@ -0,0 +1,206 @@
+"""
+Tests for cancellable streamed completions.
+"""
+
+import os
+import threading
+import time
+import pytest
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+import streamlit as st
+from openai import OpenAI
+from streamlit.testing.v1 import AppTest
+from benchmarks.load_test import chat_input_files
+from benchmarks.mock_server import MockCompletionServer
+from src.streaming import CancellableStream, budgeted_stream
+from src.token_budget import CONTINUE_PROMPT, CompletionLengthPredictor, TokenRateLimiter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def chunk(content=None, finish_reason=None):
+    """Build a streamed chunk with one choice."""
+    choice = SimpleNamespace(
+        delta=SimpleNamespace(content=content), finish_reason=finish_reason
+    )
+    return SimpleNamespace(choices=[choice], usage=None)
+
+
+def usage_chunk(completion_tokens, prompt_tokens=10):
+    """Build the final usage-only chunk."""
+    usage = SimpleNamespace(completion_tokens=completion_tokens, prompt_tokens=prompt_tokens)
+    return SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeStream:
+    """Iterable stand-in for openai.Stream that records close()."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class TestCancellableStream:
+    """Test cases for CancellableStream."""
+
+    def test_streams_full_answer(self):
+        """Test that deltas are yielded and the answer completes."""
+        response = FakeStream([chunk("Hel"), chunk("lo"), chunk(None, "stop"), usage_chunk(2)])
+        client = Mock()
+        client.chat.completions.create.return_value = response
+        on_close = Mock()
+
+        stream = CancellableStream(client, [], 100, on_close=on_close, model="m")
+        deltas = list(stream)
+
+        assert deltas == ["Hel", "lo"]
+        assert stream.text == "Hello"
+        assert stream.finished and not stream.cancelled
+        assert stream.completion_tokens == 2
+        assert response.closed
+        on_close.assert_called_once_with(stream)
+        kwargs = client.chat.completions.create.call_args[1]
+        assert kwargs["stream"] is True
+        assert kwargs["model"] == "m"
+
+    def test_continues_truncated_answer(self):
+        """Test that an answer cut off by max_tokens is continued."""
+        client = Mock()
+        client.chat.completions.create.side_effect = [
+            FakeStream([chunk("Part one, "), chunk(None, "length"), usage_chunk(50)]),
+            FakeStream([chunk("part two."), chunk(None, "stop"), usage_chunk(20)]),
+        ]
+
+        stream = CancellableStream(client, [{"role": "user", "content": "x"}], 50, ceiling=500)
+
+        assert "".join(stream) == "Part one, part two."
+        assert stream.continuations == 1
+        messages = client.chat.completions.create.call_args[1]["messages"]
+        assert messages[-2] == {"role": "assistant", "content": "Part one, "}
+        assert messages[-1]["content"] == CONTINUE_PROMPT
+
+    def test_close_mid_stream_keeps_partial_text(self):
+        """Test that leaving the with-block early cancels and closes."""
+        response = FakeStream([chunk("a"), chunk("b"), chunk("c"), chunk(None, "stop")])
+        client = Mock()
+        client.chat.completions.create.return_value = response
+
+        with pytest.raises(KeyboardInterrupt):
+            with CancellableStream(client, [], 100) as stream:
+                for delta in stream:
+                    if delta == "b":
+                        raise KeyboardInterrupt
+
+        assert stream.text == "ab"
+        assert stream.cancelled
+        assert stream.closed
+        assert response.closed
+        # Without usage data the generated tokens are estimated
+        assert stream.completion_tokens == 1
+
+    def test_cancel_before_start(self):
+        """Test that a cancelled stream never yields."""
+        client = Mock()
+        stream = CancellableStream(client, [], 100)
+        stream.cancel()
+        assert list(stream) == []
+        client.chat.completions.create.assert_not_called()
+
+    def test_cancel_aborts_http_stream(self):
+        """Test that cancel() from another thread stops a real HTTP stream."""
+        answer = " ".join(f"w{i}" for i in range(500))
+        with MockCompletionServer(chunk_delay=0.01, answer=answer) as server:
+            client = OpenAI(api_key="sk-test", base_url=server.base_url)
+            stream = CancellableStream(
+                client, [{"role": "user", "content": "x"}], 1000, model="m"
+            )
+            started = time.perf_counter()
+            deltas = []
+            for delta in stream:
+                if not deltas:
+                    # Timed from the first delta, past the client's cold start
+                    threading.Timer(0.2, stream.cancel).start()
+                deltas.append(delta)
+            elapsed = time.perf_counter() - started
+
+        assert stream.cancelled
+        assert 0 < len(deltas) < 500
+        # The full answer would take five seconds
+        assert elapsed < 2
+
+
+class TestBudgetedStream:
+    """Test cases for budgeted streams."""
+
+    def test_cancel_releases_reservation_immediately(self):
+        """Test that cancelling returns the unused token budget."""
+        client = Mock()
+        client.chat.completions.create.return_value = FakeStream(
+            [chunk("word ") for _ in range(100)]
+        )
+        limiter = TokenRateLimiter(10000)
+        predictor = CompletionLengthPredictor()
+
+        stream = budgeted_stream(client, [], "c", 1000, predictor=predictor, limiter=limiter)
+        assert limiter.in_flight == 1
+        assert limiter.available < 10000 - 999
+
+        with stream:
+            for i, _ in enumerate(stream):
+                if i == 3:
+                    break
+
+        assert limiter.in_flight == 0
+        # Only the four streamed words (about five tokens) stay reserved
+        assert 10000 - 10 < limiter.available < 10000
+        # Cancelled answers are not learned from
+        assert predictor.sample_count("c") == 0
+
+    def test_finished_stream_is_recorded(self):
+        """Test that completed answers feed the predictor."""
+        client = Mock()
+        client.chat.completions.create.return_value = FakeStream(
+            [chunk("ok"), chunk(None, "stop"), usage_chunk(42)]
+        )
+        predictor = CompletionLengthPredictor()
+
+        stream = budgeted_stream(client, [], "c", 1000, predictor=predictor, limiter=None)
+        list(stream)
+
+        assert predictor.sample_count("c") == 1
+
+
+@contextmanager
+def stopped_spinner(*args, **kwargs):
+    """Spinner whose closing delta lands on a Stop click, like a rerun."""
+    yield
+    st.stop()
+
+
+class TestChatApp:
+    """Test cases for streaming in chatgpt_clone."""
+
+    def test_stop_before_streaming_releases_reservation(self):
+        """Test that Stop while the request waits returns its reservation."""
+        limiter = TokenRateLimiter(10000)
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}), \
+                patch("src.scheduler.limiter_for", return_value=limiter), \
+                patch.object(st, "spinner", stopped_spinner), \
+                chat_input_files():
+            app = AppTest.from_file(os.path.join(ROOT, "chatgpt_clone.py"))
+            app.run()
+            app.chat_input[0].set_value("Tell me a story").run()
+
+        assert not app.exception
+        assert limiter.in_flight == 0
+        # The 1000 reserved completion tokens are back; the prompt estimate
+        # is charged as for any closed stream
+        assert limiter.available > 10000 - 100
@@ -0,0 +1,309 @@
+"""
+Tests for adaptive completion budgeting.
+"""
+
+import asyncio
+import os
+import pytest
+from unittest.mock import Mock, patch
+from src import token_budget
+from src.token_budget import (
+    CONTINUE_PROMPT,
+    CompletionLengthPredictor,
+    TokenRateLimiter,
+    budgeted_completion,
+    create_with_continuation,
+    estimate_prompt_tokens,
+    estimate_tokens,
+    get_rate_limiter,
+)
+
+
+def make_response(content, finish_reason="stop", completion_tokens=None, prompt_tokens=None):
+    """Build a mock chat completion response."""
+    choice = Mock()
+    choice.message.content = content
+    choice.finish_reason = finish_reason
+    response = Mock()
+    response.choices = [choice]
+    response.usage.completion_tokens = completion_tokens
+    response.usage.prompt_tokens = prompt_tokens
+    return response
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEstimates:
+    """Test cases for token estimates."""
+
+    def test_estimate_tokens(self):
+        """Test the character based estimate."""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("hi") == 1
+        assert estimate_tokens("a" * 40) == 10
+
+    def test_estimate_prompt_tokens_includes_overhead(self):
+        """Test that every message adds framing overhead."""
+        messages = [{"role": "user", "content": "a" * 8}, {"role": "assistant", "content": ""}]
+        assert estimate_prompt_tokens(messages) == 2 + 4 + 4
+
+
+class TestCompletionLengthPredictor:
+    """Test cases for the completion length predictor."""
+
+    def test_cold_start_returns_ceiling(self):
+        """Test that classes without enough samples use the ceiling."""
+        predictor = CompletionLengthPredictor(min_samples=5)
+        for _ in range(4):
+            predictor.record("c", 50)
+        assert predictor.predict("c", 1000) == 1000
+
+    def test_predicts_percentile_with_headroom(self):
+        """Test prediction from recorded samples."""
+        predictor = CompletionLengthPredictor(percentile=90, min_samples=10, headroom=1.5, floor=1)
+        for tokens in range(10, 110, 10):
+            predictor.record("c", tokens)
+        # 90th percentile of 10..100 is 90, times 1.5 headroom
+        assert predictor.predict("c", 1000) == 135
+        assert predictor.predict("c", 100) == 100
+
+    def test_floor_applies(self):
+        """Test that tiny predictions are raised to the floor."""
+        predictor = CompletionLengthPredictor(min_samples=1, floor=64)
+        predictor.record("c", 3)
+        assert predictor.predict("c", 1000) == 64
+        assert predictor.predict("c", 32) == 32
+
+    def test_record_ignores_non_integers(self):
+        """Test that missing usage data is not recorded."""
+        predictor = CompletionLengthPredictor()
+        predictor.record("c", Mock())
+        predictor.record("c", None)
+        predictor.record("c", 0)
+        assert predictor.sample_count("c") == 0
+
+    def test_window_is_bounded(self):
+        """Test that only recent samples are kept."""
+        predictor = CompletionLengthPredictor(window=3)
+        for _ in range(10):
+            predictor.record("c", 10)
+        assert predictor.sample_count("c") == 3
+
+    def test_invalid_percentile(self):
+        """Test that out of range percentiles are rejected."""
+        with pytest.raises(ValueError):
+            CompletionLengthPredictor(percentile=0)
+
+    def test_classify(self):
+        """Test prompt classification."""
+        classify = CompletionLengthPredictor.classify
+        assert classify("Tell me a joke").startswith("chat:short:")
+        assert classify("Write a Python function", app="x").startswith("x:code:")
+        assert classify("Explain quantum computing").startswith("chat:long:")
+        assert classify("Hello").startswith("chat:general:")
+        assert classify("a" * 4000).endswith(":1024")
+
+
+class TestTokenRateLimiter:
+    """Test cases for the token rate limiter."""
+
+    def test_try_acquire_and_refund(self):
+        """Test that unused tokens are returned on release."""
+        limiter = TokenRateLimiter(1000, clock=FakeClock())
+        reservation = limiter.try_acquire(800)
+        assert reservation is not None
+        assert limiter.in_flight == 1
+        assert limiter.try_acquire(300) is None
+
+        limiter.release(reservation, used_tokens=100)
+        assert limiter.available == 900
+        assert limiter.in_flight == 0
+
+        # Releasing twice is harmless
+        limiter.release(reservation, used_tokens=0)
+        assert limiter.available == 900
+
+    def test_smaller_reservations_admit_more_requests(self):
+        """Test that predicted budgets admit more concurrent requests."""
+        limiter = TokenRateLimiter(10000, clock=FakeClock())
+        fixed = [limiter.try_acquire(1100) for _ in range(20)]
+        assert sum(r is not None for r in fixed) == 9
+
+        limiter = TokenRateLimiter(10000, clock=FakeClock())
+        predicted = [limiter.try_acquire(300) for _ in range(40)]
+        assert sum(r is not None for r in predicted) == 33
+
+    def test_refill_over_time(self):
+        """Test that the bucket refills at tokens_per_minute / 60 per second."""
+        clock = FakeClock()
+        limiter = TokenRateLimiter(600, clock=clock)
+        limiter.try_acquire(600)
+        clock.now = 5.0
+        assert limiter.available == pytest.approx(50)
+
+    def test_acquire_timeout(self):
+        """Test that acquire gives up after the timeout."""
+        limiter = TokenRateLimiter(60)
+        limiter.try_acquire(60)
+        with pytest.raises(TimeoutError):
+            limiter.acquire(60, timeout=0.01)
+
+    def test_invalid_rate(self):
+        """Test that a non-positive rate is rejected."""
+        with pytest.raises(ValueError):
+            TokenRateLimiter(0)
+
+    def test_acquire_async_waits_for_refill(self):
+        """Test that coroutines wait on the event loop for tokens to refill."""
+        limiter = TokenRateLimiter(6000)
+        limiter.try_acquire(6000)
+
+        async def acquire():
+            return await limiter.acquire_async(50, timeout=2)
+
+        assert asyncio.run(acquire()).tokens == 50
+        with pytest.raises(TimeoutError):
+            asyncio.run(limiter.acquire_async(6000, timeout=0.01))
+
+    def test_overuse_is_debited(self):
+        """Test that tokens used beyond the reservation are taken from the bucket."""
+        limiter = TokenRateLimiter(600, clock=FakeClock())
+        limiter.release(limiter.try_acquire(100), 250)
+        assert limiter.available == 350
+        assert limiter.try_acquire(400) is None
+
+    @pytest.mark.parametrize("value", ["lots", "-5", "1.5"])
+    def test_malformed_environment_value(self, value):
+        """Test that a bad OPENAI_TOKENS_PER_MINUTE is a clear configuration error."""
+        with patch.dict(os.environ, {"OPENAI_TOKENS_PER_MINUTE": value}), \
+                patch.object(token_budget, "_limiter", None):
+            with pytest.raises(ValueError, match="OPENAI_TOKENS_PER_MINUTE"):
+                get_rate_limiter()
+
+    def test_configured_from_environment(self):
+        """Test building the shared limiter from OPENAI_TOKENS_PER_MINUTE."""
+        with patch.dict(os.environ, {"OPENAI_TOKENS_PER_MINUTE": "9000"}), \
+                patch.object(token_budget, "_limiter", None):
+            assert get_rate_limiter().capacity == 9000
+
+
+class TestCreateWithContinuation:
+    """Test cases for continued completions."""
+
+    def test_single_request(self):
+        """Test a response that finishes normally."""
+        client = Mock()
+        client.chat.completions.create.return_value = make_response("Hi", completion_tokens=2)
+
+        result = create_with_continuation(client, [{"role": "user", "content": "x"}], 100)
+
+        assert result.content == "Hi"
+        assert result.completion_tokens == 2
+        assert result.continuations == 0
+        client.chat.completions.create.assert_called_once()
+
+    def test_continues_truncated_response(self):
+        """Test that a response hitting max_tokens is continued."""
+        client = Mock()
+        client.chat.completions.create.side_effect = [
+            make_response("Part one, ", "length", completion_tokens=50),
+            make_response("part two.", "stop", completion_tokens=20),
+        ]
+        messages = [{"role": "user", "content": "Tell me a story"}]
+
+        result = create_with_continuation(client, messages, 50, ceiling=1000, model="m")
+
+        assert result.content == "Part one, part two."
+        assert result.completion_tokens == 70
+        assert result.continuations == 1
+        assert result.finish_reason == "stop"
+        second = client.chat.completions.create.call_args_list[1][1]
+        assert second["model"] == "m"
+        assert second["messages"][-2] == {"role": "assistant", "content": "Part one, "}
+        assert second["messages"][-1] == {"role": "user", "content": CONTINUE_PROMPT}
+        # The caller's message list is untouched
+        assert len(messages) == 1
+
+    def test_continuation_respects_ceiling(self):
+        """Test that continuations stop once the ceiling is used up."""
+        client = Mock()
+        client.chat.completions.create.side_effect = [
+            make_response("a", "length", completion_tokens=60),
+            make_response("b", "length", completion_tokens=40),
+            make_response("c", "stop", completion_tokens=10),
+        ]
+
+        result = create_with_continuation(client, [], 60, ceiling=100)
+
+        assert result.content == "ab"
+        assert client.chat.completions.create.call_args_list[1][1]["max_tokens"] == 40
+        assert client.chat.completions.create.call_count == 2
+
+
+class TestBudgetedCompletion:
+    """Test cases for budgeted completions."""
+
+    def test_uses_prediction_and_records(self):
+        """Test that the predicted budget is requested and the result learned."""
+        predictor = CompletionLengthPredictor(min_samples=1, headroom=1.0, floor=1)
+        predictor.record("c", 120)
+        client = Mock()
+        client.chat.completions.create.return_value = make_response(
+            "ok", completion_tokens=80, prompt_tokens=10
+        )
+        limiter = TokenRateLimiter(10000, clock=FakeClock())
+
+        result = budgeted_completion(
+            client, [{"role": "user", "content": "x"}], "c", 1000,
+            predictor=predictor, limiter=limiter
+        )
+
+        assert result.content == "ok"
+        assert client.chat.completions.create.call_args[1]["max_tokens"] == 120
+        assert predictor.sample_count("c") == 2
+        assert limiter.in_flight == 0
+        assert limiter.available == 10000 - 90
+
+    def test_continuations_are_reserved(self):
+        """Test that each continuation reserves and settles its own tokens."""
+        client = Mock()
+        client.chat.completions.create.side_effect = [
+            make_response("a" * 400, "length", completion_tokens=100, prompt_tokens=10),
+            make_response("b", "stop", completion_tokens=60, prompt_tokens=120),
+        ]
+        predictor = CompletionLengthPredictor(min_samples=1, headroom=1.0, floor=1)
+        predictor.record("c", 100)
+        limiter = TokenRateLimiter(10000, clock=FakeClock())
+        acquire = Mock(wraps=limiter.acquire)
+
+        with patch.object(limiter, "acquire", acquire):
+            result = budgeted_completion(
+                client, [{"role": "user", "content": "x"}], "c", 1000,
+                predictor=predictor, limiter=limiter
+            )
+
+        assert result.continuations == 1
+        assert acquire.call_count == 2
+        # The continuation's prompt includes the first part of the answer
+        assert acquire.call_args_list[1].args[0] > 100 + 100
+        assert limiter.in_flight == 0
+        assert limiter.available == 10000 - (10 + 100) - (120 + 60)
+
+    def test_releases_reservation_on_error(self):
+        """Test that a failed request frees its reservation."""
+        client = Mock()
+        client.chat.completions.create.side_effect = RuntimeError("boom")
+        limiter = TokenRateLimiter(10000, clock=FakeClock())
+
+        with pytest.raises(RuntimeError):
+            budgeted_completion(client, [], "c", 500, limiter=limiter)
+
+        assert limiter.in_flight == 0
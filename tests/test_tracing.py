@@ -0,0 +1,201 @@
+"""
+Tests for span-based tracing.
+"""
+
+import glob
+import json
+import os
+import threading
+import pytest
+from unittest.mock import patch
+from streamlit.testing.v1 import AppTest
+from src import http_replay, tracing
+from src.tracing import Tracer, get_tracer, read_events, set_session, span, traced
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, "tests", "fixtures", "hello.jsonl")
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    """Enable tracing into a temporary file."""
+    instance = Tracer(str(tmp_path / "trace.json"))
+    with patch.object(tracing, "_tracer", instance), \
+            patch.object(tracing, "_configured", True):
+        yield instance
+    instance.close()
+
+
+class TestSpans:
+    """Test cases for recording spans."""
+
+    def test_disabled_spans_are_shared_noops(self):
+        """Test that disabled tracing allocates nothing per span."""
+        with patch.object(tracing, "_tracer", None), \
+                patch.object(tracing, "_configured", True):
+            first = span("a", x=1)
+            with first as active:
+                active.set(y=2)
+            assert span("b") is first
+
+    def test_nested_spans_in_chrome_format(self, tracer):
+        """Test that spans become complete events a trace viewer can load."""
+        with span("rerun", app="test") as root:
+            set_session("s1")
+            with span("child"):
+                pass
+            root.set(messages=3)
+        tracer.close()
+
+        raw = open(tracer.path, encoding="utf-8").read()
+        assert raw.startswith("[\n")
+        # The closing bracket is optional for viewers; adding it yields valid JSON
+        events = json.loads(raw.rstrip(",\n") + "]")
+        assert events == read_events(tracer.path)
+        child, parent = events
+        assert (child["name"], parent["name"]) == ("child", "rerun")
+        assert all(event["ph"] == "X" for event in events)
+        assert parent["ts"] <= child["ts"]
+        assert child["ts"] + child["dur"] <= parent["ts"] + parent["dur"] + 1
+        assert parent["args"] == {"app": "test", "messages": 3, "session": "s1"}
+        assert child["args"]["session"] == "s1"
+
+    def test_session_is_scoped_to_root_span(self, tracer):
+        """Test that the next trace in the same thread starts untagged."""
+        with span("first"):
+            set_session("s1")
+        with span("second"):
+            pass
+        first, second = read_events(tracer.path)
+        assert first["args"]["session"] == "s1"
+        assert "session" not in second["args"]
+
+    def test_exceptions_are_recorded(self, tracer):
+        """Test that a failing span records the exception type."""
+        with pytest.raises(KeyError):
+            with span("lookup"):
+                raise KeyError("x")
+        assert read_events(tracer.path)[0]["args"]["exception"] == "KeyError"
+
+    def test_traced_decorator(self, tracer):
+        """Test that decorated calls are recorded."""
+
+        @traced()
+        def work(value):
+            return value * 2
+
+        assert work(21) == 42
+        assert read_events(tracer.path)[0]["name"].endswith("work")
+
+
+class TestSampling:
+    """Test cases for trace sampling."""
+
+    def test_unsampled_trace_records_nothing(self, tracer):
+        """Test that children follow the root's sampling decision."""
+        tracer.sample_rate = 0.0
+        with span("rerun"):
+            with span("child"):
+                pass
+        tracer.sample_rate = 1.0
+        with span("sampled"):
+            pass
+        assert [event["name"] for event in read_events(tracer.path)] == ["sampled"]
+
+    def test_sample_rate(self, tracer):
+        """Test that roots are sampled at the configured rate."""
+        tracer.sample_rate = 0.5
+        with patch("src.tracing.random.random", side_effect=[0.2, 0.7, 0.4]):
+            for name in ("a", "b", "c"):
+                with span(name):
+                    pass
+        assert [event["name"] for event in read_events(tracer.path)] == ["a", "c"]
+
+
+class TestTracer:
+    """Test cases for the trace file and configuration."""
+
+    def test_rotation_starts_new_array(self, tmp_path):
+        """Test that rotated files stay loadable."""
+        path = str(tmp_path / "trace.json")
+        tracer = Tracer(path, max_bytes=2000, backups=2)
+        for i in range(50):
+            tracer.emit({"name": f"span{i}", "ph": "X", "ts": i, "dur": 1})
+        tracer.close()
+
+        assert os.path.exists(path + ".1")
+        for name in (path, path + ".1"):
+            assert open(name, encoding="utf-8").read().startswith("[\n")
+            assert read_events(name)
+
+    def test_concurrent_emits_across_rotation(self, tmp_path, capsys):
+        """Test that threads writing while the file rotates lose no events."""
+        path = str(tmp_path / "trace.json")
+        tracer = Tracer(path, max_bytes=20000, backups=1000)
+
+        def write(thread):
+            for i in range(500):
+                tracer.emit({"name": f"t{thread}-{i}", "ph": "X", "ts": i, "dur": 1})
+
+        threads = [threading.Thread(target=write, args=(t,)) for t in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tracer.close()
+
+        names = [
+            event["name"]
+            for name in glob.glob(path + "*")
+            for event in read_events(name)
+        ]
+        assert len(glob.glob(path + "*")) > 2
+        assert len(names) == len(set(names)) == 8 * 500
+        assert "Logging error" not in capsys.readouterr().err
+
+    @patch.dict(os.environ, {"TRACE_FILE": "", "TRACE_SAMPLE_RATE": "0.1"})
+    @patch.object(tracing, "_tracer", None)
+    @patch.object(tracing, "_configured", False)
+    def test_disabled_without_trace_file(self):
+        """Test that tracing is off unless TRACE_FILE is set."""
+        assert get_tracer() is None
+
+    @patch.object(tracing, "_tracer", None)
+    @patch.object(tracing, "_configured", False)
+    def test_configured_from_env(self, tmp_path):
+        """Test TRACE_FILE and TRACE_SAMPLE_RATE."""
+        path = str(tmp_path / "env.json")
+        with patch.dict(os.environ, {"TRACE_FILE": path, "TRACE_SAMPLE_RATE": "0.25"}):
+            tracer = get_tracer()
+        assert tracer.path == path and tracer.sample_rate == 0.25
+        assert get_tracer() is tracer
+        tracer.close()
+
+
+class TestAppTracing:
+    """Test cases for the instrumented apps."""
+
+    @patch.dict(
+        os.environ,
+        {
+            "OPENAI_API_KEY": "sk-test",
+            "OPENAI_REPLAY_FIXTURE": FIXTURE,
+            "OPENAI_REPLAY_TIME_SCALE": "0",
+            "OPENAI_REPLAY_MATCH": "path",
+        },
+    )
+    @patch.object(http_replay, "_env_transport", None)
+    def test_streamlit_app_phases(self, tracer):
+        """Test that a chat turn records every phase with the session id."""
+        app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"))
+        app.run()
+        app.chat_input[0].set_value("Hello! How are you?").run()
+        assert not app.exception
+
+        events = read_events(tracer.path)
+        names = [event["name"] for event in events]
+        assert names.count("rerun") == 2
+        phases = ("render_history", "get_ai_response", "api_call", "render_response")
+        assert all(name in names for name in phases)
+        session = app.session_state.session_id
+        assert all(event["args"]["session"] == session for event in events)